@@ -0,0 +1,427 @@
+"""
+Approximate nearest-neighbor index (IVF / IVF-PQ) for embedding search
+
+Vectors are L2-normalized so inner product equals cosine similarity. The index
+partitions vectors into `nlist` k-means cells and only scans the `nprobe` cells
+closest to the query. With `pq_m > 0` each vector is additionally compressed
+into `pq_m` one-byte product-quantization codes of its residual.
+
+Vectors added after training go to their nearest existing cell without retraining;
+`drifted()` tells when enough has changed that the index should be built again.
+
+Run `python app/ann_index.py --help` for the recall-versus-brute-force benchmark.
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+DRIFT_SIZE_RATIO = 2.0  # Retrain once the index has grown or shrunk by this factor since training
+DRIFT_ERROR_RATIO = 1.5  # ... or once added vectors sit this much farther from their cells than trained ones
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows (or a single vector) as float32"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 20, seed: int = 0,
+           max_training_points: int = 256) -> np.ndarray:
+    """Lloyd's k-means on a random sample of at most max_training_points per centroid"""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    k = max(1, min(k, n))
+    sample_size = min(n, k * max_training_points)
+    sample = vectors[rng.choice(n, sample_size, replace=False)] if sample_size < n else vectors
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+
+    sample_sq = (sample ** 2).sum(axis=1)
+    for _ in range(iterations):
+        distances = sample_sq[:, None] - 2 * sample @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+        assignment = distances.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Reseed empty cells from random points so every list stays usable
+        if empty.any():
+            centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+    return centroids.astype(np.float32)
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+    """Nearest centroid (L2) for each vector, in batches to bound memory"""
+    centroid_sq = (centroids ** 2).sum(axis=1)
+    result = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        result[start:start + batch_size] = (centroid_sq[None, :] - 2 * batch @ centroids.T).argmin(axis=1)
+    return result
+
+
+class IVFIndex:
+    """Inverted-file index over normalized embeddings, optionally product-quantized"""
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 8, pq_m: int = 0, seed: int = 0):
+        """
+        Args:
+            nlist: Number of k-means cells (default: about sqrt(n))
+            nprobe: Cells scanned per query; higher means better recall and slower queries
+            pq_m: Product-quantization subvectors per embedding (0 keeps full float32 vectors)
+            seed: Random seed for k-means training
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.seed = seed
+
+        self.dim = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.offsets: Optional[np.ndarray] = None  # list i spans data[offsets[i]:offsets[i + 1]]
+        self.data: Optional[np.ndarray] = None  # float32 vectors or uint8 PQ codes, grouped by list
+        self.keys: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None  # (pq_m, 256, dim / pq_m)
+        self.ksub = 0  # Trained rows of each codebook
+
+        # Drift since training: vectors trained on and their mean squared distance to their
+        # centroid, and the same for vectors added afterwards
+        self.trained = 0
+        self.train_error: Optional[float] = None
+        self.added = 0
+        self.added_error = 0.0
+
+    def __len__(self) -> int:
+        return 0 if self.keys is None else len(self.keys)
+
+    def build(self, vectors: np.ndarray, keys: Sequence[str]):
+        """Train cells (and PQ codebooks) and add all vectors"""
+        vectors = normalize(vectors)
+        n, self.dim = vectors.shape
+        if self.pq_m and self.dim % self.pq_m:
+            raise ValueError(f"pq_m={self.pq_m} must divide the embedding dimension {self.dim}")
+
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        started = time.perf_counter()
+        self.centroids = kmeans(vectors, nlist, seed=self.seed)
+        self.nlist = len(self.centroids)
+        lists = assign(vectors, self.centroids)
+
+        order = np.argsort(lists, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.nlist))]).astype(np.int64)
+        self.keys = np.asarray(keys)[order]
+
+        residuals = vectors[order] - self.centroids[lists[order]]
+        if self.pq_m:
+            self.codebooks, self.data = self._train_pq(residuals)
+        else:
+            self.data = vectors[order]
+        self.trained = n
+        self.train_error = float((residuals ** 2).sum(axis=1).mean())
+        self.added = 0
+        self.added_error = 0.0
+
+        logger.info(f"Built IVF index: {n} vectors, {self.nlist} lists, pq_m={self.pq_m} "
+                    f"in {time.perf_counter() - started:.1f}s")
+
+    def _train_pq(self, residuals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        sub_dim = self.dim // self.pq_m
+        self.ksub = min(256, len(residuals))
+        codebooks = np.zeros((self.pq_m, 256, sub_dim), dtype=np.float32)
+        for m in range(self.pq_m):
+            sub = np.ascontiguousarray(residuals[:, m * sub_dim:(m + 1) * sub_dim])
+            codebooks[m, :self.ksub] = kmeans(sub, self.ksub, iterations=15, seed=self.seed + m)
+        return codebooks, self._encode_pq(residuals, codebooks)
+
+    def _encode_pq(self, residuals: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+        sub_dim = self.dim // self.pq_m
+        codes = np.empty((len(residuals), self.pq_m), dtype=np.uint8)
+        for m in range(self.pq_m):
+            sub = np.ascontiguousarray(residuals[:, m * sub_dim:(m + 1) * sub_dim])
+            codes[:, m] = assign(sub, codebooks[m, :self.ksub])
+        return codes
+
+    def _regroup(self, lists: np.ndarray, data: np.ndarray, keys: np.ndarray):
+        """Replace the contents with rows in any order, given the list of each row"""
+        order = np.argsort(lists, kind='stable')
+        # New arrays rather than in-place edits, so a copy of the index made before is untouched
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.nlist))]).astype(np.int64)
+        self.data = data[order]
+        self.keys = keys[order]
+
+    def _lists(self) -> np.ndarray:
+        return np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+
+    def add(self, vectors: np.ndarray, keys: Sequence[str]):
+        """Add vectors to their nearest trained cells (and PQ-encode them) without retraining"""
+        if self.centroids is None:
+            raise ValueError("The index must be built before vectors are added")
+        if not len(vectors):
+            return
+        vectors = normalize(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        lists = assign(vectors, self.centroids)
+        residuals = vectors - self.centroids[lists]
+        data = self._encode_pq(residuals, self.codebooks) if self.pq_m else vectors
+        # Concatenating widens the key strings if the new ones are longer
+        self._regroup(np.concatenate([self._lists(), lists]), np.concatenate([self.data, data]),
+                      np.concatenate([self.keys, np.asarray(keys)]))
+        self.added += len(vectors)
+        self.added_error += float((residuals ** 2).sum())
+
+    def remove(self, keys: Sequence[str]) -> int:
+        """Drop vectors by key; returns how many were in the index"""
+        if not len(self) or not len(keys):
+            return 0
+        keep = ~np.isin(self.keys, np.asarray(list(keys)))
+        removed = int(len(keep) - keep.sum())
+        if removed:
+            self._regroup(self._lists()[keep], self.data[keep], self.keys[keep])
+        return removed
+
+    def drifted(self) -> bool:
+        """Whether the index has changed enough since training that it should be built again"""
+        if not self.trained:
+            return False
+        if not len(self) or not 1 / DRIFT_SIZE_RATIO <= len(self) / self.trained <= DRIFT_SIZE_RATIO:
+            return True
+        # Too few additions say little about whether the cells still fit
+        if self.train_error and self.added >= self.nlist:
+            return self.added_error / self.added > DRIFT_ERROR_RATIO * self.train_error
+        return False
+
+    def search(self, query: np.ndarray, top_k: int = 10, nprobe: Optional[int] = None,
+               allowed: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, float]]:
+        """
+        Return (key, cosine similarity) pairs for the approximate top_k neighbours
+
+        With allowed, only keys it accepts are candidates; if the probed cells hold fewer than
+        top_k of them, every cell is probed.
+        """
+        if not len(self):
+            return []
+        query = normalize(query).reshape(-1)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        coarse = self.centroids @ query
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+
+        if self.pq_m:
+            # Inner product is linear, so score = q.centroid + sum of per-subspace table lookups
+            sub_dim = self.dim // self.pq_m
+            tables = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.pq_m, sub_dim))
+            columns = np.arange(self.pq_m)
+
+        candidate_scores = []
+        candidate_rows = []
+        for cell in probe:
+            start, end = self.offsets[cell], self.offsets[cell + 1]
+            if start == end:
+                continue
+            if self.pq_m:
+                scores = coarse[cell] + tables[columns, self.data[start:end]].sum(axis=1)
+            else:
+                scores = self.data[start:end] @ query
+            candidate_scores.append(scores)
+            candidate_rows.append(np.arange(start, end))
+
+        if not candidate_scores:
+            return []
+        scores = np.concatenate(candidate_scores)
+        rows = np.concatenate(candidate_rows)
+        if allowed is not None:
+            keep = np.fromiter((allowed(str(self.keys[row])) for row in rows), dtype=bool, count=len(rows))
+            if keep.sum() < top_k and nprobe < self.nlist:
+                return self.search(query, top_k, self.nlist, allowed)
+            scores, rows = scores[keep], rows[keep]
+            if not len(scores):
+                return []
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(str(self.keys[rows[i]]), float(scores[i])) for i in best]
+
+    def save(self, path: str):
+        """Write the index to a single .npz file"""
+        params = {
+            'version': INDEX_FORMAT_VERSION,
+            'nlist': self.nlist,
+            'nprobe': self.nprobe,
+            'pq_m': self.pq_m,
+            'seed': self.seed,
+            'dim': self.dim,
+            'ksub': self.ksub,
+            'trained': self.trained,
+            'train_error': self.train_error,
+            'added': self.added,
+            'added_error': self.added_error,
+        }
+        arrays = {
+            'params': np.array(json.dumps(params)),
+            'centroids': self.centroids,
+            'offsets': self.offsets,
+            'data': self.data,
+            'keys': self.keys,
+        }
+        if self.codebooks is not None:
+            arrays['codebooks'] = self.codebooks
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        np.savez(path, **arrays)
+        logger.info(f"Saved IVF index with {len(self)} vectors to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        """Read an index written by save()"""
+        with np.load(path, allow_pickle=False) as arrays:
+            params = json.loads(str(arrays['params']))
+            if params.get('version') != INDEX_FORMAT_VERSION:
+                raise ValueError(f"Unsupported ANN index version in {path}: {params.get('version')}")
+            index = cls(nlist=params['nlist'], nprobe=params['nprobe'], pq_m=params['pq_m'], seed=params['seed'])
+            index.dim = params['dim']
+            index.centroids = arrays['centroids']
+            index.offsets = arrays['offsets']
+            index.data = arrays['data']
+            index.keys = arrays['keys']
+            index.codebooks = arrays['codebooks'] if 'codebooks' in arrays else None
+            # Indexes saved before incremental adds were always freshly built
+            index.ksub = params.get('ksub', min(256, len(index.keys)) if index.pq_m else 0)
+            index.trained = params.get('trained', len(index.keys))
+            index.train_error = params.get('train_error')
+            index.added = params.get('added', 0)
+            index.added_error = params.get('added_error', 0.0)
+        logger.info(f"Loaded IVF index with {len(index)} vectors from {path}")
+        return index
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the index arrays"""
+        arrays = [self.centroids, self.offsets, self.data, self.codebooks]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+
+def brute_force_search(vectors: np.ndarray, query: np.ndarray, top_k: int) -> np.ndarray:
+    """Exact top_k rows by cosine similarity over normalized vectors"""
+    scores = vectors @ normalize(query).reshape(-1)
+    k = min(top_k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def benchmark_recall(index: IVFIndex, vectors: np.ndarray, keys: Sequence[str], queries: np.ndarray,
+                     top_k: int = 10, nprobe_values: Sequence[int] = (1, 2, 4, 8, 16, 32)) -> List[Dict[str, float]]:
+    """Measure recall@top_k and latency against exact search for each nprobe setting"""
+    vectors = normalize(vectors)
+    keys = np.asarray(keys)
+
+    started = time.perf_counter()
+    truth = [set(keys[brute_force_search(vectors, q, top_k)]) for q in queries]
+    brute_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    report = []
+    for nprobe in nprobe_values:
+        if nprobe > index.nlist:
+            break
+        hits = 0
+        started = time.perf_counter()
+        results = [index.search(q, top_k, nprobe=nprobe) for q in queries]
+        ann_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        for expected, found in zip(truth, results):
+            hits += len(expected & {key for key, _ in found})
+        report.append({
+            'nprobe': nprobe,
+            'recall': hits / (len(queries) * top_k),
+            'ann_ms': ann_ms,
+            'brute_force_ms': brute_ms,
+            'speedup': brute_ms / ann_ms if ann_ms else float('inf'),
+        })
+    return report
+
+
+def synthetic_embeddings(n: int, dim: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """Clustered random vectors that loosely mimic text-embedding structure"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return normalize(centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32))
+
+
+def load_embeddings(path: str, keys_path: Optional[str] = None) -> Tuple[np.ndarray, List[str]]:
+    """
+    Vectors and the key of each row: from an .npz with `keys` and `vectors` arrays (as the
+    search engine saves next to a PQ index), or an .npy matrix with one key per line in
+    keys_path (default: row numbers)
+    """
+    if path.endswith('.npz'):
+        with np.load(path, allow_pickle=False) as arrays:
+            return arrays['vectors'], [str(key) for key in arrays['keys']]
+    vectors = np.load(path)
+    if keys_path is None:
+        return vectors, [str(i) for i in range(len(vectors))]
+    with open(keys_path, encoding='utf-8') as f:
+        keys = [line.rstrip('\n') for line in f if line.strip()]
+    if len(keys) != len(vectors):
+        raise SystemExit(f"{keys_path} has {len(keys)} keys for {len(vectors)} vectors")
+    return vectors, keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall-versus-brute-force benchmark for the IVF index")
+    parser.add_argument('--index', help="Benchmark a saved index against the vectors in --embeddings, "
+                                        "matched by key (an .npz with keys, or --keys)")
+    parser.add_argument('--embeddings', help=".npy matrix or .npz of keys and vectors to index (default: synthetic data)")
+    parser.add_argument('--keys', help="Key of each --embeddings .npy row, one per line (default: row numbers)")
+    parser.add_argument('--n', type=int, default=100000, help="Synthetic vector count")
+    parser.add_argument('--dim', type=int, default=256, help="Synthetic vector dimension")
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--pq-m', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
+    if args.index and not (args.embeddings and (args.embeddings.endswith('.npz') or args.keys)):
+        parser.error("--index needs the vectors with their keys: an .npz --embeddings, or --keys")
+    if args.embeddings:
+        vectors, keys = load_embeddings(args.embeddings, args.keys)
+    else:
+        vectors = synthetic_embeddings(args.n, args.dim)
+        keys = [str(i) for i in range(len(vectors))]
+
+    if args.index:
+        index = IVFIndex.load(args.index)
+        # The index stores keys in cell order; ground truth is computed over the rows they name
+        missing = len(set(map(str, index.keys)) - set(keys))
+        if missing:
+            raise SystemExit(f"{missing} of the index's {len(index)} keys have no vector in {args.embeddings}")
+    else:
+        index = IVFIndex(nlist=args.nlist, pq_m=args.pq_m)
+        index.build(vectors, keys)
+
+    rng = np.random.default_rng(1)
+    # Perturbed corpus vectors stand in for queries that are close to, but not in, the corpus
+    picks = rng.choice(len(vectors), args.queries, replace=False)
+    queries = normalize(vectors[picks] + 0.3 * rng.standard_normal((args.queries, vectors.shape[1])).astype(np.float32))
+
+    print(f"{len(index)} vectors, nlist={index.nlist}, pq_m={index.pq_m}, "
+          f"index size {index.memory_bytes() / 1024 / 1024:.1f} MB")
+    print(f"{'nprobe':>6} {'recall@' + str(args.top_k):>10} {'ann ms':>8} {'exact ms':>9} {'speedup':>8}")
+    for row in benchmark_recall(index, vectors, keys, queries, args.top_k, args.nprobe):
+        print(f"{row['nprobe']:>6} {row['recall']:>10.3f} {row['ann_ms']:>8.2f} "
+              f"{row['brute_force_ms']:>9.2f} {row['speedup']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
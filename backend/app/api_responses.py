@@ -0,0 +1,136 @@
+"""
+Compact, compressed and cacheable API responses
+
+api_response() serializes with orjson when it is installed (falling back to the json module),
+answers in MessagePack when the client asks for it and msgpack is installed, compresses with
+brotli or gzip according to Accept-Encoding, and tags the body with a strong ETag so that
+not_modified() can answer a repeated request with 304 before any work is done.
+"""
+
+import gzip
+import json
+import hashlib
+from typing import Any, Optional
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+MIN_COMPRESS_BYTES = 1024  # Smaller bodies are not worth the CPU or the extra header
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Near gzip -6 speed with noticeably smaller output for JSON
+
+
+def _default(value: Any):
+    """Serialize the odd non-JSON type (NumPy scalars, sets) that creeps into payloads"""
+    if hasattr(value, 'item'):
+        return value.item()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def make_etag(*parts: Any) -> str:
+    """Stable tag for a response identified by parts (index version, endpoint, parameters)"""
+    return hashlib.sha1(dumps(list(parts))).hexdigest()[:20]
+
+
+def negotiate_format() -> str:
+    """"msgpack" when the client prefers it (Accept header or ?format=msgpack) and it is available"""
+    if msgpack is None:
+        return 'json'
+    if request.args.get('format') == 'msgpack':
+        return 'msgpack'
+    accept = request.accept_mimetypes
+    best = accept.best_match(['application/json', *MSGPACK_MIMETYPES], default='application/json')
+    return 'msgpack' if best in MSGPACK_MIMETYPES else 'json'
+
+
+def negotiate_encoding() -> Optional[str]:
+    """Best supported Content-Encoding the client accepts, or None for identity"""
+    accept = request.accept_encodings
+    candidates = [('br', accept.quality('br')) if brotli is not None else None, ('gzip', accept.quality('gzip'))]
+    candidates = [c for c in candidates if c and c[1] > 0]
+    return max(candidates, key=lambda c: c[1])[0] if candidates else None
+
+
+def _representation_etag(etag: str, fmt: str, encoding: Optional[str]) -> str:
+    # Each format/encoding is a different byte sequence, so each gets its own strong tag
+    return f"{etag}-{fmt}" + (f"-{encoding}" if encoding else '')
+
+
+def _cache_headers(response: Response, etag: Optional[str], fmt: str, encoding: Optional[str], max_age: int):
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    if etag:
+        response.set_etag(_representation_etag(etag, fmt, encoding))
+        response.headers['Cache-Control'] = f"private, max-age={max_age}" if max_age else 'no-cache'
+
+
+def not_modified(etag: str, max_age: int = 0) -> Optional[Response]:
+    """A 304 response if the client already holds this representation, else None"""
+    fmt = negotiate_format()
+    encoding = negotiate_encoding()
+    # Bodies below MIN_COMPRESS_BYTES were sent uncompressed, so their tag has no encoding
+    for candidate in (encoding, None):
+        if request.if_none_match.contains(_representation_etag(etag, fmt, candidate)):
+            encoding = candidate
+            break
+    else:
+        return None
+    response = Response(status=304)
+    _cache_headers(response, etag, fmt, encoding, max_age)
+    return response
+
+
+def api_response(payload: Any, status: int = 200, etag: Optional[str] = None, max_age: int = 0) -> Response:
+    """
+    Serialize, compress and tag a payload for the current request
+
+    Args:
+        payload: JSON-compatible data
+        status: HTTP status code
+        etag: Base tag from make_etag(); enables conditional requests (see not_modified)
+        max_age: Seconds the client may reuse the response without revalidating (0 = always revalidate)
+    """
+    fmt = negotiate_format()
+    if fmt == 'msgpack':
+        body = msgpack.packb(payload, default=_default)
+        mimetype = MSGPACK_MIMETYPES[0]
+    else:
+        body = dumps(payload)
+        mimetype = 'application/json'
+
+    encoding = negotiate_encoding() if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding == 'br':
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+    response = Response(body, status=status, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    _cache_headers(response, etag, fmt, encoding, max_age)
+    return response
@@ -0,0 +1,136 @@
+"""
+Tokenizer-aware chunking that keeps character offsets back into the page text
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Break after sentence punctuation or at blank lines; the whitespace stays with the earlier unit
+BOUNDARY_RE = re.compile(r'(?<=[.!?;:])\s+|\n\s*\n\s*')
+
+
+class WordEncoding:
+    """
+    Word-level stand-in for a tiktoken encoding, used when tiktoken's data files are unavailable
+
+    Each token is a word or punctuation mark with its leading whitespace, so counts run a
+    little below real BPE counts but offsets and decoding are exact.
+    """
+
+    PIECE_RE = re.compile(r"\s*\w+|\s*[^\w\s]|\s+")
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.pieces: List[str] = []
+
+    def _id(self, piece: str) -> int:
+        idx = self.ids.get(piece)
+        if idx is None:
+            idx = self.ids[piece] = len(self.pieces)
+            self.pieces.append(piece)
+        return idx
+
+    def encode_ordinary(self, text: str) -> List[int]:
+        return [self._id(piece) for piece in self.PIECE_RE.findall(text)]
+
+    def encode(self, text: str, **kwargs) -> List[int]:
+        return self.encode_ordinary(text)
+
+    def encode_ordinary_batch(self, texts: List[str], **kwargs) -> List[List[int]]:
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode(self, tokens: List[int]) -> str:
+        return ''.join(self.pieces[t] for t in tokens)
+
+    def decode_with_offsets(self, tokens: List[int]) -> Tuple[str, List[int]]:
+        offsets = []
+        position = 0
+        for t in tokens:
+            offsets.append(position)
+            position += len(self.pieces[t])
+        return self.decode(tokens), offsets
+
+
+def split_units(text: str) -> List[Tuple[int, int]]:
+    """Character spans of the sentences/paragraphs in text"""
+    spans = []
+    start = 0
+    for match in BOUNDARY_RE.finditer(text):
+        if match.end() > start:
+            spans.append((start, match.end()))
+            start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def chunk_page(encoding, text: str, page: Optional[int] = None, max_tokens: int = 800,
+               overlap: int = 100) -> List[Dict[str, Any]]:
+    """
+    Split one page of text into chunks of at most max_tokens, ending on sentence boundaries
+
+    Each sentence is encoded once (as a batch) and chunks are assembled from the cached
+    counts, so the page is never re-encoded or decoded. Consecutive chunks share up to
+    `overlap` tokens of whole sentences.
+
+    Returns dicts with text, page, char_start/char_end into `text`, token_count,
+    token_start/token_end (running token position in the page) and lead_chars (characters
+    shared with the previous chunk).
+    """
+    spans = split_units(text)
+    if not spans:
+        return []
+    counts = [len(tokens) for tokens in encoding.encode_ordinary_batch([text[s:e] for s, e in spans])]
+
+    # Sentences longer than a chunk are cut at token boundaries using decoded offsets
+    piece_tokens = max(1, (max_tokens - overlap) // 2)
+    units: List[Tuple[int, int, int]] = []  # (char_start, char_end, token_count)
+    for (start, end), count in zip(spans, counts):
+        if count <= max_tokens - overlap:
+            units.append((start, end, count))
+            continue
+        tokens = encoding.encode_ordinary(text[start:end])
+        _, offsets = encoding.decode_with_offsets(tokens)
+        for i in range(0, len(tokens), piece_tokens):
+            piece_start = start + offsets[i]
+            piece_end = start + offsets[i + piece_tokens] if i + piece_tokens < len(tokens) else end
+            units.append((piece_start, piece_end, min(piece_tokens, len(tokens) - i)))
+
+    positions = [0]
+    for _, _, count in units:
+        positions.append(positions[-1] + count)
+
+    chunks = []
+    first = 0
+    previous_end = None
+    while first < len(units):
+        last = first
+        total = units[first][2]
+        while last + 1 < len(units) and total + units[last + 1][2] <= max_tokens:
+            last += 1
+            total += units[last][2]
+
+        char_start, char_end = units[first][0], units[last][1]
+        chunks.append({
+            'text': text[char_start:char_end],
+            'page': page,
+            'char_start': char_start,
+            'char_end': char_end,
+            'token_count': total,
+            'token_start': positions[first],
+            'token_end': positions[last + 1],
+            'lead_chars': max(0, previous_end - char_start) if previous_end is not None else 0
+        })
+        previous_end = char_end
+        if last + 1 >= len(units):
+            break
+
+        # Step back over trailing sentences that fit the overlap, always moving forward
+        next_first = last + 1
+        carried = 0
+        while next_first - 1 > first and carried + units[next_first - 1][2] <= overlap:
+            next_first -= 1
+            carried += units[next_first][2]
+        first = next_first
+
+    return chunks
@@ -0,0 +1,125 @@
+"""
+Bounded on-disk cache of generated files (page previews, page-range PDFs)
+
+Files are named by the caller's key, evicted least recently used past a byte budget, and
+built at most once at a time: a request for a file another thread is building waits for it.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+
+def file_fingerprint(file_path: str) -> str:
+    """Identity of a source file that changes whenever the file is replaced or edited"""
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}\x1f{stat.st_size}\x1f{stat.st_mtime_ns}"
+
+
+class DiskCache:
+    """Directory of generated files with LRU eviction and single-flight builds"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Args:
+            cache_dir: Directory for the files (created if missing; existing files are reused)
+            max_bytes: Total size before the least recently used files are deleted
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, int]" = OrderedDict()  # filename -> bytes, oldest first
+        self.total_bytes = 0
+        self.building: Dict[str, Future] = {}
+        self.stats = {'hits': 0, 'builds': 0, 'evictions': 0}
+
+        existing = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)  # Left by a build interrupted mid-write
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self.entries[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def __contains__(self, name: str) -> bool:
+        with self.lock:
+            return name in self.entries or name in self.building
+
+    def read(self, name: str, build: Callable[[], bytes]) -> bytes:
+        """
+        Contents of the cached file, calling build() to create it if it is missing
+
+        A hit is opened holding the lock eviction takes, so another thread's build cannot
+        delete the file between the lookup and the read; a build returns the bytes it wrote.
+        """
+        path = os.path.join(self.cache_dir, name)
+        cached = None
+        with self.lock:
+            if name in self.entries:
+                try:
+                    cached = open(path, 'rb')
+                except FileNotFoundError:
+                    pass  # Deleted behind the cache's back; built again below
+                else:
+                    self.entries.move_to_end(name)
+                    self.stats['hits'] += 1
+        if cached is not None:
+            with cached:
+                return cached.read()
+
+        # Another thread building the same file is awaited rather than repeated
+        with self.lock:
+            future = self.building.get(name)
+            owner = future is None
+            if owner:
+                future = self.building[name] = Future()
+        if not owner:
+            return future.result()
+        try:
+            data = build()
+            self._write(name, data)
+            future.set_result(data)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.building.pop(name, None)
+        return data
+
+    def _write(self, name: str, data: bytes):
+        path = os.path.join(self.cache_dir, name)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.stats['builds'] += 1
+            self.total_bytes += len(data) - self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            self._evict()
+
+    def _evict(self):
+        # The newest file always stays, even if it alone exceeds the budget
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.stats['evictions'] += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def metrics(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.total_bytes,
+                        max_bytes=self.max_bytes, building=len(self.building))
@@ -0,0 +1,311 @@
+"""
+PDF text extraction and page matching, shared by the web process and search shard workers
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF - more stable than pdfplumber
+
+logger = logging.getLogger(__name__)
+
+MARGIN_BAND = 0.12  # Top and bottom share of the page height where running headers and footers sit
+REPEATED_LINE_SHARE = 0.5  # A margin line on at least this share of pages is page furniture, not content
+MIN_PAGES_FOR_STRIPPING = 4  # Too few pages to tell a running header from a title
+ROMAN_NUMERAL_RE = re.compile(r'[ivxlc]+')  # Front matter page numbers
+
+# PyMuPDF is not thread-safe: every fitz call in the process, whether extracting, rendering a
+# preview or cutting a page range, is made holding this one lock
+FITZ_LOCK = threading.Lock()
+
+
+class PageWords:
+    """
+    Word bounding boxes of one page, packed for term lookup without the PDF
+
+    Words are kept lowercased in one space-joined string with their start offsets, so a term
+    or phrase is found with str.find and mapped back to the words it spans. Boxes are PDF
+    points (x0, y0, x1, y1) in a flat float array, four values per word.
+    """
+
+    __slots__ = ('text', 'starts', 'boxes', 'width', 'height', 'unpack')
+
+    def __init__(self, words: Sequence[tuple], width: float, height: float):
+        """
+        Args:
+            words: page.get_text("words") tuples (x0, y0, x1, y1, word, block, line, word_no)
+            width, height: Page size in points
+        """
+        self.starts = array('i')
+        self.boxes = array('f')
+        parts = []
+        position = 0
+        for x0, y0, x1, y1, word, *_ in words:
+            self.starts.append(position)
+            self.boxes.extend((x0, y0, x1, y1))
+            parts.append(word.lower())
+            position += len(word) + 1
+        self.text = ' '.join(parts)
+        self.width = width
+        self.height = height
+        self.unpack = None
+
+    @classmethod
+    def packed(cls, text: str, width: float, height: float,
+               unpack: Callable[[], Tuple[array, array]]) -> 'PageWords':
+        """Words whose starts and boxes are only decoded, by unpack(), when first looked up"""
+        words = cls((), width, height)
+        words.text = text
+        words.unpack = unpack
+        return words
+
+    def unpacked(self) -> 'PageWords':
+        """This page's words with their starts and boxes decoded"""
+        if self.unpack is not None:
+            self.starts, self.boxes = self.unpack()
+            self.unpack = None
+        return self
+
+    def find(self, terms: Iterable[str]) -> List[Tuple[float, float, float, float]]:
+        """Boxes of every word that is part of an occurrence of any of the terms"""
+        self.unpacked()
+        matched = []
+        seen = set()
+        for term in terms:
+            needle = ' '.join(term.lower().split())
+            if not needle:
+                continue
+            position = self.text.find(needle)
+            while position != -1:
+                first = bisect_right(self.starts, position) - 1
+                last = bisect_right(self.starts, position + len(needle) - 1) - 1
+                for i in range(first, last + 1):
+                    if i not in seen:
+                        seen.add(i)
+                        matched.append(tuple(self.boxes[4 * i:4 * i + 4]))
+                position = self.text.find(needle, position + 1)
+        return matched
+
+    def without(self, dropped: Iterable[int]) -> 'PageWords':
+        """A copy without the words at the given indexes, copied run by run between them"""
+        self.unpacked()
+        copy = PageWords((), self.width, self.height)
+        parts = []
+        count = len(self.starts)
+        position = 0
+        run_start = 0
+        for end in sorted(set(dropped)) + [count]:
+            if end > run_start:
+                begin = self.starts[run_start]
+                finish = self.starts[end] - 1 if end < count else len(self.text)
+                shift = begin - position
+                copy.starts.extend([start - shift for start in self.starts[run_start:end]])
+                copy.boxes.extend(self.boxes[4 * run_start:4 * end])
+                parts.append(self.text[begin:finish])
+                position += finish - begin + 1
+            run_start = end + 1
+        copy.text = ' '.join(parts)
+        return copy
+
+
+@dataclass
+class DocumentSection:
+    title: str
+    content: str
+    page: int
+    words: Optional[PageWords] = None
+
+@dataclass 
+class DocumentData:
+    title: str
+    sections: List[DocumentSection]
+
+    @property
+    def full_text(self) -> str:
+        """All pages' text, a line each; joined on demand rather than kept next to the sections"""
+        return ''.join(section.content + "\n" for section in self.sections)
+
+def clean_text(text: str) -> str:
+    """Clean and normalize text"""
+    if not text:
+        return ""
+    
+    # Remove excessive whitespace
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\n\s*\n', '\n', text)
+    
+    # Remove common PDF artifacts
+    text = re.sub(r'[^\w\s\-.,;:()!?"\'/]', ' ', text)
+    
+    return text.strip()
+
+def margin_lines(words: Sequence[tuple], height: float) -> Dict[Tuple[str, str], List[int]]:
+    """
+    Lines of a page that sit in its top or bottom margin band
+    
+    Returns:
+        {(band, normalized text): indexes of the line's words}, where digits are folded to "#"
+        and a bare roman numeral counts as a page number, so "Page 7" matches "Page 8"
+    """
+    top_edge = height * MARGIN_BAND
+    bottom_edge = height - top_edge
+    # Only lines with a word in a band can lie wholly inside it
+    candidates = {(word[5], word[6]) for word in words if word[3] <= top_edge or word[1] >= bottom_edge}
+    if not candidates:
+        return {}
+    lines: Dict[Tuple[int, int], List[int]] = {}
+    for i, word in enumerate(words):
+        if (word[5], word[6]) in candidates:
+            lines.setdefault((word[5], word[6]), []).append(i)
+    
+    found = {}
+    for indexes in lines.values():
+        if max(words[i][3] for i in indexes) <= top_edge:
+            band = 'top'
+        elif min(words[i][1] for i in indexes) >= bottom_edge:
+            band = 'bottom'
+        else:
+            continue
+        text = ' '.join(words[i][4] for i in indexes).lower()
+        text = '#' if ROMAN_NUMERAL_RE.fullmatch(text) else re.sub(r'\d+', '#', text)
+        found.setdefault((band, text), []).extend(indexes)
+    return found
+
+def repeated_margin_lines(pages: Sequence[Dict[Tuple[str, str], List[int]]]) -> set:
+    """Margin lines found on enough pages to be running headers, footers or page numbers"""
+    if len(pages) < MIN_PAGES_FOR_STRIPPING:
+        return set()
+    counts: Dict[Tuple[str, str], int] = {}
+    for lines in pages:
+        for key in lines:
+            counts[key] = counts.get(key, 0) + 1
+    threshold = max(2, len(pages) * REPEATED_LINE_SHARE)
+    return {key for key, count in counts.items() if count >= threshold}
+
+def extract_document(file_path: str) -> Optional[DocumentData]:
+    """
+    Extract the text of every page of a PDF
+    
+    Running headers, footers, distribution statements and page numbers (margin lines that
+    recur on most pages) are dropped, so they are neither stored nor matched by search.
+    """
+    try:
+        logger.info(f"Loading document data for: {file_path}")
+        
+        if not os.path.exists(file_path):
+            logger.error(f"File not found: {file_path}")
+            return None
+            
+        # Extract text using stable PyMuPDF; the words of a page joined by spaces clean to
+        # the same text as page.get_text(), and carry the positions the margin check needs
+        # Taken per page rather than for the whole document, so previews are not held up
+        with FITZ_LOCK:
+            doc = fitz.open(file_path)
+            page_count = len(doc)
+        pages = []
+        for page_num in range(page_count):
+            try:
+                with FITZ_LOCK:
+                    page = doc[page_num]
+                    words = page.get_text("words")
+                    width, height = page.rect.width, page.rect.height
+                if words:
+                    # Only the packed boxes are kept until every page has been seen
+                    pages.append((page_num, ' '.join(word[4] for word in words),
+                                  PageWords(words, width, height), margin_lines(words, height)))
+            except Exception as e:
+                logger.warning(f"Error processing page {page_num + 1}: {e}")
+                continue
+        with FITZ_LOCK:
+            doc.close()
+        
+        repeated = repeated_margin_lines([lines for *_, lines in pages])
+        sections = []
+        stripped_words = 0
+        
+        for page_num, page_text, words, lines in pages:
+            dropped = {i for key in repeated.intersection(lines) for i in lines[key]}
+            if dropped:
+                stripped_words += len(dropped)
+                page_text = ' '.join(word for i, word in enumerate(page_text.split(' ')) if i not in dropped)
+                words = words.without(dropped)
+            cleaned_text = clean_text(page_text)
+            if cleaned_text:
+                section = DocumentSection(
+                    title=f"Page {page_num + 1}",
+                    content=cleaned_text,
+                    page=page_num + 1,
+                    words=words
+                )
+                sections.append(section)
+                
+                if (page_num + 1) % 50 == 0:
+                    logger.info(f"Processed {page_num + 1} pages")
+        
+        if not sections:
+            logger.warning(f"No text extracted from {file_path}")
+            return None
+        
+        if repeated:
+            logger.info(f"Stripped {stripped_words} words of {len(repeated)} repeated header/footer lines "
+                        f"from {file_path}: {sorted(text for _, text in repeated)}")
+            
+        document_data = DocumentData(
+            title=os.path.basename(file_path),
+            sections=sections
+        )
+        
+        logger.info(f"Successfully loaded {len(sections)} sections from {file_path}")
+        return document_data
+        
+    except Exception as e:
+        logger.error(f"Error loading document {file_path}: {e}")
+        return None
+
+def search_sections(doc_data: DocumentData, weighted_terms: Sequence[Tuple[str, float]],
+                    deadline: Optional[float] = None) -> Tuple[List[Dict], bool]:
+    """
+    Match weighted terms against each page of a document
+    
+    Each hit carries the page size and the boxes (PDF points) of every term found on the
+    page, for drawing highlights over a rendered preview.
+    
+    Returns:
+        (results, complete) where complete is False if the time.monotonic() deadline
+        stopped the scan early
+    """
+    results = []
+    for section in doc_data.sections:
+        if deadline is not None and time.monotonic() >= deadline:
+            return results, False
+        section_text_lower = section.content.lower()
+        
+        for term, relevance in weighted_terms:
+            if term in section_text_lower:
+                # Find context around the match
+                start_pos = section_text_lower.find(term)
+                context_start = max(0, start_pos - 100)
+                context_end = min(len(section.content), start_pos + len(term) + 100)
+                context = section.content[context_start:context_end]
+                
+                result = {
+                    'document': doc_data.title,
+                    'section': section.title,
+                    'page': section.page,
+                    'context': context,
+                    'relevance': relevance  # Simple relevance score
+                }
+                if section.words is not None:
+                    result['page_size'] = [round(section.words.width, 1), round(section.words.height, 1)]
+                    result['highlights'] = [[round(v, 1) for v in box] for box in
+                                            section.words.find(t for t, _ in weighted_terms)]
+                results.append(result)
+                break  # Only one match per section to avoid duplicates
+    return results, True
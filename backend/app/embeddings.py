@@ -0,0 +1,307 @@
+"""
+Pluggable embedding backends: OpenAI (remote) and local LSA (TF-IDF + truncated SVD)
+
+The local backend is fitted on the indexed corpus with NumPy alone, needs no network or
+API key, and embeds a short query in microseconds by summing a few term vectors.
+"""
+
+import os
+import re
+import math
+import json
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were
+will with shall may not no any all such which be been being than then there these those into
+""".split())
+
+LSA_FORMAT_VERSION = 1
+OPENAI_EMBEDDING_DIMENSIONS = {
+    'text-embedding-ada-002': 1536,
+    'text-embedding-3-small': 1536,
+    'text-embedding-3-large': 3072,
+}
+# Texts sent per embeddings request: the endpoint takes a list of inputs (at most 2048), and
+# a modest token budget keeps one failed or retried request from costing much
+OPENAI_EMBEDDING_BATCH_TOKENS = 8000
+OPENAI_EMBEDDING_BATCH_SIZE = 2048
+
+
+def lsa_tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+class EmbeddingBackend:
+    """Interface for turning text into vectors; cosine similarity is used on the results"""
+
+    name = "base"
+
+    def embed(self, texts: Sequence[str], token_counts: Optional[Sequence[int]] = None,
+              background: bool = True) -> List[List[float]]:
+        """Embed documents; failed items come back as empty lists"""
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> List[float]:
+        raise NotImplementedError
+
+    def prepare(self, texts: Sequence[str]):
+        """Called with corpus texts before they are embedded; corpus-fitted backends train here"""
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    @property
+    def dimension(self) -> Optional[int]:
+        """Length of the vectors this backend produces, or None if not known before embedding"""
+        return None
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Remote embeddings through the shared OpenAI request scheduler"""
+
+    name = "openai"
+
+    def __init__(self, scheduler, model: str, count_tokens):
+        from openai_scheduler import INTERACTIVE, BACKGROUND
+        self.scheduler = scheduler
+        self.model = model
+        self.count_tokens = count_tokens
+        self.priorities = {True: BACKGROUND, False: INTERACTIVE}
+
+    @property
+    def dimension(self):
+        return OPENAI_EMBEDDING_DIMENSIONS.get(self.model)
+
+    def _request(self, texts: List[str], tokens: int, background: bool):
+        return self.scheduler.submit(
+            lambda client: client.embeddings.create(model=self.model, input=texts),
+            tokens=tokens,
+            priority=self.priorities[background]
+        )
+
+    @staticmethod
+    def batches(counts: Sequence[int], max_tokens: int = OPENAI_EMBEDDING_BATCH_TOKENS,
+                max_size: int = OPENAI_EMBEDDING_BATCH_SIZE) -> List[range]:
+        """Consecutive index ranges within the batch budget; a text over it goes alone"""
+        batches = []
+        start = 0
+        tokens = 0
+        for i, count in enumerate(counts):
+            if i > start and (tokens + count > max_tokens or i - start >= max_size):
+                batches.append(range(start, i))
+                start, tokens = i, 0
+            tokens += count
+        if start < len(counts):
+            batches.append(range(start, len(counts)))
+        return batches
+
+    def embed(self, texts, token_counts=None, background=True):
+        counts = token_counts or [self.count_tokens(text) for text in texts]
+        requests = [(batch, self._request([texts[i] for i in batch], sum(counts[i] for i in batch), background))
+                    for batch in self.batches(counts)]
+        embeddings = [[] for _ in texts]
+        for batch, future in requests:
+            try:
+                # Items carry their input position; the API does not promise to keep the order
+                for item in future.result().data:
+                    embeddings[batch[item.index]] = item.embedding
+            except Exception as e:
+                logger.error(f"Error getting embeddings for {len(batch)} texts: {e}")
+        return embeddings
+
+    def embed_query(self, text):
+        return self.embed([text], background=False)[0]
+
+
+class CSRMatrix:
+    """Just enough of a compressed sparse row matrix for TF-IDF products in NumPy"""
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, n_cols: int):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = (len(indptr) - 1, n_cols)
+
+    def matmul(self, dense: np.ndarray, max_nnz: int = 2_000_000) -> np.ndarray:
+        """self @ dense, in row blocks that keep the temporary product bounded"""
+        n_rows = self.shape[0]
+        out = np.zeros((n_rows, dense.shape[1]), dtype=np.float32)
+        start = 0
+        while start < n_rows:
+            end = int(np.searchsorted(self.indptr, self.indptr[start] + max_nnz, side='right')) - 1
+            end = min(n_rows, max(end, start + 1))
+            lo, hi = self.indptr[start], self.indptr[end]
+            if hi > lo:
+                products = self.data[lo:hi, None] * dense[self.indices[lo:hi]]
+                offsets = self.indptr[start:end] - lo
+                nonempty = self.indptr[start + 1:end + 1] > self.indptr[start:end]
+                sums = np.add.reduceat(products, offsets[nonempty], axis=0)
+                out[start:end][nonempty] = sums
+            start = end
+        return out
+
+    def transpose(self) -> 'CSRMatrix':
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind='stable')
+        counts = np.bincount(self.indices, minlength=self.shape[1])
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        return CSRMatrix(indptr, rows[order], self.data[order], self.shape[0])
+
+
+class LSAEmbeddingBackend(EmbeddingBackend):
+    """Latent semantic analysis vectors fitted on the corpus; fully offline"""
+
+    name = "local"
+
+    def __init__(self, dim: int = 256, min_df: int = 2, max_features: int = 50000,
+                 model_path: Optional[str] = None, seed: int = 0):
+        """
+        Args:
+            dim: Embedding dimension (SVD rank)
+            min_df: Ignore terms found in fewer chunks than this
+            max_features: Keep at most this many of the most common terms
+            model_path: Where the fitted model is saved and loaded from
+            seed: Random seed for the randomized SVD
+        """
+        self.dim = dim
+        self.min_df = min_df
+        self.max_features = max_features
+        self.model_path = model_path
+        self.seed = seed
+
+        self.vocabulary: Dict[str, int] = {}
+        self.idf: Optional[np.ndarray] = None
+        self.term_vectors: Optional[np.ndarray] = None  # (n_terms, dim), already idf-weighted
+
+        if model_path and os.path.exists(model_path):
+            try:
+                self.load(model_path)
+            except Exception as e:
+                logger.error(f"Could not load local embedding model from {model_path}: {e}")
+
+    @property
+    def ready(self) -> bool:
+        return self.term_vectors is not None
+
+    @property
+    def dimension(self):
+        # The SVD rank can come out below dim on a small corpus
+        return self.term_vectors.shape[1] if self.term_vectors is not None else None
+
+    def prepare(self, texts):
+        if not self.ready:
+            self.fit(texts)
+
+    def fit(self, texts: Sequence[str]):
+        """Build the vocabulary and IDF weights, then factorize the TF-IDF matrix"""
+        tokenized = [Counter(lsa_tokenize(text)) for text in texts]
+        document_frequency = Counter()
+        for counts in tokenized:
+            document_frequency.update(counts.keys())
+
+        min_df = self.min_df if len(texts) >= 10 * self.min_df else 1
+        terms = [t for t, df in document_frequency.items() if df >= min_df]
+        terms.sort(key=lambda t: (-document_frequency[t], t))
+        terms = terms[:self.max_features]
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        n_docs = len(texts)
+        self.idf = np.array([math.log((1 + n_docs) / (1 + document_frequency[t])) + 1 for t in terms],
+                            dtype=np.float32)
+
+        matrix = self._tfidf(tokenized)
+        k = max(1, min(self.dim, min(matrix.shape) - 1 if min(matrix.shape) > 1 else 1))
+        components = self._randomized_svd(matrix, k)  # (n_terms, k)
+
+        # Fold idf into the projection so a query is just sum(tf * row)
+        self.term_vectors = (components * self.idf[:, None]).astype(np.float32)
+        logger.info(f"Fitted local LSA embeddings: {n_docs} chunks, {len(terms)} terms, dim {k}")
+
+        if self.model_path:
+            self.save(self.model_path)
+
+    def _tf(self, counts: Counter):
+        """Sublinear term frequencies over the known vocabulary"""
+        ids, weights = [], []
+        for term, count in counts.items():
+            idx = self.vocabulary.get(term)
+            if idx is not None:
+                ids.append(idx)
+                weights.append(1.0 + math.log(count))
+        return np.array(ids, dtype=np.int64), np.array(weights, dtype=np.float32)
+
+    def _tfidf(self, tokenized: List[Counter]) -> CSRMatrix:
+        indptr, indices, data = [0], [], []
+        for counts in tokenized:
+            ids, weights = self._tf(counts)
+            weights = weights * self.idf[ids]
+            norm = np.linalg.norm(weights)
+            if norm:
+                weights /= norm
+            indices.append(ids)
+            data.append(weights)
+            indptr.append(indptr[-1] + len(ids))
+        return CSRMatrix(np.array(indptr, dtype=np.int64),
+                         np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+                         np.concatenate(data) if data else np.zeros(0, dtype=np.float32),
+                         len(self.vocabulary))
+
+    def _randomized_svd(self, matrix: CSRMatrix, k: int, oversample: int = 10, power_iterations: int = 3) -> np.ndarray:
+        """Right singular vectors (n_terms x k) via a randomized range finder"""
+        rng = np.random.default_rng(self.seed)
+        transposed = matrix.transpose()
+        width = min(k + oversample, min(matrix.shape))
+        sample = matrix.matmul(rng.standard_normal((matrix.shape[1], width)).astype(np.float32))
+        basis, _ = np.linalg.qr(sample)
+        for _ in range(power_iterations):
+            basis, _ = np.linalg.qr(transposed.matmul(basis))
+            basis, _ = np.linalg.qr(matrix.matmul(basis))
+        projected = transposed.matmul(basis).T  # (width, n_terms) = basis^T @ matrix
+        _, _, vt = np.linalg.svd(projected, full_matrices=False)
+        return vt[:k].T
+
+    def _embed_counts(self, counts: Counter) -> List[float]:
+        ids, weights = self._tf(counts)
+        if not len(ids):
+            return []
+        vector = weights @ self.term_vectors[ids]
+        norm = np.linalg.norm(vector)
+        return (vector / norm).tolist() if norm else []
+
+    def embed(self, texts, token_counts=None, background=True):
+        if not self.ready:
+            raise RuntimeError("Local embedding model has not been fitted")
+        return [self._embed_counts(Counter(lsa_tokenize(text))) for text in texts]
+
+    def embed_query(self, text):
+        if not self.ready:
+            return []
+        return self._embed_counts(Counter(lsa_tokenize(text)))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez(path,
+                 params=np.array(json.dumps({'version': LSA_FORMAT_VERSION, 'dim': self.dim})),
+                 terms=np.array(terms),
+                 idf=self.idf,
+                 term_vectors=self.term_vectors)
+        logger.info(f"Saved local embedding model to {path}")
+
+    def load(self, path: str):
+        with np.load(path, allow_pickle=False) as arrays:
+            params = json.loads(str(arrays['params']))
+            if params.get('version') != LSA_FORMAT_VERSION:
+                raise ValueError(f"Unsupported local embedding model version: {params.get('version')}")
+            self.vocabulary = {str(term): i for i, term in enumerate(arrays['terms'])}
+            self.idf = arrays['idf']
+            self.term_vectors = arrays['term_vectors']
+        logger.info(f"Loaded local embedding model with {len(self.vocabulary)} terms from {path}")
@@ -1,20 +1,39 @@
 # LLM-Enhanced Search Module for Document Search Tool
 import os
+import re
+import copy
 import json
 import logging
-from typing import List, Dict, Any, Optional
-import openai
-from openai import OpenAI
+from typing import List, Dict, Any, Callable, Iterator, Optional, Sequence, Union
 import tiktoken
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+
+from ann_index import IVFIndex, normalize
+from chunking import WordEncoding, chunk_page
+from embeddings import EmbeddingBackend, LSAEmbeddingBackend, OpenAIEmbeddingBackend
+from openai_scheduler import INTERACTIVE, get_scheduler
+from response_cache import ResponseCache, hash_text
+from vector_store import VectorStore
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the prompts in llm_enhanced_search change so cached answers are not reused
+PROMPT_VERSION = "1"
+DEFAULT_MAX_CONTEXT_TOKENS = 3000
+MAX_COMPLETION_TOKENS = 1000
+PROMPT_OVERHEAD_TOKENS = 200
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "..", "cache", "llm_responses.sqlite3")
+DEFAULT_LOCAL_EMBEDDING_PATH = os.path.join(os.path.dirname(__file__), "..", "cache", "lsa_embeddings.npz")
+
+# Cosine scores differ in scale between backends, so each has its own relevance cut-off
+SIMILARITY_THRESHOLDS = {'openai': 0.7, 'local': 0.3}
+
 class LLMSearchEngine:
     """LLM-powered semantic search engine for document content"""
     
-    def __init__(self, api_key: str = None, model: str = "gpt-3.5-turbo", embedding_model: str = "text-embedding-ada-002"):
+    def __init__(self, api_key: str = None, model: str = "gpt-3.5-turbo", embedding_model: str = "text-embedding-ada-002",
+                 ann_index_path: str = None, cache_path: str = None, semantic_cache_threshold: float = None,
+                 embedding_backend: Union[str, EmbeddingBackend] = None, embedding_precision: str = None):
         """
         Initialize LLM search engine
         
@@ -22,19 +41,71 @@ class LLMSearchEngine:
             api_key: OpenAI API key (or set OPENAI_API_KEY environment variable)
             model: GPT model for text generation and analysis
             embedding_model: Model for generating embeddings
+            ann_index_path: Where the approximate nearest-neighbor index is saved
+                (or set ANN_INDEX_PATH); an existing index is loaded on startup
+            cache_path: SQLite file for cached answers (or set LLM_CACHE_PATH; empty disables)
+            semantic_cache_threshold: Reuse a cached answer for a different query whose embedding
+                is at least this similar (or set LLM_SEMANTIC_CACHE_THRESHOLD; unset disables)
+            embedding_backend: "openai", "local" (offline TF-IDF + SVD) or an EmbeddingBackend
+                (or set EMBEDDING_BACKEND; defaults to "openai" with an API key, else "local")
+            embedding_precision: Storage for chunk embeddings: "int8", "float16" or "float32"
+                (or set EMBEDDING_PRECISION; default "int8", with exact float32 rescoring)
         """
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
-        if not self.api_key:
+        backend_name = embedding_backend if isinstance(embedding_backend, str) else None
+        backend_name = backend_name or os.getenv('EMBEDDING_BACKEND') or ('openai' if self.api_key else 'local')
+        if backend_name == 'openai' and not self.api_key and not isinstance(embedding_backend, EmbeddingBackend):
             raise ValueError("OpenAI API key required. Set OPENAI_API_KEY environment variable or pass api_key parameter.")
         
-        self.client = OpenAI(api_key=self.api_key)
+        # All API calls share one rate-limited scheduler and connection pool per key;
+        # without a key only local semantic search is available
+        self.scheduler = get_scheduler(self.api_key, os.getenv('OPENAI_BASE_URL')) if self.api_key else None
         self.model = model
         self.embedding_model = embedding_model
-        self.encoding = tiktoken.encoding_for_model(model)
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            logger.warning(f"tiktoken encoding unavailable ({e}); using approximate word tokens")
+            self.encoding = WordEncoding()
         
-        # Cache for embeddings to avoid re-computation
+        if isinstance(embedding_backend, EmbeddingBackend):
+            self.embedding_backend = embedding_backend
+        elif backend_name == 'local':
+            self.embedding_backend = LSAEmbeddingBackend(
+                model_path=os.getenv('LOCAL_EMBEDDING_PATH', DEFAULT_LOCAL_EMBEDDING_PATH) or None)
+        else:
+            self.embedding_backend = OpenAIEmbeddingBackend(self.scheduler, embedding_model, self.count_tokens)
+        self.similarity_threshold = SIMILARITY_THRESHOLDS.get(self.embedding_backend.name, 0.7)
+        
+        # Cache for embeddings to avoid re-computation; vectors live in the compact store
+        # and section_embeddings keeps only chunk metadata
         self.document_embeddings = {}
         self.section_embeddings = {}
+        self.vector_store = VectorStore(precision=embedding_precision or os.getenv('EMBEDDING_PRECISION', 'int8'),
+                                        spill_dir=os.getenv('EMBEDDING_SPILL_DIR') or None)
+        
+        # Optional ANN index; semantic_search falls back to brute force without it
+        self.ann_index: Optional[IVFIndex] = None
+        self.ann_rerank_factor = 4  # PQ candidates fetched per result before exact rescoring
+        self.ann_unrescored_logged = False
+        self.ann_index_path = ann_index_path or os.getenv('ANN_INDEX_PATH')
+        if self.ann_index_path and os.path.exists(self.ann_index_path):
+            try:
+                self.load_ann_index(self.ann_index_path)
+            except Exception as e:
+                logger.error(f"Could not load ANN index from {self.ann_index_path}: {e}")
+        
+        # Persistent answer cache for llm_enhanced_search
+        self.response_cache: Optional[ResponseCache] = None
+        if cache_path is None:
+            cache_path = os.getenv('LLM_CACHE_PATH', DEFAULT_CACHE_PATH)
+        if semantic_cache_threshold is None and os.getenv('LLM_SEMANTIC_CACHE_THRESHOLD'):
+            semantic_cache_threshold = float(os.getenv('LLM_SEMANTIC_CACHE_THRESHOLD'))
+        if cache_path:
+            try:
+                self.response_cache = ResponseCache(cache_path, semantic_threshold=semantic_cache_threshold)
+            except Exception as e:
+                logger.error(f"Could not open LLM response cache at {cache_path}: {e}")
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
@@ -42,98 +113,384 @@ class LLMSearchEngine:
     
     def chunk_text(self, text: str, max_tokens: int = 1000, overlap: int = 100) -> List[str]:
         """Split text into smaller chunks for embedding"""
-        tokens = self.encoding.encode(text)
-        chunks = []
-        
-        for i in range(0, len(tokens), max_tokens - overlap):
-            chunk_tokens = tokens[i:i + max_tokens]
-            chunk_text = self.encoding.decode(chunk_tokens)
-            chunks.append(chunk_text)
-        
-        return chunks
+        return [chunk['text'] for chunk in self.chunk_page(text, max_tokens=max_tokens, overlap=overlap)]
+    
+    def chunk_page(self, text: str, page: Optional[int] = None, max_tokens: int = 800,
+                   overlap: int = 100) -> List[Dict[str, Any]]:
+        """Sentence-aligned chunks of one page with token counts and character offsets"""
+        return chunk_page(self.encoding, text, page=page, max_tokens=max_tokens, overlap=overlap)
     
     def get_embedding(self, text: str) -> List[float]:
         """Get embedding for text"""
         try:
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input=text
-            )
-            return response.data[0].embedding
+            return self.embedding_backend.embed_query(text)
         except Exception as e:
             logger.error(f"Error getting embedding: {e}")
             return []
     
+    def get_embeddings(self, texts: List[str], token_counts: List[int]) -> List[List[float]]:
+        """Embed many corpus texts as background work; failed items come back empty"""
+        try:
+            return self.embedding_backend.embed(texts, token_counts, background=True)
+        except Exception as e:
+            logger.error(f"Error getting embeddings: {e}")
+            return [[] for _ in texts]
+    
+    def chunk_document(self, doc_name: str, doc_data: Dict[str, Any]) -> List[tuple]:
+        """Chunk one document's sections; returns [(section_idx, section, chunk_idx, chunk)]"""
+        pending = []
+        for section_idx, section in enumerate(doc_data['sections']):
+            section_content = ' '.join(section['content'])
+            
+            # Skip very short sections
+            if len(section_content.strip()) < 50:
+                continue
+            
+            # Chunk large sections
+            chunks = self.chunk_page(section_content, page=section.get('page'), max_tokens=800)
+            pending.extend((section_idx, section, chunk_idx, chunk) for chunk_idx, chunk in enumerate(chunks))
+        return pending
+    
+    def embed_document(self, doc_name: str, pending: List[tuple], update_ann: bool = True) -> int:
+        """
+        Embed one document's chunks (from chunk_document) and make them searchable
+        
+        Chunks from an earlier indexing of the same document are replaced. With update_ann,
+        the chunks are added to an existing ANN index (without saving) so the document is
+        found at once; see update_ann_index.
+        
+        Returns:
+            Number of chunks embedded
+        """
+        logger.info(f"Processing embeddings for {doc_name}")
+        
+        # Embed the whole document at background priority so interactive queries go first
+        embeddings = self.get_embeddings([item[3]['text'] for item in pending],
+                                         [item[3]['token_count'] for item in pending])
+        
+        keys, vectors = [], []
+        for (section_idx, section, chunk_idx, chunk), embedding in zip(pending, embeddings):
+            if embedding:
+                section_key = f"{doc_name}_{section_idx}_{chunk_idx}"
+                keys.append(section_key)
+                vectors.append(embedding)
+                self.section_embeddings[section_key] = {
+                    'content': chunk['text'],
+                    'document': doc_name,
+                    'section': section,
+                    'section_index': section_idx,
+                    'chunk_index': chunk_idx,
+                    'page': chunk['page'],
+                    'char_start': chunk['char_start'],
+                    'char_end': chunk['char_end'],
+                    'token_start': chunk['token_start'],
+                    'token_end': chunk['token_end'],
+                    'token_count': chunk['token_count'],
+                    'lead_chars': chunk['lead_chars']
+                }
+        vectors = np.array(vectors, dtype=np.float32)
+        self.vector_store.add(keys, vectors)
+        
+        # New chunks are in place before stale ones go, so searches never see the document missing
+        current = set(keys)
+        stale = [key for key, data in list(self.section_embeddings.items())
+                 if data['document'] == doc_name and key not in current]
+        self.vector_store.remove(stale)
+        for key in stale:
+            self.section_embeddings.pop(key, None)
+        
+        if update_ann:
+            self.update_ann_index(keys, vectors, stale)
+        return len(keys)
+    
     def index_documents_with_embeddings(self, document_index: Dict[str, Any]):
         """Create embeddings for all document sections"""
         logger.info("Creating embeddings for document sections...")
         
-        for doc_name, doc_data in document_index.items():
-            logger.info(f"Processing embeddings for {doc_name}")
-            doc_embeddings = []
-            
-            for section_idx, section in enumerate(doc_data['sections']):
-                section_content = ' '.join(section['content'])
-                
-                # Skip very short sections
-                if len(section_content.strip()) < 50:
-                    continue
-                
-                # Chunk large sections
-                chunks = self.chunk_text(section_content, max_tokens=800)
-                
-                for chunk_idx, chunk in enumerate(chunks):
-                    embedding = self.get_embedding(chunk)
-                    if embedding:
-                        section_key = f"{doc_name}_{section_idx}_{chunk_idx}"
-                        self.section_embeddings[section_key] = {
-                            'embedding': embedding,
-                            'content': chunk,
-                            'document': doc_name,
-                            'section': section,
-                            'section_index': section_idx,
-                            'chunk_index': chunk_idx
-                        }
-        
-        logger.info(f"Created embeddings for {len(self.section_embeddings)} document chunks")
+        pending_by_doc = {doc_name: self.chunk_document(doc_name, doc_data)
+                          for doc_name, doc_data in document_index.items()}
+        
+        # Corpus-fitted backends (local LSA) train on the chunk texts before embedding them
+        self.embedding_backend.prepare([item[3]['text'] for pending in pending_by_doc.values() for item in pending])
+        
+        for doc_name, pending in pending_by_doc.items():
+            self.embed_document(doc_name, pending)
+        self.finish_indexing()
+    
+    def finish_indexing(self):
+        """Log the embedding store size and save an existing ANN index, rebuilt if it has drifted"""
+        store = self.vector_store.metrics()
+        logger.info(f"Created embeddings for {store['vectors']} document chunks "
+                    f"({store['memory_bytes'] / 1024 / 1024:.1f} MB as {store['precision']})")
+        
+        index = self.ann_index
+        if index is None:
+            return
+        if index.drifted() or index.dim != self.vector_store.dim:
+            self.build_ann_index(nprobe=index.nprobe, pq_m=index.pq_m)
+        elif self.ann_index_path:
+            self.save_ann_index(self.ann_index_path)
+    
+    def update_ann_index(self, keys: List[str], vectors: np.ndarray, removed: List[str] = ()):
+        """
+        Add new chunks to their nearest existing IVF lists and drop removed ones
+        
+        The index is only retrained (not saved) when the change makes it drift: it grew or
+        shrank a lot, new vectors fit its cells poorly, or their dimension no longer matches.
+        """
+        index = self.ann_index
+        if index is None:
+            return
+        if len(vectors) and vectors.shape[1] != index.dim:
+            logger.info(f"Embeddings are now {vectors.shape[1]}-dimensional; rebuilding the ANN index")
+            self.build_ann_index(nprobe=index.nprobe, pq_m=index.pq_m, save=False)
+            return
+        # Updated on a copy that replaces the index in one step, so searches never see it half-changed
+        updated = copy.copy(index)
+        updated.remove(list(keys) + list(removed))
+        updated.add(vectors, keys)
+        if updated.drifted():
+            logger.info(f"ANN index drifted ({len(updated)} vectors, {updated.trained} trained); rebuilding it")
+            self.build_ann_index(nprobe=index.nprobe, pq_m=index.pq_m, save=False)
+        else:
+            self.ann_index = updated
+    
+    def build_ann_index(self, nlist: int = None, nprobe: int = 8, pq_m: int = 0, save: bool = True) -> Optional[IVFIndex]:
+        """
+        Build an approximate nearest-neighbor index from the stored embeddings
+        
+        Args:
+            nlist: Number of IVF cells (default: about sqrt of the chunk count)
+            nprobe: Cells scanned per query; raise for recall, lower for latency
+            pq_m: Product-quantization subvectors (0 keeps full vectors in the index)
+            save: Write the index to ann_index_path when one is configured
+        """
+        keys = self.vector_store.keys()
+        if not keys:
+            logger.warning("No embeddings available to build an ANN index")
+            return None
+        
+        vectors = self.vector_store.vectors(keys)
+        index = IVFIndex(nlist=nlist, nprobe=nprobe, pq_m=pq_m)
+        index.build(vectors, keys)
+        self.ann_index = index
+        
+        if save and self.ann_index_path:
+            self.save_ann_index(self.ann_index_path)
+        return index
+    
+    def _ann_metadata_path(self, path: str) -> str:
+        return os.path.splitext(path)[0] + '.meta.json'
+    
+    def _ann_vectors_path(self, path: str) -> str:
+        return os.path.splitext(path)[0] + '.vectors.npz'
+    
+    def save_ann_index(self, path: str):
+        """
+        Save the ANN index plus what is needed to serve results after a restart: the chunk
+        metadata and, for a PQ index, the full vectors its candidates are rescored with
+        """
+        index = self.ann_index
+        index.save(path)
+        with open(self._ann_metadata_path(path), 'w', encoding='utf-8') as f:
+            json.dump(self.section_embeddings, f, default=str)
+        if index.pq_m:
+            keys = [str(key) for key in index.keys if key in self.vector_store]
+            np.savez(self._ann_vectors_path(path), keys=np.array(keys), vectors=self.vector_store.vectors(keys))
+    
+    def load_ann_index(self, path: str):
+        """
+        Load a saved ANN index, restoring chunk metadata and rescoring vectors for any chunks
+        not yet in memory
+        
+        Raises:
+            ValueError: The index holds vectors of another dimension than the embedding backend's
+        """
+        index = IVFIndex.load(path)
+        expected = self.embedding_backend.dimension or self.vector_store.dim
+        if expected is not None and index.dim != expected:
+            raise ValueError(f"ANN index holds {index.dim}-dimensional vectors, but the "
+                             f"{self.embedding_backend.name} embedding backend produces {expected}")
+        
+        if index.pq_m:
+            vectors_path = self._ann_vectors_path(path)
+            if os.path.exists(vectors_path):
+                with np.load(vectors_path, allow_pickle=False) as arrays:
+                    missing = [i for i, key in enumerate(arrays['keys']) if key not in self.vector_store]
+                    self.vector_store.add([str(key) for key in arrays['keys'][missing]], arrays['vectors'][missing])
+            else:
+                logger.warning(f"No stored vectors next to {path}; PQ scores are not rescored "
+                               f"until the documents are embedded again")
+        metadata_path = self._ann_metadata_path(path)
+        if os.path.exists(metadata_path):
+            with open(metadata_path, encoding='utf-8') as f:
+                for key, data in json.load(f).items():
+                    self.section_embeddings.setdefault(key, data)
+        self.ann_index = index
+    
+    def _ann_search(self, index: IVFIndex, query_embedding: List[float], top_k: int,
+                    similarity_threshold: float, allowed: Optional[Callable[[str], bool]] = None) -> List[Dict[str, Any]]:
+        """
+        Semantic search through the ANN index
+        
+        PQ candidates are rescored exactly when every one has its full vector stored; scores
+        are never mixed, so with any missing the approximate PQ scores are used for all.
+        """
+        query = normalize(query_embedding)
+        candidates = top_k * self.ann_rerank_factor if index.pq_m else top_k
+        
+        found = [(key, score) for key, score in index.search(query, top_k=candidates, allowed=allowed)
+                 if key in self.section_embeddings]
+        if index.pq_m and found:
+            keys = [key for key, _ in found]
+            if all(key in self.vector_store for key in keys):
+                found = list(zip(keys, self.vector_store.similarities(keys, query).tolist()))
+            elif not self.ann_unrescored_logged:
+                self.ann_unrescored_logged = True
+                logger.warning("Full vectors missing for some ANN candidates; using unrescored PQ scores")
+        
+        similarities = []
+        for section_key, similarity in found:
+            section_data = self.section_embeddings.get(section_key)
+            if section_data and similarity >= similarity_threshold:
+                similarities.append({
+                    'section_key': section_key,
+                    'similarity': similarity,
+                    'data': section_data
+                })
+        
+        similarities.sort(key=lambda x: x['similarity'], reverse=True)
+        return similarities[:top_k]
     
-    def semantic_search(self, query: str, top_k: int = 10, similarity_threshold: float = 0.7) -> List[Dict[str, Any]]:
-        """Perform semantic search using embeddings"""
+    def semantic_search(self, query: str, top_k: int = 10, similarity_threshold: float = None,
+                        documents: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Perform semantic search using embeddings
+        
+        With documents, only their chunks are ranked, so a scoped search still gets top_k
+        matches rather than whatever of the corpus-wide top_k falls in scope.
+        """
         if not self.section_embeddings:
             return []
+        if similarity_threshold is None:
+            similarity_threshold = self.similarity_threshold
+        allowed = None
+        if documents:
+            scope = set(documents)
+            allowed = lambda key: self.section_embeddings.get(key, {}).get('document') in scope
         
         # Get query embedding
         query_embedding = self.get_embedding(query)
         if not query_embedding:
             return []
         
-        # Calculate similarities
+        index = self.ann_index
+        if index is not None and len(query_embedding) == index.dim:
+            return self._ann_search(index, query_embedding, top_k, similarity_threshold, allowed)
+        
+        # Scan the compact embedding matrix and rescore the best candidates at full precision
+        if len(query_embedding) != self.vector_store.dim:
+            return []
         similarities = []
-        for section_key, section_data in self.section_embeddings.items():
-            similarity = cosine_similarity(
-                [query_embedding], 
-                [section_data['embedding']]
-            )[0][0]
-            
-            if similarity >= similarity_threshold:
+        for section_key, similarity in self.vector_store.search(query_embedding, top_k, allowed=allowed):
+            # A chunk can be dropped by re-indexing between the scan and this lookup
+            section_data = self.section_embeddings.get(section_key)
+            if section_data and similarity >= similarity_threshold:
                 similarities.append({
                     'section_key': section_key,
                     'similarity': similarity,
                     'data': section_data
                 })
+        return similarities
+    
+    def pack_context(self, matches: List[Dict[str, Any]], max_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS):
+        """
+        Build LLM context from semantic matches within a token budget
         
-        # Sort by similarity and return top_k
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        return similarities[:top_k]
+        Chunks are taken greedily in score order. Overlapping or adjacent chunks of the same
+        section are merged into one passage so shared text is sent once, and costs come from
+        the token counts cached at chunking time.
+        
+        Returns:
+            (context, token_count) where token_count is the packed context's token estimate
+        """
+        selected: Dict[tuple, Dict[int, Dict[str, Any]]] = {}  # (document, section_index) -> {chunk_index: data}
+        headers: Dict[tuple, str] = {}
+        used = 0
+        
+        for match in matches:
+            data = match['data']
+            group = (data['document'], data.get('section_index'))
+            chunks = selected.get(group, {})
+            chunk_idx = data.get('chunk_index', 0)
+            if chunk_idx in chunks:
+                continue
+            
+            cost = data.get('token_count') or self.count_tokens(data['content'])
+            for neighbour_idx in (chunk_idx - 1, chunk_idx + 1):
+                neighbour = chunks.get(neighbour_idx)
+                if neighbour is not None:
+                    cost -= self._chunk_overlap(*sorted([neighbour, data], key=lambda c: c.get('chunk_index', 0)))
+            if group not in headers:
+                section = data['section']
+                header = f"\n--- {data['document']} - {section['title']} (Page {section.get('page', 'Unknown')}) ---\n"
+                cost += self.count_tokens(header)
+            
+            if used + cost > max_tokens:
+                continue
+            used += cost
+            if group not in headers:
+                headers[group] = header
+            selected.setdefault(group, {})[chunk_idx] = data
+        
+        context = ""
+        for group, chunks in selected.items():
+            context += headers[group]
+            previous = None
+            for chunk_idx in sorted(chunks):
+                data = chunks[chunk_idx]
+                if previous is not None and chunk_idx == previous.get('chunk_index', 0) + 1:
+                    # Continue the passage, skipping text the previous chunk already sent
+                    context += data['content'][data.get('lead_chars', 0):] if self._chunk_overlap(previous, data) else data['content']
+                else:
+                    context += ("\n...\n" if previous is not None else "") + data['content']
+                previous = data
+            context += "\n\n"
+        
+        return context, used
+    
+    @staticmethod
+    def _chunk_overlap(first: Dict[str, Any], second: Dict[str, Any]) -> int:
+        """Tokens shared by two consecutive chunks of a section"""
+        if 'token_end' not in first or 'token_start' not in second:
+            return 0
+        return max(0, first['token_end'] - second['token_start'])
     
-    def llm_enhanced_search(self, query: str, document_context: str, max_context_tokens: int = 3000) -> Dict[str, Any]:
-        """Use LLM to analyze query and provide intelligent responses"""
+    def _cached_answer(self, query: str, context_hash: str):
+        """Look up a cached answer; returns (cached result or None, query embedding if one was computed)"""
+        if not self.response_cache:
+            return None, None
+        query_embedding = None
+        cached = self.response_cache.get(query, context_hash, self.model, PROMPT_VERSION)
+        if cached is None and self.response_cache.semantic_threshold is not None:
+            query_embedding = self.get_embedding(query)
+            cached = self.response_cache.get_similar(query_embedding, context_hash, self.model, PROMPT_VERSION)
+        if cached is None:
+            self.response_cache.record_miss()
+        return cached, query_embedding
+    
+    def _build_messages(self, query: str, document_context: str, max_context_tokens: int,
+                        context_tokens: Optional[int]):
+        """Truncate the context to the budget and build the chat prompt; returns (messages, token estimate)"""
         
         # Truncate context if too long
-        if self.count_tokens(document_context) > max_context_tokens:
+        if context_tokens is None:
+            context_tokens = self.count_tokens(document_context)
+        if context_tokens > max_context_tokens:
             tokens = self.encoding.encode(document_context)
             truncated_tokens = tokens[:max_context_tokens]
             document_context = self.encoding.decode(truncated_tokens)
+            context_tokens = max_context_tokens
         
         system_prompt = """You are an expert assistant helping users find information in technical documents. 
 
@@ -158,20 +515,62 @@ Please provide a helpful response based on the document content. Include:
 - Page numbers or section references when available
 - If multiple documents contain relevant info, organize by document
 """
-
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        # Rate-limit estimate: context, prompt boilerplate and the completion ceiling
+        return messages, context_tokens + PROMPT_OVERHEAD_TOKENS + MAX_COMPLETION_TOKENS
+    
+    def llm_enhanced_search(self, query: str, document_context: str, max_context_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS,
+                            context_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Use LLM to analyze query and provide intelligent responses
+        
+        Pass context_tokens when the caller already knows the context size (e.g. from
+        pack_context) to skip re-encoding it here.
+        """
+        
+        # Serve repeat questions over the same context from the cache
+        context_hash = hash_text(f"{max_context_tokens}:{document_context}")
+        cached, query_embedding = self._cached_answer(query, context_hash)
+        if cached is not None:
+            return {
+                'response': cached['response'],
+                'tokens_used': 0,
+                'tokens_saved': cached['tokens_used'],
+                'cached': cached['cache'],
+                'model': self.model
+            }
+        
+        if self.scheduler is None:
+            return {
+                'response': "LLM answers need an OpenAI API key; semantic search is running locally.",
+                'tokens_used': 0,
+                'model': self.model
+            }
+        
+        messages, estimated_tokens = self._build_messages(query, document_context, max_context_tokens, context_tokens)
+        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.1  # Lower temperature for more factual responses
+            response = self.scheduler.run(
+                lambda client: client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=MAX_COMPLETION_TOKENS,
+                    temperature=0.1  # Lower temperature for more factual responses
+                ),
+                tokens=estimated_tokens,
+                priority=INTERACTIVE
             )
             
+            answer = response.choices[0].message.content
+            if self.response_cache:
+                self.response_cache.put(query, context_hash, self.model, PROMPT_VERSION,
+                                        answer, response.usage.total_tokens, query_embedding)
+            
             return {
-                'response': response.choices[0].message.content,
+                'response': answer,
                 'tokens_used': response.usage.total_tokens,
                 'model': self.model
             }
@@ -184,6 +583,90 @@ Please provide a helpful response based on the document content. Include:
                 'model': self.model
             }
     
+    def stream_enhanced_search(self, query: str, document_context: str,
+                               max_context_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS,
+                               context_tokens: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of llm_enhanced_search
+        
+        Yields {'type': 'token', 'content': ...} events as the completion arrives, then one
+        {'type': 'done', ...} event with the full response and usage totals, or
+        {'type': 'error', 'error': ...} if the API call fails.
+        """
+        context_hash = hash_text(f"{max_context_tokens}:{document_context}")
+        cached, query_embedding = self._cached_answer(query, context_hash)
+        if cached is not None:
+            yield {'type': 'token', 'content': cached['response']}
+            yield {
+                'type': 'done',
+                'response': cached['response'],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+                'tokens_saved': cached['tokens_used'],
+                'cached': cached['cache'],
+                'model': self.model
+            }
+            return
+        
+        if self.scheduler is None:
+            yield {'type': 'error', 'error': "LLM answers need an OpenAI API key; semantic search is running locally."}
+            return
+        
+        messages, estimated_tokens = self._build_messages(query, document_context, max_context_tokens, context_tokens)
+        
+        try:
+            stream = self.scheduler.stream(
+                lambda client: client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=MAX_COMPLETION_TOKENS,
+                    temperature=0.1,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ),
+                tokens=estimated_tokens,
+                priority=INTERACTIVE
+            )
+            
+            parts = []
+            usage = None
+            for chunk in stream:
+                # The usage totals arrive in a final chunk with no choices
+                if getattr(chunk, 'usage', None):
+                    usage = {
+                        'prompt_tokens': chunk.usage.prompt_tokens,
+                        'completion_tokens': chunk.usage.completion_tokens,
+                        'total_tokens': chunk.usage.total_tokens
+                    }
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    parts.append(content)
+                    yield {'type': 'token', 'content': content}
+        
+        except Exception as e:
+            logger.error(f"LLM streaming API error: {e}")
+            yield {'type': 'error', 'error': f"Error processing query with LLM: {str(e)}"}
+            return
+        
+        answer = ''.join(parts)
+        if usage is None:
+            # Servers that ignore stream_options: estimate from the prompt and answer
+            prompt_tokens = sum(self.count_tokens(m['content']) for m in messages)
+            completion_tokens = self.count_tokens(answer)
+            usage = {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+                'estimated': True
+            }
+        
+        if self.response_cache:
+            self.response_cache.put(query, context_hash, self.model, PROMPT_VERSION,
+                                    answer, usage['total_tokens'], query_embedding)
+        
+        yield {'type': 'done', 'response': answer, 'usage': usage, 'model': self.model}
+    
     def hybrid_search(self, query: str, document_index: Dict[str, Any], 
                      use_semantic: bool = True, use_llm: bool = True,
                      top_k: int = 5) -> Dict[str, Any]:
@@ -202,20 +685,15 @@ Please provide a helpful response based on the document content. Include:
             semantic_results = self.semantic_search(query, top_k=top_k)
             results['semantic_matches'] = semantic_results
             
-            # Collect context from semantic matches
-            semantic_context = ""
-            for result in semantic_results[:3]:  # Top 3 matches
-                section_data = result['data']
-                section = section_data['section']
-                semantic_context += f"\n--- {section_data['document']} - {section['title']} (Page {section.get('page', 'Unknown')}) ---\n"
-                semantic_context += section_data['content']
-                semantic_context += "\n\n"
+            # Pack as many matches as fit the context budget, without repeating overlaps
+            semantic_context, context_tokens = self.pack_context(semantic_results)
             
             # Step 2: LLM Analysis
             if use_llm and semantic_context.strip():
-                llm_result = self.llm_enhanced_search(query, semantic_context)
+                llm_result = self.llm_enhanced_search(query, semantic_context, context_tokens=context_tokens)
                 results['llm_response'] = llm_result['response']
                 results['tokens_used'] = llm_result.get('tokens_used', 0)
+                results['tokens_saved'] = llm_result.get('tokens_saved', 0)
             
             # Step 3: Format combined results
             for result in semantic_results:
@@ -245,6 +723,44 @@ def create_llm_search_engine():
         return None
 
 # Integration helpers
+def build_results_context(results: List[Dict], limit: int = 5) -> str:
+    """Combine keyword search results into LLM context with document and page headers"""
+    context = ""
+    for result in results[:limit]:
+        section_title = result.get('section_title', result.get('section', ''))
+        context += f"\n--- {result['document']} - {section_title} (Page {result.get('page', 'Unknown')}) ---\n"
+        context += result.get('context', '')
+        context += "\n\n"
+    return context
+
+def cited_pages(answer: str, results: List[Dict], limit: int = 5) -> List[Dict[str, Any]]:
+    """Source pages from the context that the answer refers to by page number"""
+    mentioned = {int(n) for n in re.findall(r'\b(?:page|p\.)\s*(\d+)', answer, re.IGNORECASE)}
+    pages = []
+    for result in results[:limit]:
+        source = {'document': result['document'], 'page': result.get('page')}
+        if source['page'] in mentioned and source not in pages:
+            pages.append(source)
+    return pages
+
+def semantic_matches_to_results(matches: List[Dict[str, Any]], context_chars: int = 200) -> List[Dict]:
+    """Reshape semantic_search matches into the keyword search result format"""
+    results = []
+    for match in matches:
+        section_data = match['data']
+        section = section_data['section']
+        results.append({
+            'document': section_data['document'],
+            'section': section.get('title', ''),
+            'page': section.get('page'),
+            'context': section_data['content'][:context_chars],
+            'relevance': float(match['similarity']),
+            # Exact location of the matched chunk in the page text, for highlighting
+            'char_start': section_data.get('char_start'),
+            'char_end': section_data.get('char_end')
+        })
+    return results
+
 def enhance_existing_search_with_llm(query: str, existing_results: List[Dict], 
                                    llm_engine: LLMSearchEngine) -> Dict[str, Any]:
     """Enhance existing keyword search results with LLM analysis"""
@@ -252,11 +768,7 @@ def enhance_existing_search_with_llm(query: str, existing_results: List[Dict],
         return {'enhanced_response': 'No results to enhance'}
     
     # Combine context from existing results
-    context = ""
-    for result in existing_results[:5]:  # Top 5 results
-        context += f"\n--- {result['document']} - {result['section_title']} (Page {result.get('page', 'Unknown')}) ---\n"
-        context += result.get('context', '')
-        context += "\n\n"
+    context = build_results_context(existing_results)
     
     # Get LLM analysis
     llm_result = llm_engine.llm_enhanced_search(query, context)
@@ -264,5 +776,6 @@ def enhance_existing_search_with_llm(query: str, existing_results: List[Dict],
     return {
         'enhanced_response': llm_result['response'],
         'original_results_count': len(existing_results),
-        'tokens_used': llm_result.get('tokens_used', 0)
+        'tokens_used': llm_result.get('tokens_used', 0),
+        'tokens_saved': llm_result.get('tokens_saved', 0)
     }
@@ -4,18 +4,44 @@ Stable version of the Flask backend with memory optimizations and robust PDF ext
 
 import os
 import sys
+import hmac
 import json
+import io
+import uuid
 import logging
-import re
-from typing import Dict, List, Any, Optional
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Dict, List, Any, Optional, Tuple
 from functools import lru_cache
-from dataclasses import dataclass, asdict
 
 import psutil
 import fitz  # PyMuPDF - more stable than pdfplumber
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 
+from api_responses import api_response, make_etag, not_modified
+from disk_cache import file_fingerprint
+from documents import FITZ_LOCK, DocumentData, PageWords, extract_document, search_sections
+from measurements import MeasurementIndex, SI_UNITS, parse_range
+from memory_accounting import MemoryAccounting
+from near_duplicates import DuplicateIndex
+from page_pdfs import MAX_PAGES, PageRangeCache
+from page_store import PageStore
+from previews import FORMATS, PreviewCache, available_formats, clamp_width
+from profiling import RequestProfiler
+from shards import ShardPool
+from spelling import SymSpellDictionary, tokenize
+from suggest import SuggestionIndex
+
+# LLM features are optional - they need openai, tiktoken and numpy
+try:
+    from llm_search import create_llm_search_engine, semantic_matches_to_results, build_results_context, cited_pages
+    LLM_AVAILABLE = True
+except ImportError as e:
+    LLM_AVAILABLE = False
+    logging.getLogger(__name__).info(f"LLM features disabled: {e}")
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -44,8 +70,65 @@ def log_memory(stage=""):
         return 0
 
 # Global variables - now optimized for minimal memory usage
+
+# MEMORY_ACCOUNTING=1 traces Python allocations to report each document's load and index cost
+# (in /api/documents and /api/health). Tracing slows loads and adds its own memory, so it is off by default.
+memory_accounting = MemoryAccounting()
+if os.environ.get('MEMORY_ACCOUNTING', '').lower() in ('1', 'true', 'yes'):
+    memory_accounting.start()
 document_index = {}  # Only metadata: {filename: {title, sections_count, file_path}}
 document_cache = {}  # LRU cache will be handled manually, max 2 documents
+spelling_dictionary = SymSpellDictionary()  # Corpus vocabulary for typo-tolerant search
+measurement_index = MeasurementIndex()  # Number-unit pairs in SI, for range queries like "above 100 dB"
+suggestion_index = SuggestionIndex()  # Weighted corpus terms and phrases for /api/suggest
+duplicate_index = DuplicateIndex()  # MinHash clusters of near-identical pages across documents (revisions)
+# Every extracted page, compressed, so documents evicted from the LRU below are never re-extracted
+page_store = PageStore(hot_blocks=int(os.environ.get('PAGE_STORE_HOT_BLOCKS', 256)))
+llm_engine = None  # Created on startup when LLM dependencies are available
+index_version = ''  # Changes whenever the indexed files do; part of every response ETag
+
+# Hybrid search runs its keyword and semantic legs side by side
+hybrid_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid")
+HYBRID_KEYWORD_TIMEOUT = float(os.environ.get('HYBRID_KEYWORD_TIMEOUT', 5.0))
+HYBRID_SEMANTIC_TIMEOUT = float(os.environ.get('HYBRID_SEMANTIC_TIMEOUT', 3.0))
+HYBRID_DEADLINE_GRACE = 0.25  # Seconds allowed past the keyword deadline to return partial hits
+RRF_K = 60  # Standard reciprocal rank fusion damping constant
+
+# Keyword search waits for document loads only until its deadline; loads run on their own pool
+SEARCH_DEADLINE_MS = float(os.environ.get('SEARCH_DEADLINE_MS', 3000))
+SEARCH_MAX_DEADLINE_MS = float(os.environ.get('SEARCH_MAX_DEADLINE_MS', 30000))
+document_loader = ThreadPoolExecutor(max_workers=4, thread_name_prefix="loader")
+loading_documents = {}  # file_path -> Future of the load in flight
+loading_lock = threading.Lock()
+
+# Documents are embedded for semantic search in the background after startup
+embedding_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")  # One document at a time
+embedding_status = {}  # {filename: {status: pending|embedding|waiting|ready|failed, chunks, ...}}
+
+# Keyword search can fan out to worker processes holding the documents: a count, or 'auto'.
+# Off by default (0 or 1 = search in-process), since every worker is another Python process to host
+SEARCH_SHARDS = os.environ.get('SEARCH_SHARDS', '0')
+shard_pool = None
+
+# Page previews are rendered on demand into a bounded disk cache; top search hits are rendered ahead
+PREVIEW_CACHE_DIR = os.environ.get('PREVIEW_CACHE_DIR', os.path.join(os.path.dirname(__file__), "..", "cache", "previews"))
+PREVIEW_CACHE_MB = float(os.environ.get('PREVIEW_CACHE_MB', 200))
+PREVIEW_PRERENDER_HITS = int(os.environ.get('PREVIEW_PRERENDER_HITS', 5))
+preview_cache = None
+preview_cache_lock = threading.Lock()
+
+# Page-range PDFs for cited clauses, cut once per document version and range
+PAGE_PDF_CACHE_DIR = os.environ.get('PAGE_PDF_CACHE_DIR', os.path.join(os.path.dirname(__file__), "..", "cache", "pages"))
+PAGE_PDF_CACHE_MB = float(os.environ.get('PAGE_PDF_CACHE_MB', 100))
+page_pdf_cache = None
+
+# Slow requests are logged with their query and server state; profiled ones (X-Profile: 1, or
+# PROFILE_SAMPLE_RATE of all requests) also carry stack samples. ADMIN_TOKEN enables the viewer.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 1000))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 100))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+UNPROFILED_PATHS = ('/api/health', '/api/admin/')
 
 # French to English translation map for search terms
 french_to_english = {
@@ -127,92 +210,23 @@ french_to_english = {
     "recherche": ["research"]
 }
 
-@dataclass
-class DocumentSection:
-    title: str
-    content: str
-    page: int
-
-@dataclass 
-class DocumentData:
-    title: str
-    sections: List[DocumentSection]
-    full_text: str
-
-def clean_text(text: str) -> str:
-    """Clean and normalize text"""
-    if not text:
-        return ""
-    
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'\n\s*\n', '\n', text)
-    
-    # Remove common PDF artifacts
-    text = re.sub(r'[^\w\s\-.,;:()!?"\'/]', ' ', text)
-    
-    return text.strip()
-
 @lru_cache(maxsize=2)  # Only cache 2 documents at a time to save memory
 def get_document_data(file_path: str) -> Optional[DocumentData]:
-    """Load document data on-demand with caching"""
-    try:
-        logger.info(f"Loading document data for: {file_path}")
-        
-        if not os.path.exists(file_path):
-            logger.error(f"File not found: {file_path}")
-            return None
-            
-        # Extract text using stable PyMuPDF
-        doc = fitz.open(file_path)
-        sections = []
-        full_text = ""
-        
-        for page_num in range(len(doc)):
-            try:
-                page = doc[page_num]
-                page_text = page.get_text()
-                
-                if page_text.strip():
-                    cleaned_text = clean_text(page_text)
-                    if cleaned_text:
-                        section = DocumentSection(
-                            title=f"Page {page_num + 1}",
-                            content=cleaned_text,
-                            page=page_num + 1
-                        )
-                        sections.append(section)
-                        full_text += cleaned_text + "\n"
-                        
-                        if (page_num + 1) % 50 == 0:
-                            logger.info(f"Processed {page_num + 1} pages")
-                            
-            except Exception as e:
-                logger.warning(f"Error processing page {page_num + 1}: {e}")
-                continue
-                
-        doc.close()
-        
-        if not sections:
-            logger.warning(f"No text extracted from {file_path}")
-            return None
-            
-        document_data = DocumentData(
-            title=os.path.basename(file_path),
-            sections=sections,
-            full_text=full_text
-        )
-        
-        logger.info(f"Successfully loaded {len(sections)} sections from {file_path}")
-        return document_data
-        
-    except Exception as e:
-        logger.error(f"Error loading document {file_path}: {e}")
-        return None
+    """Load document data on-demand with caching: from the page store, or by extracting it once"""
+    version = file_fingerprint(file_path)
+    doc_data = page_store.document(os.path.basename(file_path), version)
+    if doc_data is not None:
+        return doc_data
+    with memory_accounting.document_load(file_path):
+        doc_data = extract_document(file_path)
+    if doc_data:
+        with memory_accounting.index_update('page_store', doc_data.title):
+            page_store.add_document(doc_data, version)
+    return doc_data
 
 def index_documents():
     """Index documents - store only metadata to save memory"""
-    global document_index
+    global document_index, index_version
     
     log_memory("at startup")
     
@@ -234,9 +248,10 @@ def index_documents():
             logger.info(f"Indexing metadata for: {filename}")
             
             # Quick check to count sections without loading full content
-            doc = fitz.open(file_path)
-            sections_count = len(doc)  # Number of pages
-            doc.close()
+            with FITZ_LOCK:
+                doc = fitz.open(file_path)
+                sections_count = len(doc)  # Number of pages
+                doc.close()
             
             # Store only metadata - no content in memory
             document_index[filename] = {
@@ -245,68 +260,310 @@ def index_documents():
                 'file_path': file_path
             }
             
+            # Feed the vocabulary and measurements into their indexes; the text itself is not kept
+            doc_data = get_document_data(file_path)
+            if doc_data:
+                # Pages identical to one of an earlier document (an unchanged page of a revision) are counted once
+                with memory_accounting.index_update('duplicates', filename):
+                    copies = duplicate_index.add_document(doc_data)
+                with memory_accounting.index_update('spelling', filename):
+                    spelling_dictionary.add_text(''.join(section.content + "\n" for section in doc_data.sections
+                                                         if section.page not in copies))
+                with memory_accounting.index_update('measurements', filename):
+                    measurement_index.add_document(doc_data, copies)
+                with memory_accounting.index_update('suggestions', filename):
+                    suggestion_index.add_document(doc_data, skip_pages=copies)
+            
             logger.info(f"Indexed {filename}: {sections_count} sections")
             
         except Exception as e:
             logger.error(f"Error indexing {filename}: {e}")
             continue
     
+    # French search keys are valid input too, so typos in them can be corrected
+    with memory_accounting.index_update('spelling'):
+        for french_term in french_to_english:
+            spelling_dictionary.add_words(tokenize(french_term))
+    
+    # French keys complete too, ranked by how often their English translations occur
+    with memory_accounting.index_update('suggestions'):
+        for french_term, english_translations in french_to_english.items():
+            weight = max(suggestion_index.counts.get(term, 0) for term in english_translations)
+            suggestion_index.add_term(french_term, max(weight, 1), 'french', note=', '.join(english_translations))
+    
+    with memory_accounting.index_update('measurements'):
+        measurement_index.finalize()
+    with memory_accounting.index_update('suggestions'):
+        suggestion_index.finalize()
+    with memory_accounting.index_update('page_store'):
+        page_store.finalize()
+    with memory_accounting.index_update('duplicates'):
+        duplicate_index.finalize()
+    
+    index_version = make_etag(*sorted(
+        (filename, os.path.getsize(info['file_path']), os.path.getmtime(info['file_path']))
+        for filename, info in document_index.items()
+    ))
+    
     log_memory("after indexing metadata")
-    logger.info(f"Indexing complete. {len(document_index)} documents indexed.")
+    logger.info(f"Indexing complete. {len(document_index)} documents indexed, "
+                f"{len(spelling_dictionary)} vocabulary terms.")
+
+def search_shard_count() -> int:
+    """Worker processes for keyword search: SEARCH_SHARDS, or for 'auto' one per document up to the CPU count"""
+    if SEARCH_SHARDS != 'auto':
+        return int(SEARCH_SHARDS)
+    return min(len(document_index), os.cpu_count() or 1, 8)
+
+def llm_document(doc_data: DocumentData) -> Dict[str, Any]:
+    """Shape extracted pages the way LLMSearchEngine expects: sections with list content and a number"""
+    return {'sections': [
+        {'title': section.title, 'number': str(section.page), 'content': [section.content], 'page': section.page}
+        for section in doc_data.sections
+    ]}
 
-def search_documents(query: str, selected_documents: List[str] = None) -> List[Dict]:
-    """Search documents with on-demand loading"""
+def embed_chunks(filename: str, pending: List[tuple]):
+    """Embed one document's chunks and record the outcome in embedding_status"""
+    started = time.monotonic()
+    embedding_status[filename] = {'status': 'embedding', 'chunks': len(pending)}
+    try:
+        count = llm_engine.embed_document(filename, pending)
+        embedding_status[filename] = {
+            'status': 'ready',
+            'chunks': count,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+        }
+        logger.info(f"Semantic search ready for {filename}: {count} chunks")
+    except Exception as e:
+        logger.error(f"Error embedding {filename}: {e}")
+        embedding_status[filename] = {'status': 'failed', 'error': str(e)}
+
+def embed_documents(filenames: List[str]):
+    """
+    Embed documents one at a time on the background worker
+    
+    Each document becomes available to semantic search as soon as its own embeddings are
+    stored; keyword search is unaffected meanwhile. A corpus-fitted backend that has no model
+    yet (local LSA on first start) is fitted once every document is chunked.
+    """
+    deferred = []
+    for filename in filenames:
+        embedding_status[filename] = {'status': 'embedding'}
+        try:
+            doc_data = get_document_data(document_index[filename]['file_path'])
+            if not doc_data:
+                raise ValueError("no text could be extracted")
+            pending = llm_engine.chunk_document(filename, llm_document(doc_data))
+        except Exception as e:
+            logger.error(f"Error preparing {filename} for embedding: {e}")
+            embedding_status[filename] = {'status': 'failed', 'error': str(e)}
+            continue
+        
+        if llm_engine.embedding_backend.ready:
+            embed_chunks(filename, pending)
+        else:
+            embedding_status[filename] = {'status': 'waiting', 'chunks': len(pending)}
+            deferred.append((filename, pending))
+    
+    if deferred:
+        try:
+            llm_engine.embedding_backend.prepare([item[3]['text'] for _, pending in deferred for item in pending])
+        except Exception as e:
+            logger.error(f"Error fitting the embedding model: {e}")
+            for filename, _ in deferred:
+                embedding_status[filename] = {'status': 'failed', 'error': str(e)}
+            return
+        for filename, pending in deferred:
+            embed_chunks(filename, pending)
+    
+    llm_engine.finish_indexing()
+
+def start_background_embedding(filenames: List[str] = None):
+    """Queue documents for embedding on the background worker"""
+    filenames = list(filenames or document_index)
+    for filename in filenames:
+        embedding_status[filename] = {'status': 'pending'}
+    return embedding_executor.submit(embed_documents, filenames)
+
+def correct_query(query: str) -> Optional[str]:
+    """Return a "did you mean" correction for the query, or None if every word is known"""
+    query_lower = query.lower().strip()
+    corrected = spelling_dictionary.correct_phrase(query_lower)
+    return corrected if corrected != query_lower else None
+
+def translate_terms(query_lower: str) -> set:
+    """Expand a query with English translations of any French terms it contains"""
+    terms = set([query_lower])
+    for french_term, english_translations in french_to_english.items():
+        if french_term in query_lower:
+            terms.update(english_translations)
+    return terms
+
+def fuzzy_terms_for(query_lower: str) -> set:
+    """Typo-tolerant variants: the corrected query, plus close words for one-word queries"""
+    terms = set()
+    corrected = correct_query(query_lower)
+    if corrected:
+        terms.update(translate_terms(corrected))
+    
+    words = tokenize(query_lower, spelling_dictionary.min_word_length)
+    if len(words) == 1 and words[0] not in spelling_dictionary:
+        terms.update(spelling_dictionary.expand(words[0]))
+    return terms
+
+def highlight_terms(search: str) -> List[str]:
+    """Terms to mark on a page preview: the search phrase, its translations and its words"""
+    search_lower = search.replace('"', '').strip().lower()
+    if not search_lower:
+        return []
+    return sorted(translate_terms(search_lower) | set(tokenize(search_lower, spelling_dictionary.min_word_length)))
+
+def loaded_page_words(file_path: str, page: int) -> Optional[PageWords]:
+    """Word boxes of a page from the page store, or None if its document has not been extracted"""
+    section = page_store.page(os.path.basename(file_path), page, file_fingerprint(file_path))
+    return section.words if section is not None else None
+
+def get_preview_cache() -> PreviewCache:
+    """The shared preview cache, created on first use"""
+    global preview_cache
+    with preview_cache_lock:
+        if preview_cache is None:
+            preview_cache = PreviewCache(PREVIEW_CACHE_DIR, max_bytes=int(PREVIEW_CACHE_MB * 1024 * 1024),
+                                         page_words=loaded_page_words)
+        return preview_cache
+
+def get_page_pdf_cache() -> PageRangeCache:
+    """The shared page-range PDF cache, created on first use"""
+    global page_pdf_cache
+    with preview_cache_lock:
+        if page_pdf_cache is None:
+            page_pdf_cache = PageRangeCache(PAGE_PDF_CACHE_DIR, max_bytes=int(PAGE_PDF_CACHE_MB * 1024 * 1024))
+        return page_pdf_cache
+
+def prerender_previews(query: str, results: List[Dict]):
+    """Queue previews of the top hits' pages, as the results viewer will request them"""
+    pages = []
+    for result in results:
+        info = document_index.get(result['document'])
+        if info is not None and (info['file_path'], result['page']) not in pages:
+            pages.append((info['file_path'], result['page']))
+        if len(pages) >= PREVIEW_PRERENDER_HITS:
+            break
+    if pages:
+        get_preview_cache().prerender(pages, highlight_terms(query))
+
+def load_document_async(file_path: str) -> Future:
+    """Load a document on the loader pool, sharing one in-flight load between concurrent requests"""
+    with loading_lock:
+        future = loading_documents.get(file_path)
+        if future is not None:
+            return future
+        future = loading_documents[file_path] = document_loader.submit(get_document_data, file_path)
+    # Registered outside the lock: a load that has already finished runs the callback right here
+    future.add_done_callback(lambda _: finish_loading(file_path))
+    return future
+
+def finish_loading(file_path: str):
+    with loading_lock:
+        loading_documents.pop(file_path, None)
+
+def request_deadline(data: Dict[str, Any] = None) -> float:
+    """
+    Absolute time.monotonic() deadline for the current request
+    
+    Taken from the X-Search-Deadline-Ms header or a deadline_ms parameter (JSON body or query
+    string), else SEARCH_DEADLINE_MS, and capped at SEARCH_MAX_DEADLINE_MS.
+    """
+    value = request.headers.get('X-Search-Deadline-Ms') or (data or {}).get('deadline_ms') or request.args.get('deadline_ms')
+    try:
+        budget_ms = float(value) if value is not None else SEARCH_DEADLINE_MS
+    except ValueError:
+        budget_ms = SEARCH_DEADLINE_MS
+    return time.monotonic() + min(max(budget_ms, 0.0), SEARCH_MAX_DEADLINE_MS) / 1000
+
+def request_flag(value: Any, default: bool = True) -> bool:
+    """
+    A boolean option from a JSON body or query string, read the same way from both: JSON
+    booleans and numbers as they are, strings true unless "false", "0", "no" or "off" (any
+    case), and a missing or empty value as default
+    """
+    if value is None or value == '':
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() not in ('false', '0', 'no', 'off')
+    return bool(value)
+
+def search_documents(query: str, selected_documents: List[str] = None, fuzzy: bool = True,
+                     deadline: Optional[float] = None,
+                     collapse_duplicates: bool = True) -> Tuple[List[Dict], List[str]]:
+    """
+    Search documents with on-demand loading, stopping at a time.monotonic() deadline
+    
+    Documents still loading when the deadline passes are skipped (their loads carry on and are
+    cached for later requests), and scanning stops between pages. Hits on near-identical pages
+    of different documents are collapsed into the best one, which lists the rest in "also_in".
+    
+    Returns:
+        (results, skipped) where skipped lists documents not searched, or only partly searched
+    """
+    skipped = []
     try:
         log_memory("before search")
         
         if not query.strip():
-            return []
+            return [], skipped
             
         query_lower = query.lower()
         results = []
         
         # Translate French terms if needed
-        search_terms = set([query_lower])
-        for french_term, english_translations in french_to_english.items():
-            if french_term in query_lower:
-                search_terms.update(english_translations)
+        search_terms = translate_terms(query_lower)
+        
+        # Exact terms rank above typo-corrected ones
+        weighted_terms = [(term, 0.8) for term in search_terms]
+        if fuzzy:
+            weighted_terms += [(term, 0.6) for term in fuzzy_terms_for(query_lower) - search_terms]
         
         # Determine which documents to search
         docs_to_search = selected_documents if selected_documents else list(document_index.keys())
         
+        if shard_pool is not None:
+            results, skipped = shard_pool.search(
+                weighted_terms, [d for d in docs_to_search if d in document_index], deadline)
+            docs_to_search = []
+        
         for doc_name in docs_to_search:
             if doc_name not in document_index:
                 continue
+            if deadline is not None and time.monotonic() >= deadline:
+                # Out of time: start loading anyway so the next search finds it ready
+                load_document_async(document_index[doc_name]['file_path'])
+                skipped.append(doc_name)
+                continue
                 
             try:
-                # Load document on-demand
+                # Load document on-demand, waiting no longer than the deadline allows
                 doc_info = document_index[doc_name]
-                doc_data = get_document_data(doc_info['file_path'])
+                if deadline is None:
+                    doc_data = get_document_data(doc_info['file_path'])
+                else:
+                    try:
+                        doc_data = load_document_async(doc_info['file_path']).result(
+                            timeout=max(0.0, deadline - time.monotonic()))
+                    except FuturesTimeoutError:
+                        logger.warning(f"Skipped {doc_name}: still loading at the search deadline")
+                        skipped.append(doc_name)
+                        continue
                 
                 if not doc_data:
                     continue
                 
                 # Search through sections
-                for section in doc_data.sections:
-                    section_text_lower = section.content.lower()
-                    
-                    for term in search_terms:
-                        if term in section_text_lower:
-                            # Find context around the match
-                            start_pos = section_text_lower.find(term)
-                            context_start = max(0, start_pos - 100)
-                            context_end = min(len(section.content), start_pos + len(term) + 100)
-                            context = section.content[context_start:context_end]
-                            
-                            results.append({
-                                'document': doc_data.title,
-                                'section': section.title,
-                                'page': section.page,
-                                'context': context,
-                                'relevance': 0.8  # Simple relevance score
-                            })
-                            break  # Only one match per section to avoid duplicates
-                            
+                matches, complete = search_sections(doc_data, weighted_terms, deadline)
+                results.extend(matches)
+                if not complete:
+                    skipped.append(doc_name)
+                
             except Exception as e:
                 logger.error(f"Error searching in {doc_name}: {e}")
                 continue
@@ -315,11 +572,182 @@ def search_documents(query: str, selected_documents: List[str] = None) -> List[D
         
         # Sort by relevance and limit results
         results.sort(key=lambda x: x['relevance'], reverse=True)
-        return results[:50]  # Limit to 50 results
+        if collapse_duplicates:
+            results = duplicate_index.collapse(results)
+        return results[:50], skipped  # Limit to 50 results
         
     except Exception as e:
         logger.error(f"Search error: {e}")
-        return []
+        return [], skipped
+
+def reciprocal_rank_fusion(ranked_lists: Dict[str, List[Dict]], k: int = RRF_K) -> List[Dict]:
+    """Merge ranked result lists by reciprocal rank, one entry per document page"""
+    fused = {}
+    for source, results in ranked_lists.items():
+        seen = set()
+        for rank, result in enumerate(results, start=1):
+            key = (result['document'], result['page'])
+            if key in seen:
+                continue  # Only a page's best rank in each list counts
+            seen.add(key)
+            
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = dict(result, score=0.0, sources=[])
+            entry['score'] += 1.0 / (k + rank)
+            entry['sources'].append(source)
+    
+    return sorted(fused.values(), key=lambda x: x['score'], reverse=True)
+
+def hybrid_search(query: str, selected_documents: List[str] = None, top_k: int = 20,
+                  keyword_timeout: float = HYBRID_KEYWORD_TIMEOUT,
+                  semantic_timeout: float = HYBRID_SEMANTIC_TIMEOUT) -> Dict[str, Any]:
+    """Run keyword and semantic search concurrently and fuse whatever finishes in time"""
+    started = time.monotonic()
+    # The keyword leg stops itself at its deadline; the grace lets it hand back what it found
+    legs = {'keyword': (hybrid_executor.submit(search_documents, query, selected_documents, True,
+                                               started + keyword_timeout), keyword_timeout + HYBRID_DEADLINE_GRACE)}
+    if llm_engine is not None and llm_engine.section_embeddings:
+        legs['semantic'] = (hybrid_executor.submit(llm_engine.semantic_search, query, top_k,
+                                                   documents=selected_documents), semantic_timeout)
+    
+    ranked_lists = {}
+    leg_status = {}
+    for name, (future, timeout) in legs.items():
+        # Each leg's timeout counts from the shared start, so a slow leg never delays the other
+        remaining = max(0.0, timeout - (time.monotonic() - started))
+        try:
+            results = future.result(timeout=remaining)
+        except FuturesTimeoutError:
+            logger.warning(f"Hybrid search {name} leg timed out after {timeout}s for '{query}'")
+            leg_status[name] = {'status': 'timeout'}
+            continue
+        except Exception as e:
+            logger.error(f"Hybrid search {name} leg failed: {e}")
+            leg_status[name] = {'status': 'error'}
+            continue
+        
+        skipped = []
+        if name == 'keyword':
+            results, skipped = results
+        else:
+            results = semantic_matches_to_results(results)
+        ranked_lists[name] = results
+        leg_status[name] = {
+            'status': 'partial' if skipped else 'ok',
+            'count': len(results),
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+        }
+        if skipped:
+            leg_status[name]['skipped'] = skipped
+    
+    if 'semantic' not in legs:
+        leg_status['semantic'] = {'status': 'unavailable'}
+    # Documents still being embedded only have keyword results so far
+    pending = [name for name, state in embedding_status.items()
+               if state['status'] != 'ready' and (not selected_documents or name in selected_documents)]
+    if pending:
+        leg_status['semantic']['pending_documents'] = pending
+    
+    results = duplicate_index.collapse(reciprocal_rank_fusion(ranked_lists))[:top_k]
+    return {
+        'results': results,
+        'total': len(results),
+        'query': query,
+        'legs': leg_status,
+        'partial': any(leg['status'] in ('timeout', 'error', 'partial') for leg in leg_status.values())
+    }
+
+def server_state() -> Dict[str, Any]:
+    """What the caches and background work looked like when a slow request finished"""
+    with loading_lock:
+        loading = [os.path.basename(path) for path in loading_documents]
+    return {
+        'memory_mb': psutil.Process().memory_info().rss / 1024 / 1024,
+        'document_cache': get_document_data.cache_info()._asdict(),
+        'documents_loading': loading,
+        'search_shards': [{'shard': s['shard'], 'ready': s['ready'], 'pending': s['pending']}
+                          for s in shard_pool.metrics()] if shard_pool else None,
+        'embedding': {name: state.get('status') for name, state in embedding_status.items()},
+        'preview_cache': preview_cache.metrics() if preview_cache else None,
+        'threads': threading.active_count()
+    }
+
+request_profiler = RequestProfiler(sample_rate=PROFILE_SAMPLE_RATE, slow_ms=SLOW_QUERY_MS,
+                                   log_size=SLOW_QUERY_LOG_SIZE, context=server_state)
+
+@app.before_request
+def start_request_timing():
+    if not request.path.startswith('/api/') or request.path.startswith(UNPROFILED_PATHS):
+        return
+    g.request_id = uuid.uuid4().hex[:12]
+    g.profile_forced = request.headers.get('X-Profile', '').lower() in ('1', 'true', 'yes')
+    g.profile = request_profiler.start() if request_profiler.should_profile(g.profile_forced) else None
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def finish_request_timing(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    duration_ms = (time.perf_counter() - started) * 1000
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.stop(profile)
+    
+    # Streamed bodies are timed up to the start of the stream
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    data = data if isinstance(data, dict) else {}
+    request_profiler.record({
+        'id': g.request_id,
+        'time': time.time(),
+        'method': request.method,
+        'path': request.path,
+        'query': data.get('query') or request.args.get('query') or request.args.get('q'),
+        'documents': data.get('documents') or request.args.getlist('documents'),
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 2),
+        'search': g.get('search_info')
+    }, profile, forced=g.profile_forced)
+    response.headers['X-Request-Id'] = g.request_id
+    return response
+
+def admin_authorized() -> bool:
+    supplied = request.headers.get('X-Admin-Token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+@app.route('/api/admin/slow-queries', methods=['GET', 'DELETE'])
+def slow_queries():
+    """Slow and profiled requests, newest first (?id= for one, &format=collapsed for flame graphs)"""
+    if not admin_authorized():
+        return jsonify({'error': 'Not found'}), 404
+    if request.method == 'DELETE':
+        request_profiler.clear()
+        return jsonify({'cleared': True})
+    
+    entries = request_profiler.entries(request.args.get('limit', type=int))
+    request_id = request.args.get('id')
+    if request_id:
+        entries = [entry for entry in entries if entry['id'] == request_id]
+        if not entries:
+            return jsonify({'error': 'No such request in the log'}), 404
+    if request.args.get('format') == 'collapsed':
+        lines = [f"{stack['stack']} {stack['samples']}"
+                 for entry in entries for stack in entry.get('profile', {}).get('stacks', [])]
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+    return api_response({'profiler': request_profiler.metrics(), 'entries': entries})
+
+@app.route('/api/admin/ann-index/rebuild', methods=['POST'])
+def rebuild_ann_index():
+    """Retrain the semantic ANN index from the stored embeddings (new chunks are otherwise only added to it)"""
+    if not admin_authorized():
+        return jsonify({'error': 'Not found'}), 404
+    if llm_engine is None or llm_engine.ann_index is None:
+        return jsonify({'error': 'No ANN index is in use'}), 409
+    index = llm_engine.ann_index
+    # Queued behind any embedding work, which updates the same index
+    embedding_executor.submit(llm_engine.build_ann_index, nprobe=index.nprobe, pq_m=index.pq_m)
+    return jsonify({'queued': True, 'vectors': len(index), 'drifted': index.drifted()}), 202
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -329,50 +757,282 @@ def health_check():
         'status': 'healthy',
         'memory_mb': memory_mb,
         'documents_indexed': len(document_index),
-        'cache_size': len(document_cache)
+        'cache_size': len(document_cache),
+        'vocabulary_size': len(spelling_dictionary),
+        'llm_cache': llm_engine.response_cache.metrics() if llm_engine and llm_engine.response_cache else None,
+        'openai_scheduler': llm_engine.scheduler.metrics() if llm_engine and llm_engine.scheduler else None,
+        'embedding_backend': llm_engine.embedding_backend.name if llm_engine else None,
+        'embedding_store': llm_engine.vector_store.metrics() if llm_engine else None,
+        'semantic_index': embedding_status,
+        'search_shards': shard_pool.metrics() if shard_pool else None,
+        'preview_cache': preview_cache.metrics() if preview_cache else None,
+        'page_pdf_cache': page_pdf_cache.metrics() if page_pdf_cache else None,
+        'measurements': measurement_index.metrics(),
+        'suggestions': suggestion_index.metrics(),
+        'profiler': request_profiler.metrics(),
+        'page_store': page_store.metrics(),
+        'near_duplicates': duplicate_index.metrics(),
+        'memory_accounting': memory_accounting.metrics()
     })
 
 @app.route('/api/documents', methods=['GET'])
 def get_documents():
     """Get list of available documents"""
     try:
+        # Semantic status changes as background embedding progresses, so it is part of the tag
+        etag = make_etag(index_version, 'documents', memory_accounting.version, sorted(
+            (filename, state.get('status')) for filename, state in embedding_status.items()))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
         documents = []
         for filename, info in document_index.items():
             documents.append({
                 'filename': filename,
                 'title': info['title'],
-                'sections_count': info['sections_count']
+                'sections_count': info['sections_count'],
+                'semantic_status': embedding_status.get(filename, {}).get('status'),
+                'memory': memory_accounting.document(filename)
             })
-        return jsonify(documents)
+        return api_response(documents, etag=etag)
     except Exception as e:
         logger.error(f"Error getting documents: {e}")
         return jsonify({'error': 'Failed to retrieve documents'}), 500
 
-@app.route('/api/search', methods=['POST'])
+@app.route('/api/documents/<path:name>/preview', methods=['GET'])
+def document_preview(name):
+    """One page rendered as an image, with the search terms highlighted"""
+    info = document_index.get(name)
+    if info is None:
+        return jsonify({'error': 'Document not found'}), 404
+    try:
+        page = int(request.args.get('page', 1))
+        width = clamp_width(request.args.get('width', type=int))
+    except ValueError:
+        return jsonify({'error': 'page must be an integer'}), 400
+    if not 1 <= page <= info['sections_count']:
+        return jsonify({'error': f"page must be between 1 and {info['sections_count']}"}), 404
+    
+    # An explicit ?format= wins; otherwise WebP for browsers that accept it
+    formats = available_formats()
+    fmt = request.args.get('format', '').lower()
+    if fmt not in formats:
+        fmt = 'webp' if 'webp' in formats and request.accept_mimetypes['image/webp'] else 'png'
+    
+    try:
+        image, etag = get_preview_cache().get(
+            info['file_path'], page, highlight_terms(request.args.get('search', '')), width, fmt)
+    except Exception as e:
+        logger.error(f"Preview of {name} page {page} failed: {e}")
+        return jsonify({'error': 'Preview failed'}), 500
+    
+    # The tag covers the file's size and mtime, so the image can be reused until the PDF changes.
+    # Bytes rather than the cache file are sent, as another request's build may evict the file
+    response = send_file(io.BytesIO(image), mimetype=FORMATS[fmt], etag=etag, max_age=86400)
+    response.vary.add('Accept')
+    return response
+
+@app.route('/api/documents/<path:name>/pages', methods=['GET'])
+def document_pages(name):
+    """Pages start..end (1-based, inclusive) as a standalone PDF, with Range and ETag support"""
+    info = document_index.get(name)
+    if info is None:
+        return jsonify({'error': 'Document not found'}), 404
+    try:
+        first = int(request.args.get('start', request.args.get('page', 1)))
+        last = int(request.args.get('end', first))
+    except ValueError:
+        return jsonify({'error': 'start and end must be integers'}), 400
+    if not 1 <= first <= last <= info['sections_count']:
+        return jsonify({'error': f"pages must satisfy 1 <= start <= end <= {info['sections_count']}"}), 404
+    if last - first + 1 > MAX_PAGES:
+        return jsonify({'error': f"At most {MAX_PAGES} pages per extract"}), 400
+    
+    try:
+        pdf, etag = get_page_pdf_cache().get(info['file_path'], first, last)
+    except Exception as e:
+        logger.error(f"Extracting pages {first}-{last} of {name} failed: {e}")
+        return jsonify({'error': 'Page extraction failed'}), 500
+    
+    suffix = f"p{first}" if first == last else f"p{first}-{last}"
+    return send_file(io.BytesIO(pdf), mimetype='application/pdf', etag=etag, max_age=86400,
+                     download_name=f"{os.path.splitext(name)[0]}-{suffix}.pdf")
+
+@app.route('/api/search', methods=['GET', 'POST'])
 def search():
     """Search endpoint"""
     try:
-        data = request.json
-        query = data.get('query', '').strip()
-        selected_documents = data.get('documents', [])
+        # POST with a JSON body, or GET with query parameters so browsers can revalidate cached results
+        if request.method == 'POST':
+            data = request.json
+            query = data.get('query', '').strip()
+            selected_documents = data.get('documents', [])
+            options = data
+        else:
+            data = None
+            query = request.args.get('query', '').strip()
+            selected_documents = request.args.getlist('documents')
+            options = request.args
+        fuzzy = request_flag(options.get('fuzzy'))
+        collapse_duplicates = request_flag(options.get('collapse_duplicates'))
+        deadline = request_deadline(data)
         
         if not query:
             return jsonify({'error': 'Query is required'}), 400
         
+        etag = make_etag(index_version, 'search', query, sorted(selected_documents or []), fuzzy,
+                         collapse_duplicates)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
         logger.info(f"Search request: '{query}' in {len(selected_documents) if selected_documents else 'all'} documents")
         
-        results = search_documents(query, selected_documents)
+        results, skipped = search_documents(query, selected_documents, fuzzy=fuzzy, deadline=deadline,
+                                            collapse_duplicates=collapse_duplicates)
+        g.search_info = {'results': len(results), 'skipped': skipped, 'sharded': shard_pool is not None}
+        if PREVIEW_PRERENDER_HITS > 0:
+            prerender_previews(query, results)
         
-        return jsonify({
+        payload = {
             'results': results,
             'total': len(results),
-            'query': query
-        })
+            'query': query,
+            'did_you_mean': correct_query(query),
+            'partial': bool(skipped),
+            'skipped': skipped
+        }
+        # A query with a numeric range ("noise above 100 dB") also gets the matching measurements
+        range_query = parse_range(query)
+        if range_query is not None:
+            payload['measurements'], payload['measurements_total'] = measurement_index.search(
+                range_query, selected_documents, limit=50)
+        
+        # Partial results are not tagged, so a later complete answer is never masked by a 304
+        return api_response(payload, etag=None if skipped else etag)
         
     except Exception as e:
         logger.error(f"Search endpoint error: {e}")
         return jsonify({'error': 'Search failed'}), 500
 
+@app.route('/api/suggest', methods=['GET'])
+def suggest():
+    """Completions of a partly typed query from corpus terms, phrases and French keys"""
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', suggestion_index.limit, type=int), 50)
+    if not query.strip():
+        return api_response({'query': query, 'suggestions': []})
+    
+    etag = make_etag(index_version, 'suggest', query, limit)
+    cached = not_modified(etag, max_age=300)
+    if cached is not None:
+        return cached
+    return api_response({'query': query, 'suggestions': suggestion_index.suggest(query, limit)},
+                        etag=etag, max_age=300)
+
+@app.route('/api/measurements', methods=['GET'])
+def search_measurements():
+    """Measurements in a numeric range, e.g. ?q=noise above 100 dB or ?q=1.5..2 m"""
+    query = request.args.get('q', request.args.get('query', '')).strip()
+    selected_documents = request.args.getlist('documents')
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    
+    range_query = parse_range(query)
+    if range_query is None:
+        return jsonify({'error': 'Query needs a number with a unit, e.g. "> 85 dBA" or "1.5..2 m"'}), 400
+    
+    etag = make_etag(index_version, 'measurements', query, sorted(selected_documents), limit)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    results, total = measurement_index.search(range_query, selected_documents, limit=limit)
+    return api_response({
+        'query': query,
+        'range': {
+            'quantity': range_query.quantity,
+            'min': None if range_query.low == float('-inf') else range_query.low,
+            'max': None if range_query.high == float('inf') else range_query.high,
+            'unit': SI_UNITS[range_query.quantity],
+            'weighting': range_query.weighting,
+            'text': range_query.text
+        },
+        'results': results,
+        'total': total
+    }, etag=etag)
+
+@app.route('/api/search/hybrid', methods=['POST'])
+def search_hybrid():
+    """Hybrid keyword + semantic search endpoint"""
+    try:
+        data = request.json
+        query = data.get('query', '').strip()
+        selected_documents = data.get('documents', [])
+        
+        if not query:
+            return jsonify({'error': 'Query is required'}), 400
+        
+        logger.info(f"Hybrid search request: '{query}' in {len(selected_documents) if selected_documents else 'all'} documents")
+        
+        return jsonify(hybrid_search(
+            query,
+            selected_documents,
+            top_k=int(data.get('top_k', 20)),
+            keyword_timeout=float(data.get('keyword_timeout', HYBRID_KEYWORD_TIMEOUT)),
+            semantic_timeout=float(data.get('semantic_timeout', HYBRID_SEMANTIC_TIMEOUT))
+        ))
+        
+    except Exception as e:
+        logger.error(f"Hybrid search endpoint error: {e}")
+        return jsonify({'error': 'Search failed'}), 500
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/llm/chat/stream', methods=['GET', 'POST'])
+def llm_chat_stream():
+    """Stream an LLM answer token by token over Server-Sent Events"""
+    if llm_engine is None:
+        return jsonify({'error': 'LLM features are not available'}), 503
+    
+    # POST with a JSON body, or GET with query parameters for EventSource clients
+    data = request.get_json(silent=True) or {}
+    query = (data.get('query') or request.args.get('query', '')).strip()
+    selected_documents = data.get('documents') or request.args.getlist('documents')
+    
+    if not query:
+        return jsonify({'error': 'Query is required'}), 400
+    
+    logger.info(f"Streaming LLM request: '{query}' in {len(selected_documents) if selected_documents else 'all'} documents")
+    
+    results = hybrid_search(query, selected_documents, top_k=5)['results']
+    context = build_results_context(results)
+    sources = [{'document': r['document'], 'page': r['page']} for r in results]
+    
+    def generate():
+        for event in llm_engine.stream_enhanced_search(query, context):
+            if event['type'] == 'token':
+                yield sse_event('token', {'content': event['content']})
+            elif event['type'] == 'error':
+                yield sse_event('error', {'error': event['error']})
+            else:
+                yield sse_event('done', {
+                    'usage': event['usage'],
+                    'model': event['model'],
+                    'cited_pages': cited_pages(event['response'], results),
+                    'sources': sources,
+                    'cached': event.get('cached'),
+                    'tokens_saved': event.get('tokens_saved', 0)
+                })
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 if __name__ == '__main__':
     try:
         logger.info("Starting Standards Search Backend (Stable Version)")
@@ -381,6 +1041,18 @@ if __name__ == '__main__':
         # Index documents
         index_documents()
         
+        num_shards = search_shard_count()
+        if num_shards > 1:
+            shard_pool = ShardPool({name: info['file_path'] for name, info in document_index.items()},
+                                   num_shards, page_store)
+        
+        if LLM_AVAILABLE:
+            llm_engine = create_llm_search_engine()
+        
+        # Embeddings are built in the background; keyword search serves in the meantime
+        if llm_engine is not None:
+            start_background_embedding()
+        
         # Start Flask app
         port = int(os.environ.get('PORT', 8080))  # Default to 8080 to match Railway config
         host = '0.0.0.0'  # Always bind to all interfaces for Railway
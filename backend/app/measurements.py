@@ -0,0 +1,271 @@
+"""
+Numeric measurements found in the documents, normalized to SI and indexed for range queries
+
+Number-unit pairs such as "85 dBA", "1.9 m" or "6 in" are recognized in page text, converted
+to the SI unit of their quantity and kept in one value-sorted array per quantity, so a query
+like "above 100 dB" or "1.5..2 m" is two binary searches and a slice.
+"""
+
+import re
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# unit spelling -> (quantity, factor to the SI unit)
+UNITS: Dict[str, Tuple[str, float]] = {
+    # Sound level; weightings are kept apart through the unit spelling
+    'dB': ('sound_level', 1.0), 'dBA': ('sound_level', 1.0), 'dBC': ('sound_level', 1.0),
+    'dBP': ('sound_level', 1.0), 'dB(A)': ('sound_level', 1.0), 'dB(C)': ('sound_level', 1.0),
+    # Length
+    'm': ('length', 1.0), 'cm': ('length', 0.01), 'mm': ('length', 0.001), 'km': ('length', 1000.0),
+    'in': ('length', 0.0254), 'inch': ('length', 0.0254), 'inches': ('length', 0.0254),
+    'ft': ('length', 0.3048), 'foot': ('length', 0.3048), 'feet': ('length', 0.3048),
+    'meter': ('length', 1.0), 'meters': ('length', 1.0), 'metre': ('length', 1.0), 'metres': ('length', 1.0),
+    # Mass
+    'kg': ('mass', 1.0), 'lb': ('mass', 0.45359237), 'lbs': ('mass', 0.45359237),
+    'pound': ('mass', 0.45359237), 'pounds': ('mass', 0.45359237),
+    # Force
+    'N': ('force', 1.0), 'kN': ('force', 1000.0), 'lbf': ('force', 4.4482216),
+    # Time
+    's': ('time', 1.0), 'sec': ('time', 1.0), 'second': ('time', 1.0), 'seconds': ('time', 1.0),
+    'ms': ('time', 0.001), 'min': ('time', 60.0), 'minute': ('time', 60.0), 'minutes': ('time', 60.0),
+    'h': ('time', 3600.0), 'hr': ('time', 3600.0), 'hour': ('time', 3600.0), 'hours': ('time', 3600.0),
+    # Frequency
+    'Hz': ('frequency', 1.0), 'kHz': ('frequency', 1000.0),
+    # Pressure
+    'Pa': ('pressure', 1.0), 'kPa': ('pressure', 1000.0), 'psi': ('pressure', 6894.757),
+    # Illuminance
+    'lux': ('illuminance', 1.0), 'lx': ('illuminance', 1.0), 'fc': ('illuminance', 10.7639),
+    'footcandles': ('illuminance', 10.7639),
+    # Angle
+    'deg': ('angle', math.pi / 180), 'degree': ('angle', math.pi / 180), 'degrees': ('angle', math.pi / 180),
+}
+SI_UNITS = {'sound_level': 'dB', 'length': 'm', 'mass': 'kg', 'force': 'N', 'time': 's',
+            'frequency': 'Hz', 'pressure': 'Pa', 'illuminance': 'lx', 'angle': 'rad'}
+WEIGHTED = {'dBA': 'dBA', 'dB(A)': 'dBA', 'dBC': 'dBC', 'dB(C)': 'dBC', 'dBP': 'dBP'}
+
+NUMBER = r'(?<![\w.])(\d{1,3}(?:,\d{3})+|\d+)(\.\d+)?'
+# Longest spellings first so "dBA" wins over "dB"; "in" only before punctuation, a capital or the end
+UNIT = '|'.join(re.escape(u) for u in sorted(UNITS, key=len, reverse=True) if u != 'in') + r'|in(?=\s*(?:[^\sa-z]|$))'
+MEASUREMENT_RE = re.compile(NUMBER + r'[\s-]?(' + UNIT + r')(?![\w(])')
+RANGE_RE = re.compile(
+    r'(?P<low>\d[\d,]*(?:\.\d+)?)\s*(?P<low_unit>' + UNIT + r')?\s*(?:\.\.|-|to|and)\s*'
+    r'(?P<high>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>' + UNIT + r')(?![\w(])', re.IGNORECASE)
+BOUND_RE = re.compile(
+    r'(?P<op>>=|<=|[<>=≥≤]|\b(?:more than|greater than|above|over|at least|less than|below|under|at most|up to))?'
+    r'\s*(?P<value>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>' + UNIT + r')(?![\w(])', re.IGNORECASE)
+OPERATORS = {'>': ('>', False), 'more than': ('>', False), 'greater than': ('>', False), 'above': ('>', False),
+             'over': ('>', False), '>=': ('>', True), '≥': ('>', True), 'at least': ('>', True),
+             '<': ('<', False), 'less than': ('<', False), 'below': ('<', False), 'under': ('<', False),
+             '<=': ('<', True), '≤': ('<', True), 'at most': ('<', True), 'up to': ('<', True)}
+CONTEXT_CHARS = 100  # Same window as keyword search snippets
+STOPWORDS = {'the', 'and', 'for', 'with', 'than', 'that', 'are', 'all', 'any', 'from', 'between', 'limit', 'limits'}
+
+
+def parse_number(text: str) -> float:
+    return float(text.replace(',', ''))
+
+
+def canonical_unit(unit: str) -> Optional[str]:
+    """The UNITS spelling of a unit typed in any case, preferring an exact match"""
+    if unit in UNITS:
+        return unit
+    lowered = unit.lower()
+    for candidate in UNITS:
+        if candidate.lower() == lowered:
+            return candidate
+    return None
+
+
+def extract_measurements(text: str) -> List[Tuple[int, float, str]]:
+    """(offset, value, unit) for every number-unit pair in text"""
+    found = []
+    for match in MEASUREMENT_RE.finditer(text):
+        whole, fraction, unit = match.groups()
+        found.append((match.start(), parse_number(whole + (fraction or '')), unit))
+    return found
+
+
+@dataclass
+class RangeQuery:
+    quantity: str
+    low: float  # SI units; -inf/inf when unbounded
+    high: float
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+    weighting: Optional[str] = None  # Sound level weighting the query asked for (dBA, dBC, dBP)
+    text: str = ''  # The query with the range expression removed
+
+
+def parse_range(query: str) -> Optional[RangeQuery]:
+    """
+    Find a numeric range in a query
+
+    Understands "80..90 dB", "80-90 dB", "80 to 90 dB", "between 80 and 90 dB", "> 100 dB", ">= 1.5 m", "above 100 dBA",
+    "at most 6 in" and a bare "85 dBA" (that exact value). Returns None if there is none.
+    """
+    match = RANGE_RE.search(query)
+    if match:
+        unit = canonical_unit(match.group('unit'))
+        low_unit = canonical_unit(match.group('low_unit') or '') or unit
+        quantity, factor = UNITS[unit]
+        if UNITS[low_unit][0] != quantity:
+            return None
+        low = parse_number(match.group('low')) * UNITS[low_unit][1]
+        high = parse_number(match.group('high')) * factor
+        result = RangeQuery(quantity, min(low, high), max(low, high), weighting=WEIGHTED.get(unit))
+    else:
+        match = BOUND_RE.search(query)
+        if not match:
+            return None
+        unit = canonical_unit(match.group('unit'))
+        if unit is None:
+            return None
+        quantity, factor = UNITS[unit]
+        value = parse_number(match.group('value')) * factor
+        op = match.group('op')
+        direction, inclusive = OPERATORS.get(op.lower(), ('=', True)) if op else ('=', True)
+        if direction == '>':
+            result = RangeQuery(quantity, value, math.inf, low_inclusive=inclusive)
+        elif direction == '<':
+            result = RangeQuery(quantity, -math.inf, value, high_inclusive=inclusive)
+        else:
+            result = RangeQuery(quantity, value, value)
+        result.weighting = WEIGHTED.get(unit)
+    result.text = ' '.join((query[:match.start()] + ' ' + query[match.end():]).split())
+    return result
+
+
+class MeasurementIndex:
+    """Value-sorted arrays of the measurements in every indexed document, one set per quantity"""
+
+    def __init__(self):
+        self.documents: List[str] = []
+        self.units: List[str] = []
+        self.pending: Dict[str, List[tuple]] = {}  # quantity -> unsorted (si_value, doc, page, offset, unit, context)
+        self.values: Dict[str, array] = {}
+        self.postings: Dict[str, Tuple[array, array, array, array]] = {}  # doc ids, pages, offsets, unit ids
+        self.contexts: Dict[str, List[str]] = {}
+        # (doc id, page) -> other (document, page) with the same text, whose measurements are not indexed again
+        self.copies: Dict[Tuple[int, int], List[Tuple[str, int]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(values) for values in self.values.values()) + sum(map(len, self.pending.values()))
+
+    def add_document(self, doc_data, copies: Optional[Dict[int, Tuple[str, int]]] = None):
+        """
+        Index the measurements on every page of a documents.DocumentData
+
+        Args:
+            copies: {page: (document, page)} for pages identical to one already indexed
+                (near_duplicates.DuplicateIndex.add_document); they share its postings
+        """
+        if doc_data.title in self.documents:
+            self.remove_document(doc_data.title)
+        doc_id = len(self.documents)
+        self.documents.append(doc_data.title)
+        for section in doc_data.sections:
+            original = (copies or {}).get(section.page)
+            if original is not None and original[0] in self.documents:
+                self.copies.setdefault((self.documents.index(original[0]), original[1]), []).append(
+                    (doc_data.title, section.page))
+                continue
+            for offset, value, unit in extract_measurements(section.content):
+                quantity, factor = UNITS[unit]
+                if unit not in self.units:
+                    self.units.append(unit)
+                context = section.content[max(0, offset - CONTEXT_CHARS):offset + CONTEXT_CHARS]
+                self.pending.setdefault(quantity, []).append(
+                    (value * factor, doc_id, section.page, offset, self.units.index(unit), context))
+
+    def remove_document(self, title: str):
+        doc_id = self.documents.index(title)
+        self.documents[doc_id] = None
+        # Copies of this document's pages lose their postings with it until they are re-added
+        self.copies = {key: [copy for copy in copies if copy[0] != title]
+                       for key, copies in self.copies.items() if key[0] != doc_id}
+        for quantity in set(self.values) | set(self.pending):
+            entries = self._entries(quantity) + self.pending.get(quantity, [])
+            self.pending[quantity] = [entry for entry in entries if entry[1] != doc_id]
+            for table in (self.values, self.postings, self.contexts):
+                table.pop(quantity, None)
+
+    def _entries(self, quantity: str) -> List[tuple]:
+        values = self.values.get(quantity, array('d'))
+        doc_ids, pages, offsets, unit_ids = self.postings.get(quantity, ([], [], [], []))
+        contexts = self.contexts.get(quantity, [])
+        return list(zip(values, doc_ids, pages, offsets, unit_ids, contexts))
+
+    def finalize(self):
+        """Merge pending measurements into the sorted arrays; queries call this as needed"""
+        for quantity, entries in self.pending.items():
+            if not entries:
+                continue
+            entries = sorted(self._entries(quantity) + entries)
+            self.values[quantity] = array('d', (e[0] for e in entries))
+            self.postings[quantity] = (array('H', (e[1] for e in entries)), array('i', (e[2] for e in entries)),
+                                       array('i', (e[3] for e in entries)), array('H', (e[4] for e in entries)))
+            self.contexts[quantity] = [e[5] for e in entries]
+        self.pending = {}
+
+    def search(self, query: RangeQuery, documents: Optional[Sequence[str]] = None,
+               limit: int = 100) -> Tuple[List[Dict], int]:
+        """
+        Measurements inside the query's range, in ascending value order
+
+        Returns:
+            (results up to limit, total number in range)
+        """
+        if self.pending:
+            self.finalize()
+        values = self.values.get(query.quantity)
+        if values is None:
+            return [], 0
+        start = (bisect_left if query.low_inclusive else bisect_right)(values, query.low)
+        end = (bisect_right if query.high_inclusive else bisect_left)(values, query.high)
+        doc_ids, pages, offsets, unit_ids = self.postings[query.quantity]
+        contexts = self.contexts[query.quantity]
+        wanted = set(documents) if documents else None
+        words = [word for word in query.text.lower().split() if len(word) >= 3 and word not in STOPWORDS]
+        si_unit = SI_UNITS[query.quantity]
+
+        results = []
+        total = 0
+        for i in range(start, end):
+            document = self.documents[doc_ids[i]]
+            unit = self.units[unit_ids[i]]
+            # The same measurement on identical pages of other documents
+            locations = [(document, pages[i])] + self.copies.get((doc_ids[i], pages[i]), [])
+            if wanted is not None:
+                locations = [location for location in locations if location[0] in wanted]
+                if not locations:
+                    continue
+            if query.weighting and WEIGHTED.get(unit) != query.weighting:
+                continue
+            if words and not any(word in contexts[i].lower() for word in words):
+                continue
+            total += 1
+            if len(results) < limit:
+                si_value = values[i]
+                result = {
+                    'document': locations[0][0],
+                    'page': locations[0][1],
+                    'offset': offsets[i],
+                    'value': round(si_value / UNITS[unit][1], 6),
+                    'unit': unit,
+                    'si_value': si_value,
+                    'si_unit': si_unit,
+                    'context': contexts[i]
+                }
+                if len(locations) > 1:
+                    result['also_in'] = [{'document': document, 'page': page, 'identical': True}
+                                         for document, page in locations[1:]]
+                results.append(result)
+        return results, total
+
+    def metrics(self) -> Dict[str, int]:
+        if self.pending:
+            self.finalize()
+        return {quantity: len(values) for quantity, values in self.values.items()}
@@ -0,0 +1,109 @@
+"""
+Optional allocation accounting for document loads and index structures
+
+With accounting on, tracemalloc traces every Python allocation, and each measured step
+(extracting one document, adding it to an index, finalizing an index) records:
+- retained bytes: traced memory still held when the step finished
+- peak bytes: the most the step had allocated at one time
+The difference between the two is what the step's temporaries cost.
+
+Steps are measured one at a time, because tracemalloc's counters are process-wide. Memory
+that MuPDF allocates natively is not traced; the RSS change of each load is recorded next
+to the traced numbers to show it.
+"""
+
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import psutil
+
+
+def _rss() -> int:
+    return psutil.Process().memory_info().rss
+
+
+class MemoryAccounting:
+    """Per-document and per-index allocation footprints, measured with tracemalloc"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents: Dict[str, Dict[str, Any]] = {}  # filename -> {load: {...}, indexes: {name: bytes}}
+        self.indexes: Dict[str, int] = {}  # index name -> retained bytes including finalize
+        self.version = 0  # Bumped on every measurement, for response ETags
+
+    @property
+    def enabled(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        """Begin tracing; only allocations made from now on are accounted"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    @contextmanager
+    def _measure(self):
+        with self.lock:
+            before = tracemalloc.get_traced_memory()[0]
+            rss_before = _rss()
+            tracemalloc.reset_peak()
+            result: Dict[str, int] = {}
+            try:
+                yield result
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                result.update(retained_bytes=current - before, peak_bytes=peak - before,
+                              rss_delta_bytes=_rss() - rss_before)
+                self.version += 1
+
+    @contextmanager
+    def document_load(self, file_path: str):
+        """Account the extraction of one document (a no-op while accounting is off)"""
+        if not self.enabled:
+            yield
+            return
+        with self._measure() as result:
+            yield
+        filename = os.path.basename(file_path)
+        entry = self.documents.setdefault(filename, {'indexes': {}})
+        loads = entry.get('load', {}).get('loads', 0) + 1
+        entry['load'] = dict(result, temporary_bytes=result['peak_bytes'] - result['retained_bytes'], loads=loads)
+
+    @contextmanager
+    def index_update(self, index: str, filename: Optional[str] = None):
+        """
+        Account adding a document to an index, or a whole-index step such as finalize
+
+        Shared structures (the spelling vocabulary) only grow by what a document adds that
+        earlier ones did not, so per-document index costs depend on indexing order.
+        """
+        if not self.enabled:
+            yield
+            return
+        with self._measure() as result:
+            yield
+        self.indexes[index] = self.indexes.get(index, 0) + result['retained_bytes']
+        if filename:
+            entry = self.documents.setdefault(filename, {'indexes': {}})
+            entry['indexes'][index] = entry['indexes'].get(index, 0) + result['retained_bytes']
+
+    def document(self, filename: str) -> Optional[Dict[str, Any]]:
+        """Accounting for one document, or None if accounting is off or it was never measured"""
+        entry = self.documents.get(filename)
+        if entry is None:
+            return None
+        return dict(entry, index_bytes=sum(entry['indexes'].values()))
+
+    def metrics(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {'enabled': False}
+        current, _ = tracemalloc.get_traced_memory()
+        return {
+            'enabled': True,
+            'traced_bytes': current,
+            'tracing_overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+            'indexes': dict(self.indexes),
+            'documents': {filename: self.document(filename) for filename in self.documents}
+        }
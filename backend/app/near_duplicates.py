@@ -0,0 +1,187 @@
+"""
+Near-duplicate pages across documents, found with MinHash signatures and LSH banding
+
+Revisions of a standard share most of their pages word for word. Each page's set of word
+shingles is summarized by a MinHash signature, whose positions agree between two pages about
+as often as their shingle sets overlap (Jaccard similarity). Signatures are cut into bands;
+pages sharing any band are candidates, and candidates from different documents whose
+signatures agree closely enough are clustered, so search can show one hit per cluster.
+Pages with exactly the same text are also found directly, by digest, as documents are added.
+"""
+
+import hashlib
+from array import array
+from typing import Dict, List, Set, Tuple
+
+from spelling import tokenize
+
+SHINGLE_WORDS = 5
+BANDS = 16
+ROWS = 4  # Signature positions per band; 16 x 4 makes pages above ~50% similar likely candidates
+NUM_HASHES = BANDS * ROWS  # A power of two: the low bits of a shingle's hash pick its bin
+BIN_BITS = NUM_HASHES.bit_length() - 1
+EMPTY = 1 << 62
+NEAR_DUPLICATE_JACCARD = 0.8  # Estimated similarity at which two pages count as the same page
+
+PageKey = Tuple[str, int]  # (document, page)
+
+
+def shingles(text: str) -> Set[int]:
+    """Hashes of the page's overlapping runs of SHINGLE_WORDS words"""
+    words = tokenize(text, 1)
+    if len(words) <= SHINGLE_WORDS:
+        return {hash(' '.join(words))} if words else set()
+    return {hash(' '.join(words[i:i + SHINGLE_WORDS])) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(hashes: Set[int]) -> array:
+    """
+    One-permutation MinHash signature: the smallest hash in each of NUM_HASHES bins
+
+    A single pass over the shingles replaces NUM_HASHES hash functions. Bins a short page
+    leaves empty borrow from the next filled bin, offset by the distance, so two pages still
+    agree in a bin about as often as their shingle sets overlap.
+
+    Python salts str hashes per process, so signatures are compared only within one process.
+    """
+    bins = [EMPTY] * NUM_HASHES
+    mask = NUM_HASHES - 1
+    for value in hashes:
+        slot = value & mask
+        value >>= BIN_BITS
+        if value < bins[slot]:
+            bins[slot] = value
+    if EMPTY in bins:
+        filled = [i for i, value in enumerate(bins) if value != EMPTY]
+        for i in range(NUM_HASHES):
+            if bins[i] == EMPTY:
+                source = next((j for j in filled if j > i), filled[0] + NUM_HASHES)
+                bins[i] = bins[source % NUM_HASHES] + (source - i)
+    return array('q', bins)
+
+
+def similarity(first: array, second: array) -> float:
+    """Estimated Jaccard similarity of two pages: the share of signature positions that agree"""
+    return sum(map(int.__eq__, first, second)) / NUM_HASHES
+
+
+class DuplicateIndex:
+    """MinHash signatures of every page and the clusters of near-identical pages"""
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_JACCARD):
+        self.threshold = threshold
+        self.signatures: Dict[PageKey, array] = {}
+        self.digests: Dict[PageKey, bytes] = {}
+        self.first_with_digest: Dict[bytes, PageKey] = {}
+        self.clusters: Dict[PageKey, int] = {}  # Only pages that have a near-duplicate
+        self.members: Dict[int, List[PageKey]] = {}
+
+    def add_document(self, doc_data) -> Dict[int, PageKey]:
+        """
+        Sign every page of a documents.DocumentData
+
+        Returns:
+            {page: (document, page)} for pages whose text is identical to a page of a document
+            added earlier, so indexes can count that text once
+        """
+        self.remove_document(doc_data.title)
+        identical = {}
+        for section in doc_data.sections:
+            key = (doc_data.title, section.page)
+            digest = hashlib.blake2b(section.content.encode('utf-8'), digest_size=16).digest()
+            self.digests[key] = digest
+            original = self.first_with_digest.setdefault(digest, key)
+            if original[0] != doc_data.title:
+                identical[section.page] = original
+            hashes = shingles(section.content)
+            if hashes:
+                self.signatures[key] = minhash(hashes)
+        return identical
+
+    def remove_document(self, title: str):
+        for key in [key for key in self.signatures if key[0] == title]:
+            del self.signatures[key]
+        for key in [key for key in self.digests if key[0] == title]:
+            digest = self.digests.pop(key)
+            if self.first_with_digest.get(digest) == key:
+                del self.first_with_digest[digest]
+        if any(key[0] == title for key in self.clusters):
+            self.finalize()
+
+    def finalize(self):
+        """Cluster pages of different documents whose signatures agree on at least the threshold"""
+        parent: Dict[PageKey, PageKey] = {}
+
+        def root(key: PageKey) -> PageKey:
+            while parent.get(key, key) != key:
+                parent[key] = parent.get(parent[key], parent[key])  # Path halving
+                key = parent[key]
+            return key
+
+        for band in range(BANDS):
+            buckets: Dict[bytes, List[PageKey]] = {}
+            for key, signature in self.signatures.items():
+                buckets.setdefault(signature[band * ROWS:(band + 1) * ROWS].tobytes(), []).append(key)
+            for keys in buckets.values():
+                for i, first in enumerate(keys):
+                    for second in keys[i + 1:]:
+                        if first[0] == second[0] or root(first) == root(second):
+                            continue
+                        if similarity(self.signatures[first], self.signatures[second]) >= self.threshold:
+                            parent.setdefault(first, first)
+                            parent.setdefault(second, second)
+                            parent[root(second)] = root(first)
+
+        self.clusters = {}
+        self.members = {}
+        roots: Dict[PageKey, int] = {}
+        for key in sorted(parent):
+            cluster = roots.setdefault(root(key), len(roots))
+            self.clusters[key] = cluster
+        for key, cluster in self.clusters.items():
+            self.members.setdefault(cluster, []).append(key)
+
+    def duplicates(self, document: str, page: int) -> List[PageKey]:
+        """Other pages in the same cluster as this one"""
+        cluster = self.clusters.get((document, page))
+        if cluster is None:
+            return []
+        return [key for key in self.members[cluster] if key != (document, page)]
+
+    def collapse(self, results: List[Dict]) -> List[Dict]:
+        """
+        Keep the first hit of each cluster, listing the others in its "also_in"
+
+        Results are expected best first. Hits that already carry an "also_in" keep theirs.
+        """
+        kept: Dict[int, Dict] = {}
+        collapsed = []
+        for result in results:
+            key = (result['document'], result['page'])
+            cluster = self.clusters.get(key)
+            if cluster is None:
+                collapsed.append(result)
+                continue
+            first = kept.get(cluster)
+            if first is None:
+                kept[cluster] = result
+                collapsed.append(result)
+                continue
+            listed = first.setdefault('also_in', [])
+            for document, page in [key] + [(other['document'], other['page']) for other in result.get('also_in', [])]:
+                if not any(entry['document'] == document and entry['page'] == page for entry in listed):
+                    listed.append({
+                        'document': document,
+                        'page': page,
+                        'identical': self.digests.get((document, page)) ==
+                                     self.digests.get((first['document'], first['page']))
+                    })
+        return collapsed
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            'pages': len(self.signatures),
+            'clusters': len(self.members),
+            'clustered_pages': len(self.clusters),
+            'identical_pages': len(self.digests) - len(set(self.digests.values()))
+        }
@@ -0,0 +1,262 @@
+"""
+Shared, rate-limit-aware scheduler for OpenAI API calls
+
+All calls go through one asyncio event loop running in a background thread, with a pooled
+HTTP client, token buckets for requests and tokens per minute, priority for interactive
+queries over background embedding jobs, and jittered exponential-backoff retries.
+Synchronous Flask code uses run() and stream(), which block the calling thread only.
+"""
+
+import os
+import time
+import queue
+import random
+import asyncio
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+try:
+    import httpx
+except ImportError:  # Newer openai releases ship httpx as httpx2
+    import httpx2 as httpx
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # Includes APITimeoutError
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """Continuously refilling budget of `per_minute` units"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)"""
+        self._refill()
+        amount = min(amount, self.capacity)  # An oversized request waits for a full bucket
+        return 0.0 if self.available >= amount else (amount - self.available) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        """Return (or, if negative, charge) the difference between estimated and actual use"""
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    sequence: int
+    call: Callable[[AsyncOpenAI], Awaitable[Any]] = field(compare=False)
+    tokens: int = field(compare=False)
+    future: Future = field(compare=False)
+    attempt: int = field(default=0, compare=False)
+
+
+class RequestScheduler:
+    """Dispatches OpenAI calls within request/token rate limits, highest priority first"""
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None,
+                 requests_per_minute: int = None, tokens_per_minute: int = None,
+                 max_concurrency: int = None, max_retries: int = 6, timeout: float = 60.0):
+        """
+        Args:
+            api_key: OpenAI API key
+            base_url: Alternative API endpoint (defaults to OPENAI_BASE_URL or the public API)
+            requests_per_minute: Request budget (or set OPENAI_RPM)
+            tokens_per_minute: Token budget (or set OPENAI_TPM)
+            max_concurrency: Simultaneous in-flight requests and pooled connections (or set OPENAI_MAX_CONCURRENCY)
+            max_retries: Retries for rate limits, timeouts and server errors
+            timeout: Per-request timeout in seconds
+        """
+        self.requests = TokenBucket(requests_per_minute or int(os.getenv('OPENAI_RPM', 3500)))
+        self.tokens = TokenBucket(tokens_per_minute or int(os.getenv('OPENAI_TPM', 90000)))
+        self.max_concurrency = max_concurrency or int(os.getenv('OPENAI_MAX_CONCURRENCY', 16))
+        self.max_retries = max_retries
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rate_limited': 0}
+        self.stats_lock = threading.Lock()  # Counted on the loop thread, read by metrics() from any thread
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="openai-scheduler", daemon=True)
+        self.thread.start()
+
+        # The client is built on the scheduler loop; its own retries are off because we retry here
+        self.client: AsyncOpenAI = asyncio.run_coroutine_threadsafe(
+            self._make_client(api_key, base_url, timeout), self.loop).result()
+        self._sequence = itertools.count()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.wakeup = asyncio.Event()
+        self.slots = asyncio.Semaphore(self.max_concurrency)
+        self.loop.create_task(self._dispatch())
+        self.loop.run_forever()
+
+    async def _make_client(self, api_key: str, base_url: Optional[str], timeout: float) -> AsyncOpenAI:
+        http_client = DefaultAsyncHttpxClient(limits=httpx.Limits(
+            max_connections=self.max_concurrency,
+            max_keepalive_connections=self.max_concurrency
+        ))
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout,
+                           http_client=http_client)
+
+    def submit(self, call: Callable[[AsyncOpenAI], Awaitable[Any]], tokens: int = 0,
+               priority: int = INTERACTIVE) -> Future:
+        """Queue call(client) and return a future for its result"""
+        future: Future = Future()
+        job = _Job(priority, next(self._sequence), call, tokens, future)
+        self.loop.call_soon_threadsafe(self._enqueue, job)
+        return future
+
+    def run(self, call: Callable[[AsyncOpenAI], Awaitable[Any]], tokens: int = 0,
+            priority: int = INTERACTIVE, timeout: Optional[float] = None) -> Any:
+        """Blocking form of submit()"""
+        return self.submit(call, tokens, priority).result(timeout)
+
+    def stream(self, call: Callable[[AsyncOpenAI], Awaitable[Any]], tokens: int = 0,
+               priority: int = INTERACTIVE) -> Iterator[Any]:
+        """Run a streaming call and iterate its chunks from the calling thread"""
+        items: queue.Queue = queue.Queue()
+        done = object()
+
+        async def relay(client):
+            stream = await call(client)
+            started = False
+            try:
+                async for chunk in stream:
+                    started = True
+                    items.put(chunk)
+            except RETRYABLE_ERRORS as e:
+                if started:
+                    # Chunks were already relayed, so a retry would repeat them
+                    raise RuntimeError(f"Stream interrupted: {e}") from e
+                raise
+            items.put(done)
+
+        future = self.submit(relay, tokens, priority)
+        future.add_done_callback(lambda f: items.put(done) if f.exception() else None)
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            yield item
+        future.result()  # Re-raise a failure that ended the stream
+
+    def _enqueue(self, job: _Job):
+        self.queue.put_nowait(job)
+        self.wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            # A slot first, then the job: taken any earlier, a background job could hold its
+            # place while interactive ones queued behind it for the slot
+            await self.slots.acquire()
+            job = await self.queue.get()
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(job.tokens))
+            if wait > 0:
+                # Put the job back and sleep until budget refills or a new (maybe higher-priority) job arrives
+                self.queue.put_nowait(job)
+                self.slots.release()
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.requests.take(1)
+            self.tokens.take(job.tokens)
+            self.loop.create_task(self._execute(job))
+
+    def _count(self, stat: str):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    async def _execute(self, job: _Job):
+        try:
+            self._count('requests')
+            result = await job.call(self.client)
+        except RETRYABLE_ERRORS as e:
+            self.slots.release()
+            if isinstance(e, openai.RateLimitError):
+                self._count('rate_limited')
+            if job.attempt >= self.max_retries:
+                self._count('failures')
+                job.future.set_exception(e)
+                return
+            delay = self._retry_delay(e, job.attempt)
+            job.attempt += 1
+            self._count('retries')
+            logger.warning(f"OpenAI call failed ({type(e).__name__}), retry {job.attempt} in {delay:.1f}s")
+            self.loop.call_later(delay, self._enqueue, job)
+            return
+        except Exception as e:
+            self.slots.release()
+            self._count('failures')
+            job.future.set_exception(e)
+            return
+
+        self.slots.release()
+        # Settle the token estimate against what the API actually billed
+        usage = getattr(result, 'usage', None)
+        if usage is not None and getattr(usage, 'total_tokens', None) is not None:
+            self.tokens.refund(job.tokens - usage.total_tokens)
+        job.future.set_result(result)
+
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """Server-suggested Retry-After when given, otherwise full-jitter exponential backoff"""
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, 0.5)
+            except ValueError:
+                pass
+        return random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, queued=self.queue.qsize(),
+                    requests_available=int(self.requests.available), tokens_available=int(self.tokens.available))
+
+
+_schedulers: Dict[tuple, RequestScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api_key: str, base_url: Optional[str] = None) -> RequestScheduler:
+    """Process-wide scheduler per API key, so every engine shares one quota"""
+    key = (api_key, base_url)
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = RequestScheduler(api_key, base_url)
+        return _schedulers[key]
@@ -0,0 +1,58 @@
+"""
+Standalone PDFs of a page range, cut from the source documents and cached on disk
+
+A cited clause is usually a page or two of a multi-megabyte standard. PyMuPDF's insert_pdf
+copies just those pages (and the fonts and images they use) into a new document, which is
+written once per document version and range and then served from the cache.
+"""
+
+import hashlib
+from typing import Dict, Tuple
+
+import fitz  # PyMuPDF
+
+from disk_cache import DiskCache, file_fingerprint
+from documents import FITZ_LOCK
+
+MAX_PAGES = 50  # Longer ranges are refused; the whole document is the better download then
+
+
+class PageRangeCache:
+    """Builds page-range PDFs on demand and keeps them on disk up to max_bytes"""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 100 * 1024 * 1024):
+        self.files = DiskCache(cache_dir, max_bytes)
+
+    def key(self, file_path: str, first: int, last: int) -> str:
+        identity = f"{file_fingerprint(file_path)}\x1f{first}-{last}"
+        return f"{hashlib.sha1(identity.encode('utf-8')).hexdigest()[:24]}.pdf"
+
+    def get(self, file_path: str, first: int, last: int) -> Tuple[bytes, str]:
+        """
+        PDF holding 1-based pages first..last inclusive, building it if it is not cached
+
+        Returns:
+            (PDF bytes, etag) where etag is the cache key
+        """
+        name = self.key(file_path, first, last)
+        return self.files.read(name, lambda: self._build(file_path, first, last)), name
+
+    def _build(self, file_path: str, first: int, last: int) -> bytes:
+        with FITZ_LOCK:
+            source = fitz.open(file_path)
+            extract = fitz.open()
+            try:
+                if not 1 <= first <= last <= len(source):
+                    raise IndexError(f"Pages {first}-{last} out of range (1-{len(source)})")
+                extract.insert_pdf(source, from_page=first - 1, to_page=last - 1)
+                title = (source.metadata or {}).get('title') or ''
+                pages = f"page {first}" if first == last else f"pages {first}-{last}"
+                extract.set_metadata({'title': f"{title} ({pages})".strip()})
+                # garbage=3 drops objects the copied pages do not reference
+                return extract.tobytes(garbage=3, deflate=True)
+            finally:
+                extract.close()
+                source.close()
+
+    def metrics(self) -> Dict[str, int]:
+        return self.files.metrics()
@@ -0,0 +1,335 @@
+"""
+Compressed in-memory store of every extracted page, so no PDF is extracted twice
+
+Each page is one block: its text, its word text when that is not just the lowercased text,
+and its word boxes as delta-encoded columns of tenths of a point. Blocks are compressed with
+zstd when zstandard is installed, otherwise zlib, each with a dictionary built from the
+corpus itself: pages are a few kilobytes, too short to compress well on their own, but
+standards repeat the same phrasing throughout. Identical pages, such as the unchanged pages
+of a revision, share one block. A small LRU of decoded pages serves repeated single-page
+reads such as preview highlights.
+"""
+
+import struct
+import hashlib
+import logging
+import threading
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+from itertools import accumulate, repeat
+from operator import add, sub, truediv
+from typing import Dict, Optional, Sequence, Tuple
+
+from documents import DocumentData, DocumentSection, PageWords
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_BYTES = 32 * 1024  # zlib's window; a larger preset dictionary would not be reached
+TRAINING_BYTES = 1024 * 1024  # Page text buffered uncompressed before the dictionary is built
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 19  # Blocks are compressed once and decompressed many times
+HOT_BLOCKS = 256
+BOX_SCALE = 10  # Boxes are kept to a tenth of a point, the precision search results report
+
+# text bytes, word text bytes (0 = the lowercased text), words, width, height, box column type;
+# the page number is kept outside the block, so identical pages of two documents share one
+BLOCK_HEADER = struct.Struct('<IIIffc')
+
+
+def encode_page(section: DocumentSection) -> bytes:
+    content = section.content.encode('utf-8')
+    words = section.words.unpacked() if section.words is not None else PageWords((), 0.0, 0.0)
+    word_text = b'' if words.text == section.content.lower() else words.text.encode('utf-8')
+    count = len(words.starts)
+
+    # Columns of small numbers compress far better than interleaved floats: the gap before
+    # each word, its width, the change in top edge from the previous word and its height
+    v = [round(value * BOX_SCALE) for value in words.boxes]
+    x0, y0, x1, y1 = v[0::4], v[1::4], v[2::4], v[3::4]
+    columns = ([x0[i] - (x1[i - 1] if i else 0) for i in range(count)],
+               [x1[i] - x0[i] for i in range(count)],
+               [y0[i] - (y0[i - 1] if i else 0) for i in range(count)],
+               [y1[i] - y0[i] for i in range(count)])
+    typecode = 'h' if all(-32768 <= n <= 32767 for column in columns for n in column) else 'i'
+    boxes = b''.join(array(typecode, column).tobytes() for column in columns)
+
+    header = BLOCK_HEADER.pack(len(content), len(word_text), count,
+                               words.width, words.height, typecode.encode('ascii'))
+    return header + content + word_text + boxes
+
+
+def decode_page(block: bytes, page: int) -> DocumentSection:
+    content_size, word_size, count, width, height, typecode = BLOCK_HEADER.unpack_from(block)
+    position = BLOCK_HEADER.size
+    content = block[position:position + content_size].decode('utf-8')
+    position += content_size
+    word_text = block[position:position + word_size].decode('utf-8') if word_size else content.lower()
+    position += word_size
+
+    # Box columns are only converted for a page that gets highlighted; a keyword scan needs just the text
+    boxes = block[position:]
+    words = PageWords.packed(word_text, width, height,
+                             lambda: unpack_words(word_text, array(typecode.decode('ascii'), boxes), count))
+    return DocumentSection(title=f"Page {page}", content=content, page=page, words=words if count else None)
+
+
+def unpack_words(word_text: str, columns: array, count: int) -> Tuple[array, array]:
+    """Word start offsets and x0, y0, x1, y1 boxes from a block's word text and box columns"""
+    # Each word starts after the lengths of the words before it plus one space apiece
+    starts = array('i', map(add, accumulate(map(len, word_text.split(' ')[:-1]), initial=0), range(count)))
+    gaps, widths, rises, heights = (columns[i * count:(i + 1) * count] for i in range(4))
+    # Undo the deltas and interleave back to x0, y0, x1, y1 without a Python-level loop
+    rights = list(accumulate(map(add, gaps, widths)))
+    tops = list(accumulate(rises))
+    values = [0] * (4 * count)
+    values[0::4] = map(sub, rights, widths)
+    values[1::4] = tops
+    values[2::4] = rights
+    values[3::4] = map(add, tops, heights)
+    return starts, array('f', map(truediv, values, repeat(BOX_SCALE)))
+
+
+def build_zlib_dictionary(samples: Sequence[str], size: int = DICTIONARY_BYTES) -> bytes:
+    """
+    Preset dictionary of the three-word phrases that recur across pages
+
+    zlib finds matches by distance, so the most valuable phrases go last, nearest the data.
+    """
+    counts: Counter = Counter()
+    for text in samples:
+        words = text.split()
+        counts.update({' '.join(words[i:i + 3]) for i in range(len(words) - 2)})
+    phrases = sorted((count * len(phrase), phrase) for phrase, count in counts.items() if count > 1)
+    chosen = []
+    total = 0
+    for _, phrase in reversed(phrases):
+        if total + len(phrase) + 1 > size:
+            break
+        chosen.append(phrase)
+        total += len(phrase.encode('utf-8')) + 1
+    return ''.join(phrase + ' ' for phrase in reversed(chosen)).encode('utf-8')
+
+
+class ZlibCodec:
+    name = 'zlib'
+
+    def __init__(self, dictionary: bytes = b''):
+        self.dictionary = dictionary
+
+    @classmethod
+    def load(cls, dictionary: bytes) -> 'ZlibCodec':
+        return cls(dictionary)
+
+    @classmethod
+    def train(cls, samples: Sequence[str]) -> 'ZlibCodec':
+        return cls(build_zlib_dictionary(samples))
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zdict=self.dictionary) if self.dictionary \
+            else zlib.compressobj(ZLIB_LEVEL)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self, dictionary: Optional['zstandard.ZstdCompressionDict'] = None):
+        self.dictionary = dictionary
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary)
+        self.decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        # zstandard's (de)compressor objects must not be shared between threads
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, dictionary: bytes) -> 'ZstdCodec':
+        return cls(zstandard.ZstdCompressionDict(dictionary) if dictionary else None)
+
+    @classmethod
+    def train(cls, samples: Sequence[str]) -> 'ZstdCodec':
+        try:
+            return cls(zstandard.train_dictionary(DICTIONARY_BYTES, [text.encode('utf-8') for text in samples]))
+        except zstandard.ZstdError as e:
+            # Too little text to train on; blocks are still compressed, just without one
+            logger.warning(f"Could not train a zstd dictionary: {e}")
+            return cls()
+
+    def compress(self, data: bytes) -> bytes:
+        with self.lock:
+            return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        with self.lock:
+            return self.decompressor.decompress(data)
+
+
+class PageStore:
+    """Every document's pages as compressed blocks, decoded on demand"""
+
+    def __init__(self, hot_blocks: int = HOT_BLOCKS):
+        self.codec = None  # Chosen and trained once TRAINING_BYTES of text (or every document) is in
+        self.documents: Dict[str, Dict] = {}  # title -> {version, pages, digests, raw_bytes}
+        # Digest of an encoded page -> its block, compressed once the codec exists; identical
+        # pages (the unchanged pages of a revision) are stored once
+        self.blocks: Dict[bytes, bytes] = {}
+        self.references: Counter = Counter()
+        self.hot: OrderedDict = OrderedDict()  # (title, page) -> DocumentSection
+        self.hot_blocks = hot_blocks
+        self.lock = threading.Lock()
+        self.pending_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'documents_decoded': 0}
+
+    def __contains__(self, title: str) -> bool:
+        return title in self.documents
+
+    def add_document(self, doc_data: DocumentData, version: Optional[Tuple] = None):
+        """
+        Store a document's pages, replacing any earlier version of it
+
+        Args:
+            version: Identity of the source file (see disk_cache.file_fingerprint); a document
+                stored under another version is treated as missing
+        """
+        encoded = [encode_page(section) for section in doc_data.sections]
+        digests = [hashlib.blake2b(block, digest_size=16).digest() for block in encoded]
+        with self.lock:
+            self._release(doc_data.title)
+            for digest, block in zip(digests, encoded):
+                if digest not in self.blocks:
+                    if self.codec is not None:
+                        block = self.codec.compress(block)
+                    else:
+                        self.pending_bytes += len(block)
+                    self.blocks[digest] = block
+                self.references[digest] += 1
+            self.documents[doc_data.title] = {
+                'version': version,
+                'pages': array('i', (section.page for section in doc_data.sections)),
+                'digests': digests,
+                'raw_bytes': sum(len(section.content.encode('utf-8')) for section in doc_data.sections)
+            }
+            train = self.codec is None and self.pending_bytes >= TRAINING_BYTES
+        if train:
+            self.finalize()
+
+    def _release(self, title: str):
+        stored = self.documents.pop(title, None)
+        if stored is None:
+            return
+        for digest in stored['digests']:
+            self.references[digest] -= 1
+            if self.references[digest] <= 0:
+                del self.references[digest]
+                del self.blocks[digest]
+        for key in [key for key in self.hot if key[0] == title]:
+            del self.hot[key]
+
+    def finalize(self):
+        """Build the corpus dictionary from the pages stored so far and compress them"""
+        with self.lock:
+            if self.codec is not None:
+                return
+            samples = [decode_page(block, 0).content for block in self.blocks.values()]
+            codec = ZstdCodec if zstandard is not None else ZlibCodec
+            self.codec = codec.train(samples)
+            logger.info(f"Page store dictionary built from {len(samples)} pages ({self.codec.name})")
+            self.blocks = {digest: self.codec.compress(block) for digest, block in self.blocks.items()}
+            self.pending_bytes = 0
+
+    def export(self, titles: Sequence[str]) -> Dict:
+        """
+        The named documents' compressed blocks and the codec dictionary, as plain picklable
+        values for PageStore.load in another process; shared pages are exported once
+        """
+        with self.lock:
+            documents = {title: dict(self.documents[title]) for title in titles if title in self.documents}
+            dictionary = self.codec.dictionary if self.codec is not None else None
+            return {
+                'codec': self.codec.name if self.codec is not None else None,
+                'dictionary': dictionary.as_bytes() if hasattr(dictionary, 'as_bytes') else dictionary or b'',
+                'documents': documents,
+                'blocks': {digest: self.blocks[digest]
+                           for stored in documents.values() for digest in stored['digests']}
+            }
+
+    @classmethod
+    def load(cls, exported: Dict, hot_blocks: int = HOT_BLOCKS) -> 'PageStore':
+        """A store holding what PageStore.export returned, without recompressing anything"""
+        store = cls(hot_blocks)
+        if exported['codec'] is not None:
+            codecs = {'zlib': ZlibCodec, 'zstd': ZstdCodec}
+            store.codec = codecs[exported['codec']].load(exported['dictionary'])
+        store.documents = exported['documents']
+        store.blocks = exported['blocks']
+        store.references = Counter(digest for stored in store.documents.values() for digest in stored['digests'])
+        return store
+
+    def version(self, title: str) -> Optional[Tuple]:
+        """The source file version a document is stored for"""
+        with self.lock:
+            stored = self.documents.get(title)
+            return stored['version'] if stored is not None else None
+
+    def _block(self, digest: bytes) -> bytes:
+        block = self.blocks[digest]
+        return self.codec.decompress(block) if self.codec is not None else block
+
+    def document(self, title: str, version: Optional[Tuple] = None) -> Optional[DocumentData]:
+        """A stored document decoded in full, or None if it is missing or stored for another version"""
+        with self.lock:
+            stored = self.documents.get(title)
+            if stored is None or stored['version'] != version:
+                return None
+            blocks = [self._block(digest) for digest in stored['digests']]
+            self.stats['documents_decoded'] += 1
+        sections = [decode_page(block, page) for block, page in zip(blocks, stored['pages'])]
+        return DocumentData(title=title, sections=sections)
+
+    def page(self, title: str, page: int, version: Optional[Tuple] = None) -> Optional[DocumentSection]:
+        """One decoded page, through the hot-block cache; None if it has no text or is not stored"""
+        key = (title, page)
+        with self.lock:
+            stored = self.documents.get(title)
+            if stored is None or stored['version'] != version:
+                return None
+            section = self.hot.get(key)
+            if section is not None:
+                self.hot.move_to_end(key)
+                self.stats['hits'] += 1
+                return section
+            try:
+                index = stored['pages'].index(page)
+            except ValueError:
+                return None
+            block = self._block(stored['digests'][index])
+            self.stats['misses'] += 1
+        section = decode_page(block, page)
+        with self.lock:
+            self.hot[key] = section
+            while len(self.hot) > self.hot_blocks:
+                self.hot.popitem(last=False)
+        return section
+
+    def metrics(self) -> Dict:
+        with self.lock:
+            pages = sum(len(stored['pages']) for stored in self.documents.values())
+            dictionary = self.codec.dictionary if self.codec is not None else None
+            return dict(self.stats,
+                        codec=self.codec.name if self.codec is not None else None,
+                        documents=len(self.documents),
+                        pages=pages,
+                        shared_pages=pages - len(self.blocks),
+                        text_bytes=sum(stored['raw_bytes'] for stored in self.documents.values()),
+                        stored_bytes=sum(map(len, self.blocks.values())),
+                        dictionary_bytes=len(dictionary.as_bytes() if hasattr(dictionary, 'as_bytes')
+                                             else dictionary or b''),
+                        hot_blocks=len(self.hot))
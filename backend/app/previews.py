@@ -0,0 +1,130 @@
+"""
+Rendered page previews with search-term highlights, kept in a bounded disk cache
+
+A preview is one PDF page rasterized by PyMuPDF at a requested width, with every occurrence
+of the search terms shaded, encoded as WebP (when Pillow is installed) or PNG. Renders are
+keyed on the file's identity, page, terms, width and format, so an edited PDF never serves
+a stale image, and the least recently used files are evicted past the size budget.
+"""
+
+import io
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from disk_cache import DiskCache, file_fingerprint
+from documents import FITZ_LOCK, PageWords
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+DEFAULT_WIDTH = 800
+MIN_WIDTH = 200
+MAX_WIDTH = 2400
+WEBP_QUALITY = 80
+HIGHLIGHT_COLOR = (1.0, 0.85, 0.0)
+HIGHLIGHT_OPACITY = 0.4
+
+
+def available_formats() -> List[str]:
+    return ['webp', 'png'] if Image is not None else ['png']
+
+
+def clamp_width(width: Optional[int]) -> int:
+    return max(MIN_WIDTH, min(MAX_WIDTH, int(width or DEFAULT_WIDTH)))
+
+
+class PreviewCache:
+    """Renders page previews on demand and keeps them on disk up to max_bytes"""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 200 * 1024 * 1024, prerender_workers: int = 1,
+                 page_words: Optional[Callable[[str, int], Optional[PageWords]]] = None):
+        """
+        Args:
+            cache_dir: Directory for rendered images (created if missing; existing files are reused)
+            max_bytes: Total size of cached images before the least recently used are deleted
+            prerender_workers: Threads rendering the pages of top search hits ahead of requests
+            page_words: (file_path, page) -> the page's word boxes if already extracted, so
+                highlights are placed without searching the page's text again
+        """
+        self.files = DiskCache(cache_dir, max_bytes)
+        self.page_words = page_words
+        self.executor = ThreadPoolExecutor(max_workers=prerender_workers, thread_name_prefix="preview")
+        self.stats = {'prerenders': 0, 'indexed_highlights': 0}
+
+    def key(self, file_path: str, page: int, terms: Iterable[str], width: int, fmt: str) -> str:
+        identity = '\x1f'.join([file_fingerprint(file_path), str(page), '\x1e'.join(sorted(set(terms))), str(width)])
+        return f"{hashlib.sha1(identity.encode('utf-8')).hexdigest()[:24]}.{fmt}"
+
+    def get(self, file_path: str, page: int, terms: Iterable[str] = (), width: int = DEFAULT_WIDTH,
+            fmt: str = 'png') -> Tuple[bytes, str]:
+        """
+        Image of a 1-based page, rendering it if it is not cached
+
+        Returns:
+            (image bytes, etag) where etag is the cache key
+        """
+        terms = list(terms)
+        name = self.key(file_path, page, terms, width, fmt)
+        return self.files.read(name, lambda: self._render(file_path, page, terms, width, fmt)), name
+
+    def prerender(self, pages: Iterable[Tuple[str, int]], terms: Iterable[str] = (),
+                  width: int = DEFAULT_WIDTH, fmt: Optional[str] = None):
+        """Queue (file_path, page) renders, e.g. for the top hits of a search, without waiting"""
+        fmt = fmt or available_formats()[0]
+        terms = list(terms)
+        for file_path, page in pages:
+            try:
+                name = self.key(file_path, page, terms, width, fmt)
+            except OSError:
+                continue
+            if name in self.files:
+                continue
+            self.stats['prerenders'] += 1
+            self.executor.submit(self._prerender_one, file_path, page, terms, width, fmt)
+
+    def _prerender_one(self, file_path: str, page: int, terms: List[str], width: int, fmt: str):
+        try:
+            self.get(file_path, page, terms, width, fmt)
+        except Exception as e:
+            logger.warning(f"Pre-rendering page {page} of {file_path} failed: {e}")
+
+    def _render(self, file_path: str, page_number: int, terms: List[str], width: int, fmt: str) -> bytes:
+        words = self.page_words(file_path, page_number) if self.page_words and terms else None
+        with FITZ_LOCK:
+            doc = fitz.open(file_path)
+            try:
+                if not 1 <= page_number <= len(doc):
+                    raise IndexError(f"Page {page_number} out of range (1-{len(doc)})")
+                page = doc[page_number - 1]
+                if words is not None:
+                    rects = [fitz.Rect(box) for box in words.find(terms)]
+                    self.stats['indexed_highlights'] += 1
+                else:
+                    rects = [rect for term in terms for rect in page.search_for(term)]
+                # Shapes drawn on the in-memory page only; the file is never saved
+                for rect in rects:
+                    page.draw_rect(rect, color=None, fill=HIGHLIGHT_COLOR,
+                                   fill_opacity=HIGHLIGHT_OPACITY, overlay=True)
+                zoom = width / page.rect.width
+                pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+                if fmt != 'webp':
+                    return pixmap.tobytes('png')
+                size, samples = (pixmap.width, pixmap.height), pixmap.samples
+            finally:
+                doc.close()
+
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', size, samples).save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+        return buffer.getvalue()
+
+    def metrics(self) -> Dict[str, int]:
+        return dict(self.files.metrics(), **self.stats)
@@ -0,0 +1,189 @@
+"""
+Opt-in sampling profiler for requests and a bounded log of slow queries
+
+A profiled request has its thread's stack (and the stacks of busy helper-pool threads such
+as the document loader) sampled every few milliseconds by one shared background thread.
+The samples are aggregated into collapsed stacks, the format flame graph tools read.
+Requests slower than a threshold are kept in a ring buffer with their query, documents,
+cache state and profile, if they were sampled.
+"""
+
+import sys
+import time
+import random
+import threading
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_INTERVAL = 0.005
+MAX_DEPTH = 48
+TOP_STACKS = 40
+# Pools that do work on a request's behalf; their idle workers are skipped
+HELPER_THREAD_PREFIXES = ('loader', 'hybrid', 'preview')
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename.replace('\\', '/').rsplit('/', 1)[-1]
+    return f"{code.co_name} ({filename}:{frame.f_lineno})"
+
+
+def collapse_stack(frame, max_depth: int = MAX_DEPTH) -> Optional[str]:
+    """Root-to-leaf "a;b;c" stack string, or None for an idle pool worker"""
+    labels = []
+    leaf_file = frame.f_code.co_filename
+    idle_pool_worker = False
+    while frame is not None and len(labels) < max_depth:
+        if frame.f_code.co_name == '_worker' and frame.f_code.co_filename.endswith(('thread.py', 'process.py')):
+            idle_pool_worker = leaf_file.endswith(('threading.py', 'queue.py'))
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    if idle_pool_worker:
+        return None
+    return ';'.join(reversed(labels))
+
+
+class Profile:
+    """Samples collected for one request"""
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+
+    def summary(self, interval: float) -> Dict[str, Any]:
+        # Self time per function: how often it was the innermost frame
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return {
+            'samples': self.samples,
+            'interval_ms': interval * 1000,
+            'top_functions': [{'function': name, 'samples': count, 'share': count / max(1, sum(leaves.values()))}
+                              for name, count in leaves.most_common(15)],
+            'stacks': [{'stack': stack, 'samples': count} for stack, count in self.stacks.most_common(TOP_STACKS)]
+        }
+
+
+class RequestProfiler:
+    """Samples the stacks of profiled requests and records the slow ones"""
+
+    def __init__(self, sample_rate: float = 0.0, slow_ms: float = 1000.0, log_size: int = 100,
+                 interval: float = DEFAULT_INTERVAL, context: Optional[Callable[[], Dict[str, Any]]] = None):
+        """
+        Args:
+            sample_rate: Fraction of requests profiled without being asked to (0 = only on request)
+            slow_ms: Requests at least this slow are logged, with their profile if they have one
+            log_size: Slow requests kept; the oldest are dropped first
+            interval: Seconds between stack samples
+            context: Returns server state (caches, loads in flight) to store with each entry
+        """
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.interval = interval
+        self.context = context
+        self.log: deque = deque(maxlen=log_size)
+        self.lock = threading.Lock()
+        self.active: Dict[int, Profile] = {}
+        self.sampler: Optional[threading.Thread] = None
+        self.helper_threads: Dict[int, str] = {}
+        self.helpers_refreshed = 0.0
+        self.stats = {'requests': 0, 'profiled': 0, 'logged': 0}
+
+    def should_profile(self, forced: bool) -> bool:
+        return forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def start(self) -> Profile:
+        """Begin sampling the calling thread"""
+        profile = Profile(threading.get_ident())
+        with self.lock:
+            self.active[id(profile)] = profile
+            if self.sampler is None or not self.sampler.is_alive():
+                self.sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self.sampler.start()
+        return profile
+
+    def stop(self, profile: Profile):
+        """Stop sampling; no sample is added to the profile after this returns"""
+        with self.lock:
+            self.active.pop(id(profile), None)
+
+    def _helpers(self) -> Dict[int, str]:
+        now = time.monotonic()
+        if now - self.helpers_refreshed > 1.0:
+            self.helper_threads = {t.ident: t.name for t in threading.enumerate()
+                                   if t.name.startswith(HELPER_THREAD_PREFIXES)}
+            self.helpers_refreshed = now
+        return self.helper_threads
+
+    def _sample_loop(self):
+        while True:
+            with self.lock:
+                profiles = list(self.active.values())
+                if not profiles:
+                    self.sampler = None
+                    return
+            frames = sys._current_frames()
+            helpers = self._helpers()
+            # Busy helper threads are shared, so each profiled request sees all of them
+            helper_stacks = []
+            for ident, name in helpers.items():
+                frame = frames.get(ident)
+                stack = collapse_stack(frame) if frame is not None else None
+                if stack:
+                    helper_stacks.append(f"[{name}];{stack}")
+            request_stacks = {}
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                stack = collapse_stack(frame) if frame is not None else None
+                request_stacks[id(profile)] = stack
+            del frames
+            # Counted under the lock, and only for profiles still active: once stop() returns,
+            # the request reads its stacks without the sampler touching them again
+            with self.lock:
+                for profile in profiles:
+                    if self.active.get(id(profile)) is not profile:
+                        continue
+                    stack = request_stacks[id(profile)]
+                    if stack:
+                        profile.stacks[f"[request];{stack}"] += 1
+                    for stack in helper_stacks:
+                        profile.stacks[stack] += 1
+                    profile.samples += 1
+            time.sleep(self.interval)
+
+    def record(self, entry: Dict[str, Any], profile: Optional[Profile], forced: bool = False):
+        """Log a finished request if it was slow (or explicitly profiled)"""
+        with self.lock:
+            self.stats['requests'] += 1
+            if profile is not None:
+                self.stats['profiled'] += 1
+        if entry['duration_ms'] < self.slow_ms and not forced:
+            return
+        if self.context is not None:
+            try:
+                entry['server'] = self.context()
+            except Exception as e:
+                entry['server'] = {'error': str(e)}
+        if profile is not None:
+            entry['profile'] = profile.summary(self.interval)
+        with self.lock:
+            self.stats['logged'] += 1
+            self.log.append(entry)
+
+    def entries(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Logged requests, newest first"""
+        with self.lock:
+            entries = list(self.log)
+        entries.reverse()
+        return entries[:limit] if limit else entries
+
+    def clear(self):
+        with self.lock:
+            self.log.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.stats, sample_rate=self.sample_rate, slow_ms=self.slow_ms,
+                        logged_now=len(self.log), capacity=self.log.maxlen)
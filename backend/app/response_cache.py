@@ -0,0 +1,135 @@
+"""
+Persistent cache for LLM answers, with exact and semantic (embedding) lookup
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query for exact matching"""
+    return ' '.join(query.lower().split())
+
+
+class ResponseCache:
+    """SQLite-backed answer cache keyed on query, context hash, model and prompt version"""
+
+    def __init__(self, path: str, semantic_threshold: Optional[float] = None, max_entries: int = 10000):
+        """
+        Args:
+            path: SQLite file (":memory:" for a process-local cache)
+            semantic_threshold: Minimum query-embedding cosine similarity for a semantic hit;
+                None disables semantic lookup
+            max_entries: Oldest entries are evicted beyond this size
+        """
+        self.path = path
+        self.semantic_threshold = semantic_threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'tokens_saved': 0}
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                context_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                response TEXT NOT NULL,
+                tokens_used INTEGER NOT NULL,
+                embedding BLOB,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_scope ON responses (context_hash, model, prompt_version)")
+        self.conn.commit()
+
+    def make_key(self, query: str, context_hash: str, model: str, prompt_version: str) -> str:
+        return hash_text('\x1f'.join([normalize_query(query), context_hash, model, prompt_version]))
+
+    def get(self, query: str, context_hash: str, model: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+        """Exact lookup; records a miss only through record_miss() so semantic lookup can follow"""
+        key = self.make_key(query, context_hash, model, prompt_version)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, tokens_used FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._record_hit('exact_hits', row[1])
+        return {'response': row[0], 'tokens_used': row[1], 'cache': 'exact'}
+
+    def get_similar(self, query_embedding: List[float], context_hash: str, model: str,
+                    prompt_version: str) -> Optional[Dict[str, Any]]:
+        """Best cached answer for the same context whose query embedding clears the threshold"""
+        if self.semantic_threshold is None or not query_embedding:
+            return None
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT response, tokens_used, embedding FROM responses "
+                "WHERE context_hash = ? AND model = ? AND prompt_version = ? AND embedding IS NOT NULL",
+                (context_hash, model, prompt_version)).fetchall()
+        if not rows:
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        # Entries embedded by a different backend have a different dimension and are skipped
+        rows = [row for row in rows if len(row[2]) == query.nbytes]
+        if not rows:
+            return None
+        matrix = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        similarities = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(similarities.argmax())
+        if similarities[best] < self.semantic_threshold:
+            return None
+
+        response, tokens_used, _ = rows[best]
+        self._record_hit('semantic_hits', tokens_used)
+        return {'response': response, 'tokens_used': tokens_used, 'cache': 'semantic',
+                'cache_similarity': float(similarities[best])}
+
+    def put(self, query: str, context_hash: str, model: str, prompt_version: str,
+            response: str, tokens_used: int, query_embedding: Optional[List[float]] = None):
+        key = self.make_key(query, context_hash, model, prompt_version)
+        embedding = np.asarray(query_embedding, dtype=np.float32).tobytes() if query_embedding else None
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, query, context_hash, model, prompt_version, response, tokens_used, embedding, time.time()))
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self.conn.commit()
+
+    def record_miss(self):
+        with self.lock:
+            self.stats['misses'] += 1
+
+    def _record_hit(self, kind: str, tokens_used: int):
+        with self.lock:
+            self.stats[kind] += 1
+            self.stats['tokens_saved'] += tokens_used
+
+    def metrics(self) -> Dict[str, Any]:
+        """Hit counts and tokens saved since startup, plus the number of stored answers"""
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.stats['exact_hits'] + self.stats['semantic_hits'] + self.stats['misses']
+            hits = lookups - self.stats['misses']
+            return dict(self.stats, entries=entries, hit_rate=hits / lookups if lookups else 0.0)
@@ -0,0 +1,239 @@
+"""
+Scatter-gather keyword search across document shards held by worker processes
+
+Documents are split into shards balanced by file size. Each shard is owned by a long-lived
+process that is handed its documents' compressed page-store blocks rather than the PDFs, so
+nothing is extracted twice and pages shared between documents stay shared; it decodes
+documents as queries need them. A query is scanned on every shard in parallel, outside the
+web process's GIL, and the hits are merged here.
+"""
+
+import os
+import sys
+import time
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from documents import search_sections
+from page_store import PageStore
+
+logger = logging.getLogger(__name__)
+
+# time.monotonic() is system-wide on Linux, macOS and Windows, so deadlines carry over to workers
+SHARD_DEADLINE_GRACE = 0.05  # Seconds allowed past the deadline for a shard's reply to arrive
+SHARD_DECODED_DOCUMENTS = 2  # Decoded documents a worker keeps, as the web process's document cache does
+
+# A spawned process first re-imports the parent's __main__. Under `python main.py` that is the
+# whole web app (Flask, its executors and indexes, memory accounting), so workers are started
+# with this module standing in as __main__; only one start may swap it at a time
+_spawn_lock = threading.Lock()
+
+
+def shard_main(exported: Dict, conn):
+    """Worker loop: load the shard's page-store blocks, then answer (request_id, terms, names, deadline) queries"""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
+    store = PageStore.load(exported)
+    del exported
+
+    @lru_cache(maxsize=SHARD_DECODED_DOCUMENTS)
+    def load(name: str):
+        return store.document(name, store.version(name))
+
+    conn.send(('ready', sorted(store.documents)))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        request_id, weighted_terms, names, deadline = message
+        matches: Dict[str, List[Dict]] = {}
+        skipped = []
+        for name in names:
+            if deadline is not None and time.monotonic() >= deadline:
+                skipped.append(name)
+                continue
+            doc_data = load(name) if name in store else None
+            if doc_data is None:
+                continue
+            matches[name], complete = search_sections(doc_data, weighted_terms, deadline)
+            if not complete:
+                skipped.append(name)
+        conn.send((request_id, matches, skipped))
+
+
+class Shard:
+    """Parent-side handle for one worker process and its pending queries"""
+
+    def __init__(self, index: int, documents: Dict[str, str], exported: Dict, context):
+        self.index = index
+        self.documents = documents
+        self.exported = exported  # Kept to hand to a restarted worker
+        self.stored_bytes = sum(map(len, exported['blocks'].values()))
+        self.context = context
+        self.ready = False
+        self.pending: Dict[int, Future] = {}
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.start()
+
+    def start(self):
+        # Queries sent to a previous worker will never be answered
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(f"Search shard {self.index} restarted"))
+        self.ready = False
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=shard_main, args=(self.exported, child_conn),
+                                            name=f"search-shard-{self.index}", daemon=True)
+        with _spawn_lock:
+            main_module = sys.modules['__main__']
+            sys.modules['__main__'] = sys.modules[__name__]
+            try:
+                self.process.start()
+            finally:
+                sys.modules['__main__'] = main_module
+        child_conn.close()
+        threading.Thread(target=self._read_replies, args=(self.conn,),
+                         name=f"search-shard-{self.index}-reader", daemon=True).start()
+
+    def _read_replies(self, conn):
+        while True:
+            try:
+                reply = conn.recv()
+            except (EOFError, OSError):
+                break
+            if reply[0] == 'ready':
+                self.ready = True
+                logger.info(f"Search shard {self.index} ready with {len(reply[1])} documents")
+                continue
+            request_id, matches, skipped = reply
+            with self.lock:
+                future = self.pending.pop(request_id, None)
+            if future is not None:
+                future.set_result((matches, skipped))
+
+        # The worker died or was closed; nothing it was asked will be answered
+        with self.lock:
+            if self.conn is not conn:
+                return  # Already restarted, which failed the old queries
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(f"Search shard {self.index} exited"))
+
+    def submit(self, request_id: int, weighted_terms, names: List[str], deadline: Optional[float]) -> Future:
+        future: Future = Future()
+        with self.lock:
+            if not self.process.is_alive():
+                logger.warning(f"Search shard {self.index} exited; restarting it")
+                self.start()
+            self.pending[request_id] = future
+            self.conn.send((request_id, list(weighted_terms), names, deadline))
+        return future
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ShardPool:
+    """Keyword search over documents split across worker processes"""
+
+    def __init__(self, documents: Dict[str, str], num_shards: int, page_store: PageStore):
+        """
+        Args:
+            documents: {document name: PDF path}
+            num_shards: Worker processes (capped at the document count)
+            page_store: Store already holding the documents; a document missing from it is
+                never found by a shard
+        """
+        num_shards = max(1, min(num_shards, len(documents)))
+        # Largest files first, each to the currently lightest shard
+        assignments: List[Dict[str, str]] = [{} for _ in range(num_shards)]
+        loads = [0] * num_shards
+        for name, path in sorted(documents.items(), key=lambda item: -os.path.getsize(item[1])):
+            lightest = loads.index(min(loads))
+            assignments[lightest][name] = path
+            loads[lightest] += os.path.getsize(path)
+
+        # Spawned rather than forked: the web process runs threads (executors, the OpenAI loop)
+        context = multiprocessing.get_context('spawn')
+        self.shards = [Shard(i, docs, page_store.export(list(docs)), context)
+                       for i, docs in enumerate(assignments)]
+        self.owner = {name: shard for shard in self.shards for name in shard.documents}
+        self._request_ids = itertools.count()
+        logger.info(f"Started {num_shards} search shards for {len(documents)} documents")
+
+    @property
+    def ready(self) -> bool:
+        return all(shard.ready for shard in self.shards)
+
+    def search(self, weighted_terms: Sequence[Tuple[str, float]], names: List[str],
+               deadline: Optional[float] = None) -> Tuple[List[Dict], List[str]]:
+        """
+        Scan the named documents on their shards in parallel
+
+        Returns:
+            (results, skipped) with results in document order, the same as a local scan, and
+            skipped listing documents not (fully) searched by the deadline
+        """
+        by_shard: Dict[Shard, List[str]] = {}
+        for name in names:
+            shard = self.owner.get(name)
+            if shard is not None:
+                by_shard.setdefault(shard, []).append(name)
+
+        request_id = next(self._request_ids)
+        futures = {shard: shard.submit(request_id, weighted_terms, shard_names, deadline)
+                   for shard, shard_names in by_shard.items()}
+
+        matches: Dict[str, List[Dict]] = {}
+        skipped = []
+        for shard, future in futures.items():
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic()) + SHARD_DEADLINE_GRACE
+            try:
+                shard_matches, shard_skipped = future.result(timeout=timeout)
+            except FuturesTimeoutError:
+                # Still loading or busy: its documents miss this query, the reply is dropped
+                with shard.lock:
+                    shard.pending.pop(request_id, None)
+                skipped.extend(by_shard[shard])
+                continue
+            except Exception as e:
+                logger.error(f"Search shard {shard.index} failed: {e}")
+                skipped.extend(by_shard[shard])
+                continue
+            matches.update(shard_matches)
+            skipped.extend(shard_skipped)
+
+        results = [result for name in names for result in matches.get(name, [])]
+        skipped = set(skipped)
+        return results, [name for name in names if name in skipped]
+
+    def metrics(self) -> List[Dict]:
+        return [{
+            'shard': shard.index,
+            'documents': sorted(shard.documents),
+            'ready': shard.ready,
+            'alive': shard.process.is_alive(),
+            'pending': len(shard.pending),
+            'stored_bytes': shard.stored_bytes
+        } for shard in self.shards]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,180 @@
+"""
+Symmetric-delete (SymSpell) spelling dictionary built from the corpus vocabulary
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+
+# Unicode letters only, so French accents survive and numbers/part codes are skipped
+WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+@dataclass
+class Suggestion:
+    term: str
+    distance: int
+    count: int
+
+
+def tokenize(text: str, min_length: int = 1) -> List[str]:
+    """Split text into lowercase word tokens"""
+    return [w for w in WORD_RE.findall(text.lower()) if len(w) >= min_length]
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance, or max_distance + 1 once it is exceeded"""
+    if a == b:
+        return 0
+    over = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return over
+
+    # Shared prefixes and suffixes never contribute edits
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > max_distance:
+        return over
+    if not a or not b:
+        return max(len_a, len_b)
+
+    # Only cells within max_distance of the diagonal can stay under the bound
+    prev_prev: List[int] = []
+    prev = [j if j <= max_distance else over for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        current = [over] * (len_b + 1)
+        current[0] = i if i <= max_distance else over
+        row_min = current[0]
+        ca = a[i - 1]
+        for j in range(max(1, i - max_distance), min(len_b, i + max_distance) + 1):
+            cb = b[j - 1]
+            value = prev[j - 1] if ca == cb else prev[j - 1] + 1
+            if prev[j] + 1 < value:
+                value = prev[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb and prev_prev[j - 2] + 1 < value:
+                value = prev_prev[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return over
+        prev_prev, prev = prev, current
+    return prev[len_b] if prev[len_b] <= max_distance else over
+
+
+class SymSpellDictionary:
+    """Corpus word frequencies plus a precomputed delete index for fast fuzzy lookup"""
+
+    def __init__(self, max_edit_distance: int = 2, prefix_length: int = 7, min_word_length: int = 3):
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.min_word_length = min_word_length
+        self.words: Dict[str, int] = {}
+        self.deletes: Dict[str, List[str]] = {}
+        self._lookup_cache: Dict[tuple, List[Suggestion]] = {}
+        self.lookup_cache_size = 10000
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        return word.lower() in self.words
+
+    def _edits(self, word: str, distance: int, results: Set[str]) -> Set[str]:
+        """Collect all strings reachable from word by up to max_edit_distance deletions"""
+        distance += 1
+        if len(word) > 1:
+            for i in range(len(word)):
+                deleted = word[:i] + word[i + 1:]
+                if deleted not in results:
+                    results.add(deleted)
+                    if distance < self.max_edit_distance:
+                        self._edits(deleted, distance, results)
+        return results
+
+    def _deletes_for(self, word: str) -> Set[str]:
+        prefix = word[:self.prefix_length]
+        return self._edits(prefix, 0, {prefix})
+
+    def add_word(self, word: str, count: int = 1):
+        """Add a word occurrence, registering its deletes the first time it is seen"""
+        word = word.lower()
+        if len(word) < self.min_word_length:
+            return
+        self._lookup_cache.clear()
+        if word in self.words:
+            self.words[word] += count
+            return
+        self.words[word] = count
+        for deleted in self._deletes_for(word):
+            self.deletes.setdefault(deleted, []).append(word)
+
+    def add_text(self, text: str):
+        """Add every word in a block of text"""
+        for word in tokenize(text, self.min_word_length):
+            self.add_word(word)
+
+    def add_words(self, words: Iterable[str]):
+        """Add a collection of words, e.g. search-term mappings"""
+        for word in words:
+            self.add_word(word)
+
+    def lookup(self, term: str, max_edit_distance: Optional[int] = None) -> List[Suggestion]:
+        """Return dictionary words within the edit distance, closest and most frequent first"""
+        term = term.lower()
+        max_distance = self.max_edit_distance if max_edit_distance is None else min(max_edit_distance, self.max_edit_distance)
+
+        if term in self.words:
+            return [Suggestion(term, 0, self.words[term])]
+        if len(term) < self.min_word_length:
+            return []
+
+        # Misspellings repeat across users, so remember recent answers
+        key = (term, max_distance)
+        cached = self._lookup_cache.get(key)
+        if cached is not None:
+            return cached
+
+        suggestions: Dict[str, Suggestion] = {}
+        for deleted in self._deletes_for(term):
+            for word in self.deletes.get(deleted, ()):
+                if word in suggestions:
+                    continue
+                distance = edit_distance(term, word, max_distance)
+                if distance <= max_distance:
+                    suggestions[word] = Suggestion(word, distance, self.words[word])
+
+        result = sorted(suggestions.values(), key=lambda s: (s.distance, -s.count))
+        if len(self._lookup_cache) >= self.lookup_cache_size:
+            self._lookup_cache.clear()
+        self._lookup_cache[key] = result
+        return result
+
+    def correct(self, term: str, max_edit_distance: Optional[int] = None) -> Optional[str]:
+        """Best correction for a term, or None if nothing is close enough"""
+        suggestions = self.lookup(term, max_edit_distance)
+        return suggestions[0].term if suggestions else None
+
+    def expand(self, term: str, max_edit_distance: Optional[int] = None, limit: int = 5) -> List[str]:
+        """Fuzzy expansion: the closest dictionary words for a term"""
+        return [s.term for s in self.lookup(term, max_edit_distance)[:limit]]
+
+    def correct_phrase(self, phrase: str) -> str:
+        """Correct each unknown word of a phrase, keeping known words as typed"""
+        def _correct(match):
+            word = match.group(0)
+            if len(word) < self.min_word_length or word in self.words:
+                return word
+            return self.correct(word) or word
+
+        return WORD_RE.sub(_correct, phrase.lower())
@@ -0,0 +1,128 @@
+"""
+Prefix autocomplete over corpus terms and phrases
+
+Words and two-word phrases are counted by the number of pages they appear on (the unit
+keyword search ranks), stored in one sorted array of accent-folded keys, and completed by
+binary search. Top completions for one- and two-letter prefixes, whose ranges span much of
+the vocabulary, are computed once when the index is finalized.
+"""
+
+import heapq
+import unicodedata
+from bisect import bisect_left
+from typing import Container, Dict, List, Optional
+
+from spelling import tokenize
+
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'are', 'was', 'were', 'has', 'have', 'not', 'but',
+    'from', 'all', 'any', 'its', 'into', 'may', 'shall', 'which', 'such', 'these', 'those', 'been',
+    'than', 'when', 'where', 'will', 'each', 'other', 'also', 'only', 'their', 'there', 'les', 'des',
+    'http', 'https', 'www', 'com', 'org', 'mil', 'gov',  # Link fragments from document footers
+}
+MIN_PHRASE_PAGES = 2  # Phrases seen on a single page are mostly noise
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+
+def fold(text: str) -> str:
+    """Lowercase without accents, so "secu" completes "sécurité\""""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class SuggestionIndex:
+    """Sorted prefix array of weighted completions"""
+
+    def __init__(self, min_word_length: int = 3, limit: int = 8):
+        self.min_word_length = min_word_length
+        self.limit = limit
+        self.counts: Dict[str, int] = {}
+        self.kinds: Dict[str, str] = {}  # text -> term | phrase | french
+        self.notes: Dict[str, str] = {}  # French key -> its English translations
+        self.keys: List[str] = []
+        self.texts: List[str] = []
+        self.weights: List[int] = []
+        self.top: Dict[str, List[int]] = {}  # short prefix -> indexes of its best completions
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add_page(self, text: str):
+        """Count each word and adjacent word pair once for the page"""
+        words = tokenize(text, self.min_word_length)
+        seen = set()
+        for i, word in enumerate(words):
+            if word in STOPWORDS:
+                continue
+            seen.add((word, 'term'))
+            if i + 1 < len(words) and words[i + 1] not in STOPWORDS:
+                seen.add((f"{word} {words[i + 1]}", 'phrase'))
+        for text, kind in seen:
+            self.counts[text] = self.counts.get(text, 0) + 1
+            self.kinds.setdefault(text, kind)
+
+    def add_document(self, doc_data, skip_pages: Container[int] = ()):
+        """Count the terms of every page of a documents.DocumentData, except copies of pages already counted"""
+        for section in doc_data.sections:
+            if section.page not in skip_pages:
+                self.add_page(section.content)
+
+    def add_term(self, text: str, weight: int, kind: str, note: Optional[str] = None):
+        """Add a completion that need not occur in the corpus, e.g. a French query key"""
+        self.counts[text] = max(self.counts.get(text, 0), weight)
+        self.kinds.setdefault(text, kind)
+        if note:
+            self.notes[text] = note
+
+    def finalize(self):
+        """Build the sorted arrays; called once after indexing (and again if terms are added)"""
+        entries = sorted(
+            (fold(text), text, count) for text, count in self.counts.items()
+            if self.kinds[text] != 'phrase' or count >= MIN_PHRASE_PAGES)
+        self.keys = [key for key, _, _ in entries]
+        self.texts = [text for _, text, _ in entries]
+        self.weights = [count for _, _, count in entries]
+
+        self.top = {}
+        prefixes: Dict[str, List[int]] = {}
+        for i, key in enumerate(self.keys):
+            for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 1):
+                if len(key) >= length:
+                    prefixes.setdefault(key[:length], []).append(i)
+        for prefix, indexes in prefixes.items():
+            self.top[prefix] = heapq.nlargest(self.limit, indexes, key=self.weights.__getitem__)
+
+    def _complete(self, prefix: str, limit: int) -> List[int]:
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH and limit <= self.limit:
+            return self.top.get(prefix, [])[:limit]
+        start = bisect_left(self.keys, prefix)
+        # Every key beginning with prefix sorts before prefix + the highest code point
+        end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+        return heapq.nlargest(limit, range(start, end), key=self.weights.__getitem__)
+
+    def suggest(self, query: str, limit: Optional[int] = None) -> List[Dict]:
+        """
+        Best completions of query, most frequent first
+
+        The whole query is the prefix, so "hazard an" completes to phrases like "hazard
+        analysis". Keyword search matches the query as one phrase, so only words and phrases
+        that occur in the corpus (or French keys it translates) are offered.
+        """
+        limit = limit or self.limit
+        if self.counts and not self.keys:
+            self.finalize()
+        prefix = ' '.join(fold(query).split())
+        if not prefix:
+            return []
+
+        suggestions = []
+        for i in self._complete(prefix, limit):
+            text = self.texts[i]
+            suggestion = {'text': text, 'count': self.weights[i], 'kind': self.kinds[text]}
+            if text in self.notes:
+                suggestion['translations'] = self.notes[text]
+            suggestions.append(suggestion)
+        return suggestions
+
+    def metrics(self) -> Dict[str, int]:
+        return {'completions': len(self.keys), 'precomputed_prefixes': len(self.top)}
@@ -0,0 +1,348 @@
+"""
+Compact storage and search for chunk embeddings
+
+Embeddings are L2-normalized and kept as rows of one float16 or int8 matrix (int8 with a
+float32 scale per row) instead of Python lists, which cost about 32 bytes per float.
+A search scans the compact matrix for candidates and rescores only those against the
+float32 vectors. The float32 copies are appended to a spill file and memory-mapped, so they
+stay out of resident memory until a candidate row is read.
+
+Run `python app/vector_store.py --help` for the memory/recall evaluation.
+"""
+
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ann_index import brute_force_search, normalize, synthetic_embeddings
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+
+def python_list_bytes(n: int, dim: int) -> int:
+    """Memory taken by n embeddings stored as lists of Python floats"""
+    return n * (sys.getsizeof([0.0] * dim) + dim * sys.getsizeof(0.0))
+
+
+class VectorStore:
+    """Keyed embedding matrix with quantized candidate search and exact rescoring"""
+
+    def __init__(self, precision: str = 'int8', spill: bool = True, spill_dir: Optional[str] = None,
+                 rescore_factor: int = 4, block_rows: int = 256):
+        """
+        Args:
+            precision: Storage for the scanned matrix: "float32", "float16" or "int8"
+            spill: Keep the float32 copies used for rescoring in a memory-mapped temporary
+                file rather than in memory (ignored for float32, which needs no copy)
+            spill_dir: Directory for the spill file (default: the system temp directory)
+            rescore_factor: Candidates fetched per requested result before exact rescoring
+            block_rows: Rows dequantized at a time while scanning (small blocks stay in cache)
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown embedding precision {precision!r}; expected one of {PRECISIONS}")
+        self.precision = precision
+        self.rescore_factor = max(1, rescore_factor)
+        self.block_rows = block_rows
+        self.lock = threading.Lock()
+
+        self.dim: Optional[int] = None
+        self.count = 0  # rows written, including replaced/removed ones
+        self.row_keys: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.live: Optional[np.ndarray] = None
+
+        self.spill = spill and precision != 'float32'
+        self.spill_dir = spill_dir
+        self._spill_file = tempfile.TemporaryFile(prefix='embeddings-', suffix='.f32', dir=spill_dir) if self.spill else None
+        self._spill_map: Optional[np.ndarray] = None
+        self._full: Optional[np.ndarray] = None  # float32 rows when not spilling
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def keys(self) -> List[str]:
+        return list(self.rows)
+
+    def _allocate(self, capacity: int):
+        code_dtype = np.int8 if self.precision == 'int8' else np.dtype(self.precision)
+        codes = np.zeros((capacity, self.dim), dtype=code_dtype)
+        live = np.zeros(capacity, dtype=bool)
+        scales = np.ones(capacity, dtype=np.float32) if self.precision == 'int8' else None
+        full = np.zeros((capacity, self.dim), dtype=np.float32) if not self.spill and self.precision != 'float32' else None
+        if self.codes is not None:
+            codes[:self.count] = self.codes[:self.count]
+            live[:self.count] = self.live[:self.count]
+            if scales is not None:
+                scales[:self.count] = self.scales[:self.count]
+            if full is not None:
+                full[:self.count] = self._full[:self.count]
+        # Readers hold references to the old arrays, so they are replaced rather than resized in place
+        self.codes, self.live, self.scales, self._full = codes, live, scales, full
+
+    def _encode(self, vectors: np.ndarray, rows: slice):
+        if self.precision == 'int8':
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.codes[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[rows] = scales
+        else:
+            self.codes[rows] = vectors.astype(self.codes.dtype)
+
+    def add(self, keys: Sequence[str], vectors) -> int:
+        """Store vectors under keys, replacing any earlier vectors for the same keys"""
+        if not len(keys):
+            return 0
+        vectors = normalize(np.atleast_2d(vectors))
+        if len(vectors) != len(keys):
+            raise ValueError(f"Got {len(keys)} keys for {len(vectors)} vectors")
+
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}")
+
+            end = self.count + len(vectors)
+            capacity = 0 if self.codes is None else len(self.codes)
+            if end > capacity:
+                self._allocate(max(end, 2 * capacity, 64))
+
+            rows = slice(self.count, end)
+            self._encode(vectors, rows)
+            if self.spill:
+                self._spill_file.seek(0, 2)
+                self._spill_file.write(vectors.tobytes())
+                self._spill_file.flush()
+                self._spill_map = None
+            elif self._full is not None:
+                self._full[rows] = vectors
+
+            for row, key in enumerate(keys, start=self.count):
+                previous = self.rows.get(key)
+                if previous is not None:
+                    self.live[previous] = False
+                    self.row_keys[previous] = None
+                self.rows[key] = row
+                self.row_keys.append(key)
+            self.live[rows] = True
+            self.count = end
+            self._maybe_compact()
+        return len(keys)
+
+    def remove(self, keys: Sequence[str]) -> int:
+        """Drop vectors by key; returns how many were stored"""
+        removed = 0
+        with self.lock:
+            for key in keys:
+                row = self.rows.pop(key, None)
+                if row is not None:
+                    self.live[row] = False
+                    self.row_keys[row] = None
+                    removed += 1
+            self._maybe_compact()
+        return removed
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.row_keys, self.rows = [], {}
+            self.codes = self.scales = self.live = self._full = self._spill_map = None
+            self.dim = None
+            if self.spill:
+                self._spill_file.seek(0)
+                self._spill_file.truncate()
+
+    def _maybe_compact(self):
+        """Rewrite storage without dead rows once they make up more than half of it"""
+        dead = self.count - len(self.rows)
+        if dead < 1024 or dead * 2 < self.count:
+            return
+        keep = np.flatnonzero(self.live[:self.count])
+        full = self._full_rows(keep)
+        codes = self.codes[keep]
+        scales = self.scales[keep] if self.scales is not None else None
+        keys = [self.row_keys[row] for row in keep]
+
+        self.codes = self.scales = self.live = self._full = None
+        self.count = len(keep)
+        self._allocate(max(self.count, 64))
+        self.codes[:self.count] = codes
+        if scales is not None:
+            self.scales[:self.count] = scales
+        if self._full is not None:
+            self._full[:self.count] = full
+        self.live[:self.count] = True
+        self.row_keys = keys
+        self.rows = {key: row for row, key in enumerate(keys)}
+        if self.spill:
+            spill_file = tempfile.TemporaryFile(prefix='embeddings-', suffix='.f32', dir=self.spill_dir)
+            spill_file.write(full.tobytes())
+            spill_file.flush()
+            self._spill_file, self._spill_map = spill_file, None
+        logger.info(f"Compacted embedding store to {self.count} vectors")
+
+    def _full_rows(self, rows: np.ndarray) -> np.ndarray:
+        """float32 vectors for the given rows (read from the spill file when spilling)"""
+        if self.precision == 'float32':
+            return self.codes[rows]
+        if not self.spill:
+            return self._full[rows]
+        if self._spill_map is None or len(self._spill_map) < self.count:
+            self._spill_map = np.memmap(self._spill_file, dtype=np.float32, mode='r', shape=(self.count, self.dim))
+        return np.asarray(self._spill_map[rows])
+
+    def vectors(self, keys: Sequence[str]) -> np.ndarray:
+        """Full-precision (normalized) vectors for keys, which must all be stored"""
+        with self.lock:
+            rows = np.array([self.rows[key] for key in keys], dtype=np.int64)
+            if self.dim is None:
+                return np.zeros((0, 0), dtype=np.float32)
+            return self._full_rows(rows)
+
+    def similarities(self, keys: Sequence[str], query) -> np.ndarray:
+        """Exact cosine similarity of query to each stored key"""
+        return self.vectors(keys) @ normalize(query).reshape(-1)
+
+    def _scan(self, query: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray], count: int) -> np.ndarray:
+        """Approximate scores against the compact matrix, dequantizing a block at a time"""
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, self.block_rows):
+            end = min(count, start + self.block_rows)
+            block = codes[start:end]
+            scores[start:end] = (block if block.dtype == np.float32 else block.astype(np.float32)) @ query
+        if scales is not None:
+            scores *= scales[:count]
+        return scores
+
+    def search(self, query, top_k: int = 10, rescore: bool = True,
+               allowed: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, float]]:
+        """
+        Top keys by cosine similarity to query
+
+        Candidates come from the compact matrix; with rescore, top_k * rescore_factor of them
+        are rescored against float32 vectors and re-ranked. With allowed, only keys it accepts
+        are candidates.
+        """
+        with self.lock:
+            if not self.rows:
+                return []
+            count, codes, scales, live = self.count, self.codes, self.scales, self.live
+            row_keys = self.row_keys
+        query = normalize(query).reshape(-1)
+        if len(query) != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dimensional query, got {len(query)}")
+
+        scores = self._scan(query, codes, scales, count)
+        valid = live[:count].copy()
+        if allowed is not None:
+            valid &= np.fromiter((key is not None and allowed(key) for key in row_keys[:count]),
+                                 dtype=bool, count=count)
+        scores[~valid] = -np.inf
+        exact = self.precision == 'float32' or not rescore
+        n_candidates = min(int(valid.sum()), top_k if exact else top_k * self.rescore_factor)
+        if not n_candidates:
+            return []
+        rows = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+
+        if not exact:
+            with self.lock:
+                moved = self.row_keys is not row_keys
+                if not moved:
+                    scores = self._full_rows(rows) @ query
+            if moved:
+                return self.search(query, top_k, rescore, allowed)  # Compacted mid-search; rows were renumbered
+        else:
+            scores = scores[rows]
+
+        order = np.argsort(-scores)[:top_k]
+        return [(row_keys[rows[i]], float(scores[i])) for i in order if row_keys[rows[i]] is not None]
+
+    def memory_bytes(self) -> int:
+        """Resident size of the stored vectors (the spill file is not counted)"""
+        arrays = [self.codes, self.scales, self.live, self._full]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def metrics(self) -> Dict[str, object]:
+        return {
+            'precision': self.precision,
+            'vectors': len(self.rows),
+            'dim': self.dim,
+            'memory_bytes': self.memory_bytes(),
+            'spill_bytes': self.count * (self.dim or 0) * 4 if self.spill else 0,
+            'python_list_bytes': python_list_bytes(len(self.rows), self.dim or 0)
+        }
+
+
+def evaluate(vectors: np.ndarray, queries: np.ndarray, top_k: int = 10,
+             precisions: Sequence[str] = PRECISIONS, rescore_factor: int = 4) -> List[Dict[str, float]]:
+    """Memory, recall@top_k (with and without rescoring) and latency per storage precision"""
+    vectors = normalize(vectors)
+    truth = [set(brute_force_search(vectors, q, top_k).tolist()) for q in queries]
+    keys = [str(i) for i in range(len(vectors))]
+    list_bytes = python_list_bytes(len(vectors), vectors.shape[1])
+
+    report = []
+    for precision in precisions:
+        store = VectorStore(precision, rescore_factor=rescore_factor)
+        store.add(keys, vectors)
+        row = {'precision': precision, 'memory_bytes': store.memory_bytes(),
+               'vs_lists': list_bytes / store.memory_bytes()}
+        for rescore in (False, True):
+            if rescore and precision == 'float32':
+                row['recall_rescored'], row['ms_rescored'] = row['recall'], row['ms']
+                continue
+            hits = 0
+            started = time.perf_counter()
+            for expected, query in zip(truth, queries):
+                found = store.search(query, top_k, rescore=rescore)
+                hits += len(expected & {int(key) for key, _ in found})
+            elapsed = (time.perf_counter() - started) * 1000 / len(queries)
+            suffix = '_rescored' if rescore else ''
+            row['recall' + suffix] = hits / (len(queries) * top_k)
+            row['ms' + suffix] = elapsed
+        report.append(row)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and recall of quantized embedding storage")
+    parser.add_argument('--embeddings', help=".npy matrix of embeddings (default: synthetic data)")
+    parser.add_argument('--n', type=int, default=50000, help="Synthetic vector count")
+    parser.add_argument('--dim', type=int, default=1536, help="Synthetic vector dimension")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--rescore-factor', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
+    vectors = np.load(args.embeddings) if args.embeddings else synthetic_embeddings(args.n, args.dim)
+
+    rng = np.random.default_rng(1)
+    # Perturbed corpus vectors stand in for queries that are close to, but not in, the corpus
+    picks = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    queries = normalize(vectors[picks] + 0.3 * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32))
+
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}; "
+          f"as Python lists {python_list_bytes(*vectors.shape) / 1024 / 1024:.1f} MB")
+    print(f"{'precision':>9} {'MB':>8} {'vs lists':>9} {'recall@' + str(args.top_k):>10} "
+          f"{'rescored':>9} {'ms':>7} {'ms resc.':>9}")
+    for row in evaluate(vectors, queries, args.top_k, rescore_factor=args.rescore_factor):
+        print(f"{row['precision']:>9} {row['memory_bytes'] / 1024 / 1024:>8.1f} {row['vs_lists']:>8.1f}x "
+              f"{row['recall']:>10.3f} {row['recall_rescored']:>9.3f} {row['ms']:>7.2f} {row['ms_rescored']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
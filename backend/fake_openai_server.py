@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Minimal OpenAI-compatible server for exercising the LLM features locally
+
+Serves /v1/chat/completions (plain and streamed) and /v1/embeddings with canned,
+deterministic output, so the backend can be run without an API key or network:
+
+    python fake_openai_server.py --port 8089
+    OPENAI_BASE_URL=http://localhost:8089/v1 OPENAI_API_KEY=test python app/main.py
+"""
+
+import json
+import time
+import random
+import hashlib
+import argparse
+
+from flask import Flask, Response, request, jsonify
+
+app = Flask(__name__)
+settings = {'token_delay': 0.02, 'embedding_dim': 1536, 'fail_rate': 0.0}
+
+ANSWER = ("According to the provided context, the requirement is stated on Page 1. "
+          "This is a canned answer from the fake completion server.")
+
+
+def answer_tokens(messages):
+    """Split the canned answer into word-sized stream deltas"""
+    words = ANSWER.split(' ')
+    return [word if i == 0 else ' ' + word for i, word in enumerate(words)]
+
+
+def usage_for(messages, completion_tokens):
+    prompt_tokens = sum(len(m.get('content', '').split()) for m in messages)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens
+    }
+
+
+@app.before_request
+def maybe_rate_limit():
+    """Reject a share of requests with 429 to exercise client retries"""
+    if settings['fail_rate'] and random.random() < settings['fail_rate']:
+        response = jsonify({'error': {'message': 'Rate limit reached (fake)', 'type': 'requests', 'code': 'rate_limit_exceeded'}})
+        response.status_code = 429
+        response.headers['Retry-After'] = '0.1'
+        return response
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    body = request.json
+    messages = body.get('messages', [])
+    model = body.get('model', 'fake-model')
+    tokens = answer_tokens(messages)
+    created = int(time.time())
+
+    if not body.get('stream'):
+        return jsonify({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': created,
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                'finish_reason': 'stop'
+            }],
+            'usage': usage_for(messages, len(tokens))
+        })
+
+    include_usage = (body.get('stream_options') or {}).get('include_usage', False)
+
+    def generate():
+        for i, token in enumerate(tokens):
+            time.sleep(settings['token_delay'])
+            chunk = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'role': 'assistant', 'content': token} if i == 0 else {'content': token},
+                    'finish_reason': None
+                }]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        final = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        yield f"data: {json.dumps(final)}\n\n"
+        if include_usage:
+            usage = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                     'choices': [], 'usage': usage_for(messages, len(tokens))}
+            yield f"data: {json.dumps(usage)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype='text/event-stream')
+
+
+@app.route('/v1/embeddings', methods=['POST'])
+def embeddings():
+    body = request.json
+    inputs = body.get('input', [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+
+    data = []
+    for i, text in enumerate(inputs):
+        # Deterministic pseudo-embedding derived from the text hash
+        seed = hashlib.sha256(str(text).encode('utf-8')).digest()
+        vector = [(seed[j % len(seed)] - 127.5) / 127.5 for j in range(settings['embedding_dim'])]
+        data.append({'object': 'embedding', 'index': i, 'embedding': vector})
+
+    return jsonify({
+        'object': 'list',
+        'data': data,
+        'model': body.get('model', 'fake-embedding'),
+        'usage': {'prompt_tokens': 0, 'total_tokens': 0}
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake OpenAI API for local testing")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--token-delay', type=float, default=0.02, help="Seconds between streamed tokens")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+    settings['token_delay'] = args.token_delay
+    settings['fail_rate'] = args.fail_rate
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
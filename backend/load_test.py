@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Load generator for the search API: replays a query mix at a set concurrency or arrival rate
+
+Reports throughput, latency percentiles, error rate and server RSS (sampled from /api/health)
+over the run, and can fail on thresholds so it doubles as a pre-deploy regression check:
+
+    python load_test.py --url http://localhost:8080 --duration 60 --concurrency 16
+    python load_test.py --rate 20 --mix search=70,suggest=20,hybrid=10 --queries queries.txt
+    python load_test.py --queries server.log --max-p95-ms 500 --max-error-rate 0.01 --json report.json
+
+--queries takes a text file (one query per line), a JSON Lines file of
+{"endpoint": ..., "query": ..., "documents": [...]} records, or a backend log, whose
+"Search request: '...'" lines are replayed. Without it a built-in mix of English, French
+and misspelled queries is used. The measurements endpoint only answers queries holding a
+value or range with a unit, so it draws from its own pool: the records marked
+"endpoint": "measurements" in --queries, else a built-in set of ranges.
+
+With --rate, requests arrive on a Poisson schedule whether or not earlier ones have finished,
+and latency is measured from the scheduled start, so a stalled server shows up as latency
+rather than as a quietly lower request rate. Without --rate each worker sends its next
+request as soon as the previous one returns.
+"""
+
+import re
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+DEFAULT_QUERIES = [
+    "accidental activation", "safety", "design", "human factors", "emergency", "noise",
+    "hazard analysis", "risk assessment", "head clearance", "impulse noise", "hearing protection",
+    "noise limits above 100 dB", "85 dBA", "système", "bruit", "ergonomie", "sécurité",
+    "poste de travail", "hazzard", "saftey", "anthropometry", "warning signal", "display",
+]
+# Each is accepted by the backend's measurements.parse_range
+DEFAULT_MEASUREMENT_QUERIES = [
+    "noise limits above 100 dB", "85 dBA", "1.5..2 m", "between 80 and 90 dB", "at most 6 in",
+    "impulse noise 140 to 170 dB", "steady-state noise below 85 dBA", "head clearance at least 1.9 m",
+]
+DEFAULT_MIX = "search=80,suggest=15,hybrid=5"
+ENDPOINTS = ('search', 'suggest', 'hybrid', 'stream', 'measurements')
+LOG_QUERY_RE = re.compile(r"Search request: '(.*)' in ")
+
+
+def load_workload(path: Optional[str]) -> List[Dict]:
+    """Queries to replay: [{query, documents, endpoint (optional)}]"""
+    if path is None:
+        return [{'query': q, 'documents': []} for q in DEFAULT_QUERIES]
+    workload = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                workload.append({'query': record['query'], 'documents': record.get('documents', []),
+                                 'endpoint': record.get('endpoint')})
+                continue
+            match = LOG_QUERY_RE.search(line)
+            if match:
+                workload.append({'query': match.group(1), 'documents': []})
+            elif 'INFO:' not in line and 'WARNING:' not in line and 'ERROR:' not in line:
+                workload.append({'query': line, 'documents': []})
+    if not workload:
+        raise SystemExit(f"No queries found in {path}")
+    return workload
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}' in --mix (choose from {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.url = args.url.rstrip('/')
+        self.timeout = args.timeout
+        self.deadline_ms = args.deadline_ms
+        self.workload = load_workload(args.queries)
+        self.measurement_workload = [item for item in self.workload if item.get('endpoint') == 'measurements'] or \
+            [{'query': q, 'documents': []} for q in DEFAULT_MEASUREMENT_QUERIES]
+        self.mix = parse_mix(args.mix)
+        self.random = random.Random(args.seed)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.samples: List[Dict] = []
+        self.health: List[Dict] = []
+        self.started = 0.0
+        self.elapsed = 0.0
+        self.stop = threading.Event()
+
+    def session(self) -> requests.Session:
+        # One keep-alive connection per worker thread, like a browser tab
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def pick(self) -> Dict:
+        with self.lock:
+            item = self.random.choice(self.workload)
+            endpoint = item.get('endpoint') or self.random.choices(
+                list(self.mix), weights=list(self.mix.values()))[0]
+            if endpoint == 'measurements' and not item.get('endpoint'):
+                # General queries mostly hold no range and would only measure 400 responses
+                item = self.random.choice(self.measurement_workload)
+            prefix_length = self.random.randint(2, max(2, len(item['query'])))
+        return dict(item, endpoint=endpoint, prefix=item['query'][:prefix_length])
+
+    def send(self, item: Dict) -> Dict:
+        """Issue one request; returns status, bytes and, for streams, time to first token"""
+        session = self.session()
+        endpoint = item['endpoint']
+        headers = {'X-Search-Deadline-Ms': str(self.deadline_ms)} if self.deadline_ms else {}
+        result = {'ttfb': None, 'partial': False}
+        if endpoint == 'search':
+            response = session.get(f"{self.url}/api/search", headers=headers, timeout=self.timeout,
+                                   params={'query': item['query'], 'documents': item['documents']})
+            result['partial'] = response.ok and response.json().get('partial', False)
+        elif endpoint == 'suggest':
+            response = session.get(f"{self.url}/api/suggest", params={'q': item['prefix']}, timeout=self.timeout)
+        elif endpoint == 'measurements':
+            response = session.get(f"{self.url}/api/measurements", params={'q': item['query']}, timeout=self.timeout)
+        elif endpoint == 'hybrid':
+            response = session.post(f"{self.url}/api/search/hybrid", timeout=self.timeout,
+                                    json={'query': item['query'], 'documents': item['documents']})
+            result['partial'] = response.ok and response.json().get('partial', False)
+        else:
+            sent = time.perf_counter()
+            response = session.post(f"{self.url}/api/llm/chat/stream", stream=True, timeout=self.timeout,
+                                    json={'query': item['query'], 'documents': item['documents']})
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event: token') and result['ttfb'] is None:
+                    result['ttfb'] = time.perf_counter() - sent
+                elif line.startswith('event: error'):
+                    result['error'] = 'stream error event'
+            response.close()
+        result['status'] = response.status_code
+        result['bytes'] = len(response.content) if endpoint != 'stream' else 0
+        return result
+
+    def run_one(self, scheduled: float):
+        item = self.pick()
+        try:
+            result = self.send(item)
+            error = result.pop('error', None) or (None if result['status'] < 400 else f"HTTP {result['status']}")
+        except Exception as e:
+            result = {'status': None, 'bytes': 0, 'ttfb': None, 'partial': False}
+            error = type(e).__name__
+        finished = time.perf_counter()
+        with self.lock:
+            self.samples.append(dict(result, endpoint=item['endpoint'], start=scheduled - self.started,
+                                     latency=finished - scheduled, error=error))
+
+    def poll_health(self, interval: float):
+        session = requests.Session()
+        while not self.stop.is_set():
+            try:
+                health = session.get(f"{self.url}/api/health", timeout=self.timeout).json()
+                self.health.append({'t': time.perf_counter() - self.started, 'memory_mb': health.get('memory_mb')})
+            except Exception as e:
+                self.health.append({'t': time.perf_counter() - self.started, 'memory_mb': None, 'error': str(e)})
+            self.stop.wait(interval)
+
+    def run(self, duration: float, concurrency: int, rate: float, max_requests: Optional[int],
+            health_interval: float):
+        self.started = time.perf_counter()
+        poller = threading.Thread(target=self.poll_health, args=(health_interval,), daemon=True)
+        poller.start()
+        end = self.started + duration
+        issued = 0
+
+        if rate > 0:
+            # Open loop: arrivals follow the schedule even when the server falls behind
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                scheduled = self.started
+                while scheduled < end and (max_requests is None or issued < max_requests):
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(self.run_one, scheduled)
+                    issued += 1
+                    scheduled += self.random.expovariate(rate)
+        else:
+            # Closed loop: each worker sends its next request when the last one returns
+            counter = iter(range(max_requests)) if max_requests else None
+
+            def worker():
+                while time.perf_counter() < end:
+                    if counter is not None and next(counter, None) is None:
+                        return
+                    self.run_one(time.perf_counter())
+
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.elapsed = time.perf_counter() - self.started
+        self.stop.set()
+        poller.join(timeout=self.timeout)
+
+    def summary(self, warmup: float = 0.0) -> Dict:
+        samples = [s for s in self.samples if s['start'] >= warmup]
+        measured = max(self.elapsed - warmup, 1e-9)
+        by_endpoint = defaultdict(list)
+        for sample in samples:
+            by_endpoint[sample['endpoint']].append(sample)
+        by_endpoint['all'] = samples
+
+        endpoints = {}
+        for name, group in by_endpoint.items():
+            latencies = [s['latency'] * 1000 for s in group]
+            errors = [s for s in group if s['error']]
+            ttfbs = [s['ttfb'] * 1000 for s in group if s['ttfb'] is not None]
+            endpoints[name] = {
+                'requests': len(group),
+                'throughput_rps': len(group) / measured,
+                'error_rate': len(errors) / len(group) if group else 0.0,
+                'errors': dict(sorted(_count(s['error'] for s in errors).items())),
+                'partial_rate': sum(1 for s in group if s['partial']) / len(group) if group else 0.0,
+                'latency_ms': {p: percentile(latencies, float(p[1:])) for p in ('p50', 'p90', 'p95', 'p99')},
+                'max_ms': max(latencies) if latencies else None,
+                'first_token_ms': {'p50': percentile(ttfbs, 50), 'p95': percentile(ttfbs, 95)} if ttfbs else None,
+            }
+
+        # Per-second timeline: completed requests, p95 and the nearest RSS sample
+        timeline = []
+        for second in range(int(self.elapsed) + 1):
+            window = [s for s in self.samples if second <= s['start'] + s['latency'] < second + 1]
+            rss = [h['memory_mb'] for h in self.health if second <= h['t'] < second + 1 and h['memory_mb']]
+            timeline.append({'t': second, 'completed': len(window),
+                             'p95_ms': percentile([s['latency'] * 1000 for s in window], 95),
+                             'rss_mb': rss[-1] if rss else None})
+
+        memory = [h['memory_mb'] for h in self.health if h['memory_mb']]
+        return {
+            'url': self.url,
+            'elapsed_s': self.elapsed,
+            'warmup_s': warmup,
+            'endpoints': endpoints,
+            'rss_mb': {'start': memory[0], 'max': max(memory), 'end': memory[-1]} if memory else None,
+            'timeline': timeline,
+        }
+
+
+def _count(items) -> Dict[str, int]:
+    counts: Dict[str, int] = defaultdict(int)
+    for item in items:
+        counts[item] += 1
+    return counts
+
+
+def _ms(value: Optional[float]) -> str:
+    return '-' if value is None else f"{value:.1f}"
+
+
+def print_report(summary: Dict):
+    print(f"\n{summary['url']}: {summary['elapsed_s']:.1f}s (first {summary['warmup_s']:.0f}s excluded)\n")
+    print(f"{'endpoint':<14}{'requests':>9}{'req/s':>9}{'errors':>9}{'partial':>9}"
+          f"{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, stats in sorted(summary['endpoints'].items(), key=lambda item: item[0] == 'all'):
+        latency = stats['latency_ms']
+        print(f"{name:<14}{stats['requests']:>9}{stats['throughput_rps']:>9.1f}{stats['error_rate']:>9.1%}"
+              f"{stats['partial_rate']:>9.1%}{_ms(latency['p50']):>9}{_ms(latency['p90']):>9}"
+              f"{_ms(latency['p95']):>9}{_ms(latency['p99']):>9}{_ms(stats['max_ms']):>9}")
+        if stats['errors']:
+            print(f"{'':<14}errors: {stats['errors']}")
+        if stats['first_token_ms']:
+            print(f"{'':<14}first token p50 {_ms(stats['first_token_ms']['p50'])} ms, "
+                  f"p95 {_ms(stats['first_token_ms']['p95'])} ms")
+
+    if summary['rss_mb']:
+        rss = summary['rss_mb']
+        print(f"\nServer RSS: {rss['start']:.0f} MB at start, {rss['max']:.0f} MB peak, {rss['end']:.0f} MB at end")
+    print(f"\n{'t (s)':>6}{'done':>7}{'p95 ms':>9}{'RSS MB':>9}")
+    for row in summary['timeline']:
+        print(f"{row['t']:>6}{row['completed']:>7}{_ms(row['p95_ms']):>9}"
+              f"{'-' if row['rss_mb'] is None else format(row['rss_mb'], '.0f'):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a query mix against the search API under load")
+    parser.add_argument('--url', default='http://localhost:8080', help="Backend base URL")
+    parser.add_argument('--queries', help="Text, JSON Lines or backend log file to replay (default: built-in mix)")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Endpoint weights, from {', '.join(ENDPOINTS)}")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds to run")
+    parser.add_argument('--requests', type=int, help="Stop after this many requests")
+    parser.add_argument('--concurrency', type=int, default=8, help="Workers (max requests in flight)")
+    parser.add_argument('--rate', type=float, default=0.0, help="Arrivals per second (0 = closed loop)")
+    parser.add_argument('--warmup', type=float, default=0.0, help="Seconds excluded from the statistics")
+    parser.add_argument('--deadline-ms', type=int, help="X-Search-Deadline-Ms sent with searches")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument('--health-interval', type=float, default=1.0, help="Seconds between /api/health samples")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the query and endpoint choice")
+    parser.add_argument('--json', help="Also write the full summary to this file")
+    parser.add_argument('--max-p95-ms', type=float, help="Exit 1 if overall p95 latency exceeds this")
+    parser.add_argument('--max-error-rate', type=float, help="Exit 1 if the overall error rate exceeds this")
+    args = parser.parse_args()
+
+    test = LoadTest(args)
+    test.run(args.duration, args.concurrency, args.rate, args.requests, args.health_interval)
+    summary = test.summary(args.warmup)
+    print_report(summary)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+    overall = summary['endpoints'].get('all', {})
+    failures = []
+    p95 = overall.get('latency_ms', {}).get('p95')
+    if args.max_p95_ms is not None and (p95 is None or p95 > args.max_p95_ms):
+        failures.append(f"p95 {_ms(p95)} ms > {args.max_p95_ms} ms")
+    if args.max_error_rate is not None and overall.get('error_rate', 1.0) > args.max_error_rate:
+        failures.append(f"error rate {overall.get('error_rate', 1.0):.2%} > {args.max_error_rate:.2%}")
+    if failures:
+        print(f"\nFAILED: {'; '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
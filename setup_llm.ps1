@@ -23,8 +23,8 @@ try {
     Write-Host "   Installing tiktoken for token counting..." -ForegroundColor Gray  
     pip install tiktoken>=0.5.0
     
-    Write-Host "   Installing scikit-learn for similarity calculations..." -ForegroundColor Gray
-    pip install scikit-learn>=1.3.0
+    Write-Host "   Installing numpy for embeddings and similarity search..." -ForegroundColor Gray
+    pip install numpy>=1.24.0
     
     Write-Host "✅ All LLM dependencies installed successfully!" -ForegroundColor Green
     
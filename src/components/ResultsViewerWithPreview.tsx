@@ -153,6 +153,15 @@ const ResultsViewer: React.FC<ResultsViewerProps> = ({ results, searchQuery }) =
                   <p className="result-matched-term">
                     {t('results.matchedTerm', { term: result.matched_term })}
                   </p>
+                  {result.also_in && result.also_in.length > 0 && (
+                    <p className="result-also-in">
+                      {t('results.alsoIn', {
+                        pages: result.also_in
+                          .map(copy => `${copy.document} (${t('results.page', { number: copy.page })})`)
+                          .join(', ')
+                      })}
+                    </p>
+                  )}
                 </div>
 
                 <div className="result-actions">
@@ -1,5 +1,8 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { useTranslation } from 'react-i18next';
+import { documentsApi, Suggestion } from '../services/api';
+
+const SUGGEST_DELAY_MS = 150;
 
 interface SearchPanelProps {
   onSearch: (query: string, language: string) => void;
@@ -10,6 +13,26 @@ interface SearchPanelProps {
 const SearchPanel: React.FC<SearchPanelProps> = ({ onSearch, onClear, isLoading }) => {
   const { t, i18n } = useTranslation();
   const [query, setQuery] = useState('');
+  const [suggestions, setSuggestions] = useState<Suggestion[]>([]);
+
+  // Ask for completions once typing pauses; a stale reply is dropped when the query moves on
+  useEffect(() => {
+    const prefix = query.trim();
+    if (prefix.length < 2) {
+      setSuggestions([]);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      documentsApi.suggest(prefix)
+        .then((items) => { if (!cancelled) setSuggestions(items); })
+        .catch(() => { if (!cancelled) setSuggestions([]); });
+    }, SUGGEST_DELAY_MS);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [query]);
 
   const handleSubmit = (e: React.FormEvent) => {
     e.preventDefault();
@@ -35,7 +58,16 @@ const SearchPanel: React.FC<SearchPanelProps> = ({ onSearch, onClear, isLoading
             placeholder={t('search.placeholder')}
             className="search-input"
             disabled={isLoading}
-          />          <div className="search-buttons">
+            list="search-suggestions"
+            autoComplete="off"
+          />
+          <datalist id="search-suggestions">
+            {suggestions.map((s) => (
+              <option key={s.text} value={s.text}>
+                {s.translations ? `${s.translations} · ${s.count}` : s.count}
+              </option>
+            ))}
+          </datalist>          <div className="search-buttons">
             <button
               type="submit"
               disabled={isLoading || !query.trim()}
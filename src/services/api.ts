@@ -44,6 +44,7 @@ export interface Document {
   filename: string;
   title: string;
   sections_count: number;
+  semantic_status?: string | null;
 }
 
 export interface SearchResult {
@@ -55,6 +56,15 @@ export interface SearchResult {
   matched_term: string;
   context: string;
   highlighted_context: string;
+  page_size?: [number, number];
+  highlights?: [number, number, number, number][];
+  also_in?: DuplicatePage[];
+}
+
+export interface DuplicatePage {
+  document: string;
+  page: number;
+  identical: boolean;
 }
 
 export interface SearchResponse {
@@ -62,6 +72,14 @@ export interface SearchResponse {
   search_terms: string[];
   translated_terms: string[];
   total_matches: number;
+  did_you_mean?: string | null;
+}
+
+export interface Suggestion {
+  text: string;
+  count: number;
+  kind: 'term' | 'phrase' | 'french';
+  translations?: string;
 }
 
 export interface DocumentsResponse {
@@ -79,14 +97,21 @@ export const documentsApi = {
     documents: string[],
     language: string
   ): Promise<SearchResponse> => {
-    const response = await api.post<SearchResponse>('/search', {
-      query,
-      documents,
-      language,
+    // GET lets the browser cache revalidate repeated searches with ETags (304, no body)
+    const response = await api.get<SearchResponse>('/search', {
+      params: { query, documents, language },
+      paramsSerializer: { indexes: null },
     });
     return response.data;
   },
 
+  suggest: async (q: string): Promise<Suggestion[]> => {
+    const response = await api.get<{ query: string; suggestions: Suggestion[] }>('/suggest', {
+      params: { q },
+    });
+    return response.data.suggestions;
+  },
+
   healthCheck: async (): Promise<{ status: string; documents_indexed: number }> => {
     const response = await api.get('/health');
     return response.data;